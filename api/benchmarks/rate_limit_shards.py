@@ -0,0 +1,104 @@
+"""
+Throughput of rate limit checks as the state is sharded over more Redis instances.
+
+Starts the redis-server processes itself, on ports from --port onwards:
+    python -m benchmarks.rate_limit_shards --shards 1 2 4 --requests 50000
+"""
+import argparse
+import asyncio
+from multiprocessing import Pool
+import os
+import shutil
+import subprocess
+import time
+import uuid
+import redis
+from redis.asyncio import Redis
+from src.services.rate_limit.algorithms import GCRAAlgorithm
+from src.services.rate_limit.scripts import load_scripts
+from src.services.storage.sharding import RateLimitRedis, tagged
+
+
+def start_servers(binary: str, ports: list[int]) -> list[subprocess.Popen]:
+    servers = [
+        subprocess.Popen(
+            [binary, "--port", str(port), "--save", "", "--appendonly", "no"],
+            stdout=subprocess.DEVNULL,
+        )
+        for port in ports
+    ]
+    # Wait until every server answers
+    for port in ports:
+        client = redis.Redis(port=port)
+        for _ in range(100):
+            try:
+                client.ping()
+                break
+            except redis.ConnectionError:
+                time.sleep(0.05)
+        client.close()
+    return servers
+
+
+async def run_checks(ports: list[int], requests: int, concurrency: int, clients: int) -> None:
+    store = RateLimitRedis([Redis(port=port) for port in ports], "sharded")
+    algorithm = GCRAAlgorithm()
+    keys = [f"rate_limit:bench:{tagged(f'client_ip={uuid.uuid4().hex}')}" for _ in range(clients)]
+    remaining = iter(range(requests))
+
+    async def worker() -> None:
+        for index in remaining:
+            key = keys[index % len(keys)]
+            await algorithm.check(store.client_for(key), key, limit=1_000_000, window=60)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    for client in store.clients:
+        await client.aclose()
+
+
+def run_process(arguments: tuple[list[int], int, int, int]) -> None:
+    asyncio.run(run_checks(*arguments))
+
+
+async def prepare(ports: list[int]) -> None:
+    for port in ports:
+        client = Redis(port=port)
+        await client.flushdb()
+        await load_scripts(client)
+        await client.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=50_000)
+    parser.add_argument("--concurrency", type=int, default=64, help="In flight checks per process")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--clients", type=int, default=10_000, help="Distinct rate limit keys")
+    parser.add_argument("--port", type=int, default=7400)
+    parser.add_argument("--redis-server", default=shutil.which("redis-server") or "redis-server")
+    args = parser.parse_args()
+
+    ports = [args.port + index for index in range(max(args.shards))]
+    servers = start_servers(args.redis_server, ports)
+    try:
+        print(f"{'shards':>6} {'checks/s':>10} {'speedup':>8}")
+        baseline = None
+        for shards in args.shards:
+            asyncio.run(prepare(ports[:shards]))
+            share = args.requests // args.processes
+            with Pool(args.processes) as pool:
+                started = time.perf_counter()
+                pool.map(run_process, [(ports[:shards], share, args.concurrency, args.clients)] * args.processes)
+                elapsed = time.perf_counter() - started
+            throughput = share * args.processes / elapsed
+            baseline = baseline or throughput
+            print(f"{shards:>6} {throughput:>10.0f} {throughput / baseline:>7.2f}x")
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
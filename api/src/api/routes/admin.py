@@ -2,19 +2,37 @@ from logging import Logger
 from fastapi import APIRouter, Depends, HTTPException, Response
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from starlette.concurrency import run_in_threadpool
 from redis.asyncio import Redis
 from src.services.auth.middleware import protected_route, verify_basic_auth
+from src.services.cache.store import ResponseCache, get_response_cache
+from src.services.gateway.config_service import get_route_table
+from src.services.gateway.config_sync import publish_config_change
 from src.services.gateway.rules import url_rewrite
 from src.services.logging.logging import get_logger
+from src.services.proxy.pool import UpstreamClientPool, get_upstream_pool
+from src.services.rate_limit.blocked import BlockedClients, get_blocked_clients
+from src.services.rate_limit.concurrency import ConcurrencyLimiter, get_concurrency_limiter
+from src.services.rate_limit.hybrid import QuotaLeases, get_quota_leases
+from src.services.rate_limit.keys import namespace_pattern
+from src.services.rate_limit.sweeper import RateLimitSweeper, get_rate_limit_sweeper
+from src.services.request_tracking import prometheus
+from src.services.request_tracking.aggregation import RedisMetricsAggregator, get_metrics_aggregator, to_aggregated
+from src.services.request_tracking.loop_monitor import EventLoopMonitor, get_loop_monitor
 from src.services.request_tracking.middleware import RequestTracker
+from src.services.request_tracking.shared_memory import SharedMetrics, get_shared_metrics
 from src.services.storage.Redis import get_redis
+from src.services.storage.breaker import RedisBreakers, get_redis_breakers
+from src.services.storage.sharding import RateLimitRedis, get_rate_limit_redis
 from src.settings import Settings, get_settings
 from src.database.base import get_db
 from src.database.models import GatewayConfig
 import base64
 from datetime import datetime
+import time
 from src.types.forwarding_rules import RouteForwardingConfig, RouteForwardingResponse, UpdateRouteForwardingRequest
-from src.types.request_tracking import RequestTrackingResponse
+from src.types.request_tracking import RequestTrackingResponse, TimeSeriesResponse
+from src.types.upstream import RouteUpstreams, UpstreamPoolResponse, UpstreamStats, UpstreamsResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(prefix="/admin")
@@ -104,12 +122,7 @@ async def get_routes(
     try:
         configs = await GatewayConfig.get_all_active_configs(db)
         routes = {
-            config.route_prefix: RouteForwardingConfig(
-                id=config.id,
-                target_url=config.target_url,
-                rate_limit=config.rate_limit,
-                url_rewrite=config.url_rewrite,
-            )
+            config.route_prefix: RouteForwardingConfig.model_validate(config, from_attributes=True)
             for config in configs
         }
         return RouteForwardingResponse(routes=routes)
@@ -123,12 +136,25 @@ async def get_routes(
 async def clear_cache(
     settings: Settings = Depends(get_settings),
     logger = Depends(get_logger),
-    redis: Redis | None = Depends(get_redis)
+    redis: Redis | None = Depends(get_redis),
+    cache: ResponseCache | None = Depends(get_response_cache),
+    leases: QuotaLeases | None = Depends(get_quota_leases),
+    blocked: BlockedClients | None = Depends(get_blocked_clients),
+    rate_limit_redis: RateLimitRedis | None = Depends(get_rate_limit_redis)
 ):
     """Clear the Redis database"""
     try:
+        if cache:
+            cache.clear_local()
+        if leases is not None:
+            leases.clear()
+        if blocked is not None:
+            blocked.clear()
         if redis:
             await redis.flushdb()
+            if rate_limit_redis and rate_limit_redis.mode != "default":
+                for client in rate_limit_redis.clients:
+                    await client.flushdb()
             logger.info("Successfully cleared all keys from Redis database")
             return {"status": "success", "message": "Redis database flushed"}
         else:
@@ -144,11 +170,29 @@ async def clear_cache(
 
 @router.get("/metrics", response_model=RequestTrackingResponse)
 @protected_route()
-async def get_metrics(logger: Logger = Depends(get_logger)):
+async def get_metrics(
+    cluster: bool = False,
+    logger: Logger = Depends(get_logger),
+    cache: ResponseCache | None = Depends(get_response_cache),
+    shared: SharedMetrics | None = Depends(get_shared_metrics),
+    aggregator: RedisMetricsAggregator | None = Depends(get_metrics_aggregator)
+):
+    """
+    Metrics of the worker answering. `host` sums the gateway routes of all the workers of the host
+    when they share memory, `cluster=true` adds those of every worker publishing to Redis.
+    """
     logger.debug("Handling GET request to /admin/metrics endpoint")
+    if cluster and not aggregator:
+        raise HTTPException(status_code=400, detail="Metrics aggregation through Redis is not enabled")
     try:
         tracker = RequestTracker(logger)
         metrics = await tracker.get_metrics()
+        if cache:
+            metrics.cache = cache.stats()
+        if shared:
+            metrics.host = to_aggregated(*shared.read())
+        if cluster and aggregator:
+            metrics.cluster = await aggregator.read()
         return metrics
     except HTTPException as he:
         logger.error(f"HTTP error retrieving metrics: {str(he)}", exc_info=True)
@@ -157,13 +201,116 @@ async def get_metrics(logger: Logger = Depends(get_logger)):
         logger.error(f"Unexpected error retrieving metrics: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to retrieve metrics: {str(e)}")
 
+@router.get("/metrics/timeseries", response_model=TimeSeriesResponse)
+@protected_route()
+async def get_metrics_timeseries(
+    start: float | None = None,
+    end: float | None = None,
+    resolution: int | None = None,
+    route: str | None = None,
+    logger: Logger = Depends(get_logger)
+):
+    """
+    Requests, errors, 429s and mean latency of the routes over time, from per-second and per-minute rollups.
+    `start` and `end` are unix seconds, the last hour by default; `resolution` (seconds) is coarsened
+    for long ranges, the per-second rollups hold the last hour and the per-minute ones the last day.
+    The range is clipped to what they hold.
+    """
+    now = time.time()
+    end = end if end is not None else now
+    start = start if start is not None else end - 3600
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if start > now:
+        raise HTTPException(status_code=400, detail="start must not be in the future")
+    if resolution is not None and resolution < 1:
+        raise HTTPException(status_code=400, detail="resolution must be at least 1 second")
+    try:
+        return RequestTracker(logger).get_timeseries(start, end, resolution, route)
+    except Exception as e:
+        logger.error(f"Error retrieving metrics time series: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/metrics/prometheus")
+@protected_route()
+async def get_metrics_prometheus(
+    logger: Logger = Depends(get_logger),
+    pool: UpstreamClientPool | None = Depends(get_upstream_pool),
+    breakers: RedisBreakers | None = Depends(get_redis_breakers),
+    loop_monitor: EventLoopMonitor | None = Depends(get_loop_monitor),
+    concurrency: ConcurrencyLimiter | None = Depends(get_concurrency_limiter),
+    shared: SharedMetrics | None = Depends(get_shared_metrics)
+):
+    """
+    Gateway metrics in the Prometheus text format: requests, latencies, rate limit decisions,
+    Redis and database calls, upstreams and event loop lag, plus the host-wide route totals when the workers
+    share memory. The values are copied on the event loop,
+    the text is formatted in a worker thread.
+    """
+    try:
+        families = prometheus.snapshot(
+            RequestTracker(logger), get_route_table().routes, pool, breakers, loop_monitor, concurrency, shared
+        )
+        body = await run_in_threadpool(prometheus.render, families)
+        return Response(content=body, media_type=prometheus.CONTENT_TYPE)
+    except Exception as e:
+        logger.error(f"Error rendering Prometheus metrics: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/upstreams", response_model=UpstreamsResponse)
+@protected_route()
+async def get_upstreams(logger: Logger = Depends(get_logger)):
+    """Get the live load-balancing and circuit breaker state of every upstream, per route"""
+    try:
+        routes = {
+            prefix: RouteUpstreams(
+                load_balancer=route.balancer.policy,
+                upstreams=[
+                    UpstreamStats(
+                        url=upstream.url,
+                        weight=upstream.weight,
+                        outstanding=upstream.outstanding,
+                        requests=upstream.requests,
+                        errors=upstream.errors,
+                        ewma_latency_ms=upstream.ewma_latency * 1000,
+                        state=upstream.state,
+                        consecutive_failures=upstream.consecutive_failures,
+                        ejections=upstream.ejections,
+                        concurrency_limit=upstream.adaptive.current if upstream.adaptive else None,
+                        shed=upstream.shed,
+                    )
+                    for upstream in route.balancer.upstreams
+                ]
+            )
+            for prefix, route in get_route_table().routes.items()
+            if route.balancer
+        }
+        return UpstreamsResponse(routes=routes)
+    except Exception as e:
+        logger.error(f"Error retrieving upstream stats: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/upstreams/pool", response_model=UpstreamPoolResponse)
+@protected_route()
+async def get_upstream_pool_stats(
+    logger: Logger = Depends(get_logger),
+    pool: UpstreamClientPool | None = Depends(get_upstream_pool)
+):
+    """Get idle/active/waiting connection counts of the upstream client pools"""
+    try:
+        return UpstreamPoolResponse(upstreams=pool.stats() if pool else {})
+    except Exception as e:
+        logger.error(f"Error retrieving upstream pool stats: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.put("/routes")
 @protected_route()
 async def update_routes(
     request: UpdateRouteForwardingRequest,
     db: AsyncSession = Depends(get_db),
     logger: Logger = Depends(get_logger),
-    redis: Redis | None = Depends(get_redis)
+    redis: Redis | None = Depends(get_redis),
+    sweeper: RateLimitSweeper | None = Depends(get_rate_limit_sweeper)
 ):
     """Update the route forwarding configuration in database"""
     try:
@@ -171,41 +318,36 @@ async def update_routes(
         existing_configs = await GatewayConfig.get_all_active_configs(db)
         existing_prefixes = {config.route_prefix for config in existing_configs}
         new_prefixes = set(request.routes.keys())
+        # Limits of the saved routes start over under a new generation, the old keys expire with their window
+        stale: list[tuple[str, int]] = []
 
         # Delete configs that are no longer present
         for prefix in existing_prefixes - new_prefixes:
-            await GatewayConfig.delete_config(db, prefix)
+            deleted = await GatewayConfig.delete_config(db, prefix)
+            if deleted:
+                stale.append((prefix, deleted.rate_limit_generation - 1))
 
         # Update or create new configs
         for prefix, config in request.routes.items():
+            route_fields = config.model_dump(exclude={"id"})
             # Check if config exists
             existing_config = await GatewayConfig.get_config_by_prefix(db, prefix)
             
             if existing_config:
                 # Update existing config
-                await GatewayConfig.update_config(
-                    db,
-                    prefix,
-                    target_url=config.target_url,
-                    rate_limit=config.rate_limit,
-                    url_rewrite=config.url_rewrite
-                )
+                generation = existing_config.rate_limit_generation
+                stale.append((prefix, generation))
+                await GatewayConfig.update_config(db, prefix, rate_limit_generation=generation + 1, **route_fields)
             else:
                 # Create new config
-                await GatewayConfig.create_config(
-                    db,
-                    route_prefix=prefix,
-                    target_url=config.target_url,
-                    rate_limit=config.rate_limit,
-                    url_rewrite=config.url_rewrite
-                )
-
-        # Clear rate limiting cache if Redis is available
-        if redis:
-            # Clear only rate limit keys
-            async for key in redis.scan_iter(match="rate_limit:*"):
-                await redis.delete(key)
-            logger.info("Cleared rate limiting cache after route update")
+                await GatewayConfig.create_config(db, route_prefix=prefix, **route_fields)
+
+        # Swap in the new route table here and on every other worker
+        await publish_config_change(redis, logger)
+
+        if sweeper:
+            for prefix, generation in stale:
+                sweeper.schedule(namespace_pattern(prefix, generation))
 
         # Return the updated configuration
         return await get_routes(db, logger)
@@ -219,7 +361,8 @@ async def delete_route(
     config_id: int,
     db: AsyncSession = Depends(get_db),
     logger: Logger = Depends(get_logger),
-    redis: Redis | None = Depends(get_redis)
+    redis: Redis | None = Depends(get_redis),
+    sweeper: RateLimitSweeper | None = Depends(get_rate_limit_sweeper)
 ):
     """Delete a route configuration from database"""
     try:
@@ -228,15 +371,15 @@ async def delete_route(
         if not config:
             raise HTTPException(status_code=404, detail=f"Route with ID {config_id} not found")
 
-        # Delete the route configuration
+        # Delete the route configuration, its limits start over if it is created again
+        generation = config.rate_limit_generation
         config.is_active = False
+        config.rate_limit_generation = generation + 1
         await db.commit()
+        await publish_config_change(redis, logger)
 
-        # Clear rate limiting cache for this route if Redis is available
-        if redis:
-            async for key in redis.scan_iter(match=f"rate_limit:{config.route_prefix}*"):
-                await redis.delete(key)
-            logger.info(f"Cleared rate limiting cache for route {config.route_prefix}")
+        if sweeper:
+            sweeper.schedule(namespace_pattern(config.route_prefix, generation))
 
         return {"status": "success", "message": f"Route {config.route_prefix} deleted successfully"}
     except HTTPException:
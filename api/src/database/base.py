@@ -1,15 +1,19 @@
 import logging
 from logging import Logger
+import time
 from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from typing import Any
 from src.settings import Settings
 from src.database.models.base import Base, metadata
+from src.services.request_tracking.histogram import LatencyHistogram
 
 # Global variables that will be set during initialization
 async_engine = None
 AsyncSessionLocal = None
 logging_adapter = None
+# Time of every statement sent to the database, across engines
+query_latency = LatencyHistogram()
 
 def configure_sqlalchemy_logging(logger: Logger):
     """
@@ -52,6 +56,22 @@ def configure_sqlalchemy_logging(logger: Logger):
     
     return adapter
 
+def instrument_query_latency(engine) -> None:
+    """Record the duration of the statements of `engine` in `query_latency`"""
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        query_latency.record(time.perf_counter() - conn.info["query_started"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def drop_timer(exception_context):
+        started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+        if started:
+            query_latency.record(time.perf_counter() - started.pop())
+
 def get_async_database_url(settings: Settings) -> str:
     """
     Construct async database URL based on settings.
@@ -116,6 +136,8 @@ async def init_db(settings: Settings, logger: Logger) -> tuple[Any, Any, Any]:
     sqlalchemy_logger.setLevel(log_level)
     aiosqlite_logger.setLevel(log_level)
     
+    instrument_query_latency(async_engine.sync_engine)
+
     if settings.DB_ECHO and async_engine:
         @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
         def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
@@ -15,6 +15,20 @@ class GatewayConfig(Base):
     target_url: Mapped[str] = mapped_column(String, nullable=False)
     rate_limit: Mapped[int] = mapped_column(Integer, nullable=False, default=60)
     url_rewrite: Mapped[Any] = mapped_column(JSON, nullable=False, default={})
+    rate_limit_algorithm: Mapped[str | None] = mapped_column(String, nullable=True, default=None)
+    rate_limit_hybrid: Mapped[Any] = mapped_column(JSON, nullable=False, default={})
+    rate_limits: Mapped[Any] = mapped_column(JSON, nullable=False, default=[])
+    rate_limit_failure_mode: Mapped[str] = mapped_column(String, nullable=False, default="local")
+    rate_limit_generation: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    concurrency: Mapped[Any] = mapped_column(JSON, nullable=False, default={})
+    adaptive_concurrency: Mapped[Any] = mapped_column(JSON, nullable=False, default={})
+    max_body_size: Mapped[int | None] = mapped_column(Integer, nullable=True, default=None)
+    buffer_body: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+    upstreams: Mapped[Any] = mapped_column(JSON, nullable=False, default=[])
+    load_balancer: Mapped[str] = mapped_column(String, nullable=False, default="round_robin")
+    health_check: Mapped[Any] = mapped_column(JSON, nullable=False, default={})
+    cache: Mapped[Any] = mapped_column(JSON, nullable=False, default={})
+    coalesce: Mapped[Any] = mapped_column(JSON, nullable=False, default={})
     is_active: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
 
     @classmethod
@@ -51,9 +65,13 @@ class GatewayConfig(Base):
         route_prefix: str,
         target_url: str, 
         rate_limit: int = 60,
-        url_rewrite: dict[str, str] | None = None
+        url_rewrite: dict[str, str] | None = None,
+        **options: Any
     ):
-        """Create a new gateway configuration or reactivate a soft deleted one"""
+        """
+        Create a new gateway configuration or reactivate a soft deleted one
+        `options` sets the remaining route columns (body limits, ...)
+        """
         # Check for existing config including soft deleted ones
         query = select(cls).where(cls.route_prefix == route_prefix)
         result = await db.execute(query)
@@ -65,6 +83,9 @@ class GatewayConfig(Base):
                 existing_config.target_url = target_url
                 existing_config.rate_limit = rate_limit
                 existing_config.url_rewrite = url_rewrite or {}
+                for key, value in options.items():
+                    if hasattr(existing_config, key):
+                        setattr(existing_config, key, value)
                 existing_config.is_active = True
                 await db.commit()
                 await db.refresh(existing_config)
@@ -78,7 +99,8 @@ class GatewayConfig(Base):
             route_prefix=route_prefix,
             target_url=target_url,
             rate_limit=rate_limit,
-            url_rewrite=url_rewrite or {}
+            url_rewrite=url_rewrite or {},
+            **{key: value for key, value in options.items() if hasattr(cls, key)}
         )
         db.add(config)
         await db.commit()
@@ -103,5 +125,7 @@ class GatewayConfig(Base):
         config = await cls.get_config_by_prefix(db, route_prefix)
         if config:
             config.is_active = False
+            # A route created again under the same prefix starts its limits over
+            config.rate_limit_generation += 1
             await db.commit()
         return config 
@@ -4,10 +4,27 @@ from fastapi import FastAPI
 
 from src.database.base import init_db
 from src.services.auth.middleware import setup_auth_middleware
+from src.services.cache.store import ResponseCache
+from src.services.gateway.config_service import load_route_table
+from src.services.gateway.config_sync import ConfigSyncWorker
 from src.services.gateway.middleware import setup_gateway
 from src.services.logging.middleware import setup_error_reporting
-from src.services.request_tracking.middleware import setup_request_tracking
+from src.services.proxy.coalesce import RequestCoalescer
+from src.services.proxy.health import HealthChecker
+from src.services.proxy.pool import UpstreamClientPool
+from src.services.rate_limit.blocked import BlockedClients
+from src.services.rate_limit.concurrency import ConcurrencyLimiter
+from src.services.rate_limit.hybrid import QuotaLeases
+from src.services.rate_limit.local import LocalRateLimiter
+from src.services.rate_limit.scripts import load_scripts
+from src.services.rate_limit.sweeper import RateLimitSweeper
+from src.services.request_tracking.aggregation import RedisMetricsAggregator
+from src.services.request_tracking.loop_monitor import EventLoopMonitor
+from src.services.request_tracking.middleware import RequestTracker, setup_request_tracking
+from src.services.request_tracking.shared_memory import SharedMetrics, SharedMetricsUnavailable
 from src.services.storage.Redis import close_redis, init_redis
+from src.services.storage.breaker import RedisBreakers
+from src.services.storage.sharding import init_rate_limit_redis
 from src.services.logging.logging import setup_logging
 from src.services.cors.middleware import setup_cors_middleware
 from src.api.routes.admin import router as admin_router
@@ -28,12 +45,82 @@ async def lifespan(app: FastAPI):
     app.state.db_engine = db_engine
     app.state.db_session = db_session
     app.state.redis = redis
+    if redis:
+        await load_scripts(redis)
+        config_sync = ConfigSyncWorker(redis, settings, logger)
+        await config_sync.start()
+    else:
+        config_sync = None
+        await load_route_table(logger)
+    app.state.config_sync = config_sync
+    app.state.rate_limit_redis = await init_rate_limit_redis(settings, redis, logger)
+    if app.state.rate_limit_redis and app.state.rate_limit_redis.mode != "default":
+        for client in app.state.rate_limit_redis.clients:
+            await load_scripts(client)
+    app.state.upstream_pool = UpstreamClientPool(settings, logger)
+    app.state.response_cache = ResponseCache(redis, settings, logger)
+    app.state.request_coalescer = RequestCoalescer(logger)
+    app.state.quota_leases = QuotaLeases(logger, settings.RATE_LIMIT_HYBRID_MAX_KEYS)
+    app.state.blocked_clients = BlockedClients(settings.RATE_LIMIT_BLOCKED_MAX_KEYS)
+    app.state.redis_breakers = (
+        RedisBreakers(app.state.rate_limit_redis.clients, settings, logger) if app.state.rate_limit_redis else None
+    )
+    app.state.local_rate_limiter = LocalRateLimiter(settings.RATE_LIMIT_FALLBACK_MAX_KEYS)
+    app.state.concurrency_limiter = ConcurrencyLimiter(logger, app.state.rate_limit_redis, app.state.redis_breakers)
+    app.state.rate_limit_sweeper = (
+        RateLimitSweeper(app.state.rate_limit_redis, logger, settings.RATE_LIMIT_SWEEP_BATCH_SIZE)
+        if app.state.rate_limit_redis and settings.RATE_LIMIT_SWEEP_STALE_KEYS else None
+    )
+    app.state.health_checker = HealthChecker(app.state.upstream_pool, logger)
+    await app.state.health_checker.start()
+    app.state.loop_monitor = EventLoopMonitor(logger, settings.EVENT_LOOP_MONITOR_INTERVAL_SECONDS)
+    await app.state.loop_monitor.start()
+    tracker = RequestTracker(logger)
+    app.state.shared_metrics = None
+    if settings.METRICS_SHARED_MEMORY_PATH:
+        try:
+            app.state.shared_metrics = SharedMetrics(
+                settings.METRICS_SHARED_MEMORY_PATH,
+                settings.METRICS_SHARED_MAX_WORKERS,
+                settings.METRICS_SHARED_MAX_ROUTES,
+                logger
+            )
+            logger.info(f"Sharing route metrics through {settings.METRICS_SHARED_MEMORY_PATH} as worker {app.state.shared_metrics.worker}")
+        except (OSError, SharedMetricsUnavailable) as e:
+            logger.error(f"Shared memory metrics disabled: {str(e)}")
+    tracker.shared = app.state.shared_metrics
+    app.state.metrics_aggregator = (
+        RedisMetricsAggregator(redis, tracker.route_totals, logger, settings.METRICS_REDIS_PUBLISH_SECONDS)
+        if redis and settings.METRICS_REDIS_AGGREGATION else None
+    )
+    if app.state.metrics_aggregator:
+        await app.state.metrics_aggregator.start()
     logger.info("Application startup complete")
     
     yield
     
     # --- SHUTDOWN ---
     logger.info("Shutting down application")
+    if app.state.config_sync:
+        await app.state.config_sync.stop()
+    await app.state.health_checker.stop()
+    await app.state.loop_monitor.stop()
+    if app.state.metrics_aggregator:
+        await app.state.metrics_aggregator.stop()
+    if app.state.shared_metrics:
+        RequestTracker(logger).shared = None
+        app.state.shared_metrics.close()
+    await app.state.request_coalescer.close()
+    await app.state.gateway.close()
+    await app.state.quota_leases.close()
+    if app.state.redis_breakers:
+        await app.state.redis_breakers.close()
+    if app.state.rate_limit_sweeper:
+        await app.state.rate_limit_sweeper.close()
+    if app.state.rate_limit_redis:
+        await app.state.rate_limit_redis.close()
+    await app.state.upstream_pool.close()
+    logger.info("Upstream connection pools closed")
     await close_redis(app.state.redis)
     logger.info("Redis connection closed")
 
@@ -0,0 +1,121 @@
+from collections.abc import Mapping
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, final
+
+# Statuses a shared cache may store without explicit permission (RFC 9111 3, RFC 9110 15.1)
+CACHEABLE_STATUSES = frozenset({200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501})
+# Request headers identifying the client, a response to them is never shared with another one
+CREDENTIAL_HEADERS = ("authorization", "cookie", "proxy-authorization")
+
+
+@final
+@dataclass(frozen=True, slots=True)
+class CachePolicy:
+    """Per-route response cache settings, directives sent by the upstream take precedence"""
+    default_ttl: float = 0.0                # Freshness when the upstream gives none, 0 to only cache explicit lifetimes
+    stale_while_revalidate: float = 0.0     # Serve stale while refreshing in the background
+    stale_if_error: float = 0.0             # Serve stale when the upstream fails
+    max_object_size: int | None = None      # Bytes, defaults to RESPONSE_CACHE_MAX_OBJECT_BYTES
+
+    @classmethod
+    def from_options(cls, options: Mapping[str, Any] | None) -> "CachePolicy | None":
+        """Build the policy of a route from its stored `cache` column, None when caching is off"""
+        if not options or not options.get("enabled"):
+            return None
+        return cls(**{key: value for key, value in options.items() if key != "enabled"})
+
+
+@final
+@dataclass(frozen=True, slots=True)
+class CacheLifetime:
+    """Seconds a stored response stays fresh, then usable while revalidating or on upstream errors"""
+    ttl: float
+    stale_while_revalidate: float
+    stale_if_error: float
+
+    @property
+    def retention(self) -> float:
+        """How long the entry is worth keeping at all"""
+        return self.ttl + max(self.stale_while_revalidate, self.stale_if_error)
+
+
+def parse_cache_control(value: str | None) -> dict[str, str | None]:
+    """Cache-Control directives, lowercased, with their unquoted argument if any"""
+    directives: dict[str, str | None] = {}
+    if not value:
+        return directives
+    for part in value.split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip().strip('"') if argument else None
+    return directives
+
+
+def _seconds(directives: Mapping[str, str | None], name: str) -> float | None:
+    value = directives.get(name)
+    if value is None or not value.isdigit():
+        return None
+    return float(value)
+
+
+def _http_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def request_bypasses_cache(headers: Mapping[str, str]) -> bool:
+    """Requests carrying credentials or asking not to store are never served from the shared cache"""
+    if any(name in headers for name in CREDENTIAL_HEADERS):
+        return True
+    return "no-store" in parse_cache_control(headers.get("cache-control"))
+
+
+def request_requires_revalidation(headers: Mapping[str, str]) -> bool:
+    directives = parse_cache_control(headers.get("cache-control"))
+    return "no-cache" in directives or directives.get("max-age") == "0" or headers.get("pragma") == "no-cache"
+
+
+def response_lifetime(status_code: int, headers: Mapping[str, str], policy: CachePolicy, now: float) -> CacheLifetime | None:
+    """How long a shared cache may keep this response, None when it must not be stored"""
+    if status_code not in CACHEABLE_STATUSES:
+        return None
+    if headers.get("vary", "").strip() == "*" or "set-cookie" in headers:
+        return None
+    directives = parse_cache_control(headers.get("cache-control"))
+    if "no-store" in directives or "private" in directives:
+        return None
+
+    ttl = _seconds(directives, "s-maxage")
+    if ttl is None:
+        ttl = _seconds(directives, "max-age")
+    if ttl is None and "expires" in headers:
+        expires = _http_date(headers.get("expires"))
+        date = _http_date(headers.get("date")) or now
+        # An invalid Expires means already expired (RFC 9111 5.3)
+        ttl = max(expires - date, 0.0) if expires is not None else 0.0
+    if ttl is None:
+        ttl = policy.default_ttl
+    age = headers.get("age", "")
+    ttl = max(ttl - (float(age) if age.isdigit() else 0.0), 0.0)
+    if "no-cache" in directives:
+        ttl = 0.0
+
+    stale_while_revalidate = _seconds(directives, "stale-while-revalidate")
+    stale_if_error = _seconds(directives, "stale-if-error")
+    # Serving stale is forbidden once the upstream asked for revalidation
+    if "must-revalidate" in directives or "proxy-revalidate" in directives:
+        stale_while_revalidate = stale_if_error = 0.0
+    lifetime = CacheLifetime(
+        ttl=ttl,
+        stale_while_revalidate=policy.stale_while_revalidate if stale_while_revalidate is None else stale_while_revalidate,
+        stale_if_error=policy.stale_if_error if stale_if_error is None else stale_if_error,
+    )
+    has_validator = "etag" in headers or "last-modified" in headers
+    if lifetime.retention <= 0 and not has_validator:
+        return None
+    return lifetime
@@ -0,0 +1,318 @@
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass
+import hashlib
+import json
+from logging import Logger
+import time
+from typing import final
+from fastapi import Request
+from fastapi.responses import Response
+from redis.asyncio import Redis
+from src.services.cache.policy import CacheLifetime
+from src.settings import Settings
+from src.types.cache import CacheStats
+
+CACHE_KEY_PREFIX = "cache:response:"
+VARY_KEY_PREFIX = "cache:vary:"
+# Responses that must be revalidated on every use are still kept this long for their validators
+VALIDATOR_RETENTION_SECONDS = 3600.0
+# Bound on the Vary specs remembered per worker, oldest forgotten first
+MAX_VARY_SPECS = 10_000
+# Headers describing one answer rather than the resource, never stored. The rate limit ones belong
+# to the client that got the response, the cache rule sets the current client's on every hit.
+UNSTORED_HEADERS = frozenset({
+    "age",
+    "x-cache",
+    "x-ratelimit-limit",
+    "x-ratelimit-remaining",
+    "x-ratelimit-reset",
+    "ratelimit",
+    "ratelimit-policy",
+})
+
+
+@final
+@dataclass(slots=True)
+class CachedResponse:
+    """A stored upstream response with its freshness timeline, times are epoch seconds"""
+    status_code: int
+    headers: list[tuple[str, str]]
+    body: bytes
+    stored_at: float
+    fresh_until: float
+    stale_while_revalidate_until: float
+    stale_if_error_until: float
+    vary: tuple[str, ...] = ()
+
+    @classmethod
+    def create(
+        cls,
+        status_code: int,
+        headers: Mapping[str, str],
+        body: bytes,
+        lifetime: CacheLifetime,
+        now: float
+    ) -> "CachedResponse":
+        vary = tuple(sorted({name.strip().lower() for name in headers.get("vary", "").split(",") if name.strip()}))
+        fresh_until = now + lifetime.ttl
+        return cls(
+            status_code=status_code,
+            headers=[(key, value) for key, value in headers.items() if key.lower() not in UNSTORED_HEADERS],
+            body=body,
+            stored_at=now,
+            fresh_until=fresh_until,
+            stale_while_revalidate_until=fresh_until + lifetime.stale_while_revalidate,
+            stale_if_error_until=fresh_until + lifetime.stale_if_error,
+            vary=vary,
+        )
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(key) + len(value) for key, value in self.headers)
+
+    @property
+    def keep_until(self) -> float:
+        """Past this point the entry is useless, drives the Redis TTL"""
+        until = max(self.fresh_until, self.stale_while_revalidate_until, self.stale_if_error_until)
+        if self.header("etag") or self.header("last-modified"):
+            until = max(until, self.stored_at + VALIDATOR_RETENTION_SECONDS)
+        return until
+
+    def header(self, name: str) -> str | None:
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    def validators(self) -> dict[str, str]:
+        """Conditional request headers to revalidate the entry with the upstream"""
+        headers: dict[str, str] = {}
+        if etag := self.header("etag"):
+            headers["if-none-match"] = etag
+        if last_modified := self.header("last-modified"):
+            headers["if-modified-since"] = last_modified
+        return headers
+
+    def refreshed(self, not_modified_headers: Mapping[str, str], lifetime: CacheLifetime, now: float) -> "CachedResponse":
+        """The entry updated with the headers of a 304 answer to its revalidation"""
+        updates = {key.lower(): value for key, value in not_modified_headers.items() if key.lower() != "content-length"}
+        headers = {key: updates.pop(key.lower(), value) for key, value in self.headers}
+        headers.update(updates)
+        return CachedResponse.create(self.status_code, headers, self.body, lifetime, now)
+
+    def to_response(self, cache_status: str, now: float) -> Response:
+        response = Response(content=self.body, status_code=self.status_code)
+        response.raw_headers = [
+            (key.encode("latin-1"), value.encode("latin-1"))
+            for key, value in self.headers
+        ]
+        response.headers["age"] = str(max(int(now - self.stored_at), 0))
+        response.headers["x-cache"] = cache_status
+        return response
+
+    def dumps(self) -> bytes:
+        meta = {
+            "status_code": self.status_code,
+            "headers": self.headers,
+            "stored_at": self.stored_at,
+            "fresh_until": self.fresh_until,
+            "stale_while_revalidate_until": self.stale_while_revalidate_until,
+            "stale_if_error_until": self.stale_if_error_until,
+            "vary": self.vary,
+        }
+        return json.dumps(meta).encode() + b"\n" + self.body
+
+    @classmethod
+    def loads(cls, data: bytes) -> "CachedResponse":
+        meta, _, body = data.partition(b"\n")
+        fields = json.loads(meta)
+        return cls(
+            status_code=fields["status_code"],
+            headers=[(key, value) for key, value in fields["headers"]],
+            body=body,
+            stored_at=fields["stored_at"],
+            fresh_until=fields["fresh_until"],
+            stale_while_revalidate_until=fields["stale_while_revalidate_until"],
+            stale_if_error_until=fields["stale_if_error_until"],
+            vary=tuple(fields["vary"]),
+        )
+
+
+@final
+class LRUCache:
+    """In-process tier, bounded by the total size of the stored entries rather than their count"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> CachedResponse | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: CachedResponse) -> None:
+        self.delete(key)
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+
+@dataclass(slots=True)
+class _Counters:
+    hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    revalidations: int = 0
+    stores: int = 0
+    shared_hits: int = 0
+    errors: int = 0
+
+
+@final
+class ResponseCache:
+    """
+    Two-tier response cache: a byte-bounded LRU in each worker in front of Redis shared by all.
+    Redis failures only cost the shared tier, they never fail the request.
+    """
+    def __init__(self, redis: Redis | None, settings: Settings, logger: Logger):
+        self.redis = redis if settings.RESPONSE_CACHE_SHARED else None
+        self.logger = logger
+        self.max_object_size = settings.RESPONSE_CACHE_MAX_OBJECT_BYTES
+        self.local = LRUCache(settings.RESPONSE_CACHE_MAX_BYTES)
+        self._counters = _Counters()
+        # Vary header names per base key, so a lookup knows which request headers select the variant
+        self._vary: dict[str, tuple[str, ...]] = {}
+
+    @staticmethod
+    def _redis_key(prefix: str, key: str) -> str:
+        return prefix + hashlib.sha256(key.encode()).hexdigest()
+
+    @staticmethod
+    def variant_key(base_key: str, vary: tuple[str, ...], headers: Mapping[str, str]) -> str:
+        if not vary:
+            return base_key
+        return base_key + "|" + "|".join(f"{name}={headers.get(name, '')}" for name in vary)
+
+    async def _get_vary(self, base_key: str) -> tuple[str, ...] | None:
+        vary = self._vary.get(base_key)
+        if vary is not None or not self.redis:
+            return vary
+        try:
+            data = await self.redis.get(self._redis_key(VARY_KEY_PREFIX, base_key))
+        except Exception as e:
+            self._counters.errors += 1
+            self.logger.warning(f"Response cache Redis read failed: {str(e)}")
+            return None
+        if data is None:
+            return None
+        vary = tuple(json.loads(data))
+        self._remember_vary(base_key, vary)
+        return vary
+
+    def _remember_vary(self, base_key: str, vary: tuple[str, ...]) -> None:
+        self._vary.pop(base_key, None)
+        self._vary[base_key] = vary
+        if len(self._vary) > MAX_VARY_SPECS:
+            del self._vary[next(iter(self._vary))]
+
+    async def get(self, base_key: str, headers: Mapping[str, str]) -> CachedResponse | None:
+        """Find the variant of `base_key` matching the request headers, local tier first"""
+        vary = await self._get_vary(base_key)
+        if vary is None:
+            return None
+        key = self.variant_key(base_key, vary, headers)
+        entry = self.local.get(key)
+        if entry is not None or not self.redis:
+            return entry
+        try:
+            data = await self.redis.get(self._redis_key(CACHE_KEY_PREFIX, key))
+        except Exception as e:
+            self._counters.errors += 1
+            self.logger.warning(f"Response cache Redis read failed: {str(e)}")
+            return None
+        if data is None:
+            return None
+        entry = CachedResponse.loads(data)
+        self._counters.shared_hits += 1
+        self.local.set(key, entry)
+        return entry
+
+    async def set(self, base_key: str, headers: Mapping[str, str], entry: CachedResponse) -> None:
+        key = self.variant_key(base_key, entry.vary, headers)
+        self._remember_vary(base_key, entry.vary)
+        self.local.set(key, entry)
+        self._counters.stores += 1
+        if not self.redis:
+            return
+        ttl_ms = int((entry.keep_until - time.time()) * 1000)
+        if ttl_ms <= 0:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                await pipe.set(self._redis_key(VARY_KEY_PREFIX, base_key), json.dumps(entry.vary), px=ttl_ms)
+                await pipe.set(self._redis_key(CACHE_KEY_PREFIX, key), entry.dumps(), px=ttl_ms)
+                await pipe.execute()
+        except Exception as e:
+            self._counters.errors += 1
+            self.logger.warning(f"Response cache Redis write failed: {str(e)}")
+
+    def clear_local(self) -> None:
+        """Drop the in-process tier, e.g. after the shared one was flushed"""
+        self.local.clear()
+        self._vary.clear()
+
+    def record_hit(self, stale: bool = False) -> None:
+        if stale:
+            self._counters.stale_hits += 1
+        else:
+            self._counters.hits += 1
+
+    def record_miss(self) -> None:
+        self._counters.misses += 1
+
+    def record_revalidation(self) -> None:
+        self._counters.revalidations += 1
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self._counters.hits,
+            stale_hits=self._counters.stale_hits,
+            misses=self._counters.misses,
+            revalidations=self._counters.revalidations,
+            stores=self._counters.stores,
+            evictions=self.local.evictions,
+            shared_hits=self._counters.shared_hits,
+            errors=self._counters.errors,
+            entries=len(self.local),
+            size_bytes=self.local.size,
+            max_bytes=self.local.max_bytes,
+        )
+
+
+async def get_response_cache(request: Request) -> ResponseCache | None:
+    """
+    Dependency that provides the response cache from app state.
+    Ex: cache: ResponseCache | None = Depends(get_response_cache)
+    """
+    return getattr(request.app.state, "response_cache", None)
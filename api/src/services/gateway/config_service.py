@@ -1,16 +1,31 @@
+from logging import Logger
 from src.database.base import get_db
 from src.database.models import GatewayConfig
+from src.services.gateway.route_table import RouteTable
 
-async def get_route_config(path: str) -> tuple[str, int, dict[str, str]] | None:
-    """Get the target URL and rate limit for a given path"""
+# Current snapshot, replaced as a whole on reload so readers never see a partial table
+_route_table: RouteTable = RouteTable()
+
+
+def get_route_table() -> RouteTable:
+    """Get the in-memory route table currently in use"""
+    return _route_table
+
+
+async def load_route_table(logger: Logger | None = None, version: int = 0) -> RouteTable:
+    """Rebuild the route table from the active configurations and swap it in"""
+    global _route_table
     async for db in get_db():
-        config = await GatewayConfig.get_config_by_prefix(db, path)
-        if config:
-            return config.target_url, config.rate_limit, config.url_rewrite
-        
-        # Try to find a matching prefix
         configs = await GatewayConfig.get_all_active_configs(db)
-        for config in configs:
-            if path.startswith(config.route_prefix):
-                return config.target_url, config.rate_limit, config.url_rewrite
-    return None 
+        _route_table = RouteTable.from_configs(configs, version, _route_table)
+    if logger:
+        logger.info(f"Route table v{version} loaded with {len(_route_table)} routes")
+    return _route_table
+
+
+async def get_route_config(path: str) -> tuple[str, int, dict[str, str]] | None:
+    """Get the target URL and rate limit for a given path"""
+    route = _route_table.resolve(path)
+    if route:
+        return route.target_url, route.rate_limit, route.url_rewrite
+    return None
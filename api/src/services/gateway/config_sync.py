@@ -0,0 +1,92 @@
+import asyncio
+import time
+from logging import Logger
+from typing import final
+from redis.asyncio import Redis
+from src.services.gateway.config_service import get_route_table, load_route_table
+from src.settings import Settings
+
+CONFIG_VERSION_KEY = "gateway:config:version"
+CONFIG_CHANNEL = "gateway:config:updates"
+
+
+async def get_config_version(redis: Redis | None) -> int:
+    """Get the cluster-wide route configuration version"""
+    if not redis:
+        return 0
+    version = await redis.get(CONFIG_VERSION_KEY)
+    return int(version) if version else 0
+
+
+async def publish_config_change(redis: Redis | None, logger: Logger) -> None:
+    """
+    Bump the configuration version, reload the local route table and notify the other workers.
+    Must be called after the change is committed to the database.
+    """
+    if not redis:
+        await load_route_table(logger)
+        return
+
+    version: int = await redis.incr(CONFIG_VERSION_KEY)
+    await load_route_table(logger, version)
+    receivers = await redis.publish(CONFIG_CHANNEL, version)
+    logger.info(f"Published route config v{version} to {receivers} subscribers")
+
+
+@final
+class ConfigSyncWorker:
+    """
+    Keep the local route table in sync with the other workers.
+    Reloads on pub/sub notifications and periodically compares versions to catch missed messages.
+    """
+    def __init__(self, redis: Redis, settings: Settings, logger: Logger):
+        self.redis = redis
+        self.interval = settings.ROUTE_CONFIG_SYNC_INTERVAL_SECONDS
+        self.logger = logger
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        """Load the current snapshot and start listening for changes"""
+        await load_route_table(self.logger, await get_config_version(self.redis))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _reload_if_changed(self, version: int) -> None:
+        if version != get_route_table().version:
+            self.logger.info(f"Route config changed (v{get_route_table().version} -> v{version}), reloading")
+            await load_route_table(self.logger, version)
+
+    async def _listen(self) -> None:
+        pubsub = self.redis.pubsub()
+        try:
+            await pubsub.subscribe(CONFIG_CHANNEL)
+            # Messages published while we were not subscribed are caught by this first check
+            await self._reload_if_changed(await get_config_version(self.redis))
+            last_check = time.monotonic()
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=self.interval)
+                if message and message["type"] == "message":
+                    await self._reload_if_changed(int(message["data"]))
+                if time.monotonic() - last_check >= self.interval:
+                    await self._reload_if_changed(await get_config_version(self.redis))
+                    last_check = time.monotonic()
+        finally:
+            await pubsub.aclose()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Route config sync failed, retrying in {self.interval}s: {str(e)}")
+                await asyncio.sleep(self.interval)
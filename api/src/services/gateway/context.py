@@ -0,0 +1,55 @@
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any, final
+from fastapi import Request
+from src.services.gateway.config_service import get_route_table
+from src.services.gateway.route_table import CompiledRoute
+
+
+@final
+@dataclass(slots=True)
+class RouteContext:
+    """Route resolved once per request and handed to every rule"""
+    route: CompiledRoute
+    prefix: str
+    target_url: str
+    rate_limit: int
+    url_rewrite: dict[str, str]
+    # Per-request scratch space shared between the pre and post phases of the rules
+    state: dict[str, Any] = field(default_factory=dict)
+    # Headers rules add to the upstream request, on top of the client ones
+    upstream_headers: dict[str, str] = field(default_factory=dict)
+    # Called once the response is sent or the client went away, whatever the outcome of the request
+    finalizers: list[Callable[[], Awaitable[None]]] = field(default_factory=list)
+
+    @classmethod
+    def from_route(cls, route: CompiledRoute) -> "RouteContext":
+        return cls(
+            route=route,
+            prefix=route.prefix,
+            target_url=route.target_url,
+            rate_limit=route.rate_limit,
+            url_rewrite=route.url_rewrite,
+        )
+
+    async def finalize(self) -> None:
+        """Run the finalizers, only the first call does"""
+        finalizers, self.finalizers = self.finalizers, []
+        for finalizer in finalizers:
+            await finalizer()
+
+
+def resolve_route_context(request: Request) -> RouteContext | None:
+    """
+    Get the context attached by the gateway middleware,
+    or resolve it from the route table when a rule is called on its own
+    """
+    context: RouteContext | None = getattr(request.state, "route_context", None)
+    if context is not None:
+        return context
+    route = get_route_table().resolve(request.url.path)
+    if route is None:
+        return None
+    context = RouteContext.from_route(route)
+    request.state.route_context = context
+    return context
@@ -1,12 +1,27 @@
+import asyncio
 from logging import Logger
+import math
+import time
 from typing import final
-from fastapi import FastAPI, Request,  HTTPException
-from src.services.gateway.config_service import get_route_config
+import anyio
+from fastapi import FastAPI, Request, Response, HTTPException
+import httpx
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.types import Receive, Scope, Send
+from src.services.gateway.config_service import get_route_table
+from src.services.gateway.context import RouteContext
+from src.services.gateway.route_table import CompiledRoute
 from src.services.gateway.rules.asbtract import Rule, RulePhase
+from src.services.gateway.rules.cache import CacheRule
+from src.services.gateway.rules.concurrency import ConcurrencyRule
 from src.services.gateway.rules.rate_limiter import RateLimitRule
 from src.services.gateway.rules.url_rewrite import UrlRewriteRule
 from src.settings import Settings
-from src.services.proxy.service import forward_request
+from src.services.proxy.balancer import NoHealthyUpstream
+from src.services.proxy.coalesce import RequestCoalescer, coalesce_key
+from src.services.proxy.body import RequestBodyTooLarge, SpooledRequestBody, check_content_length, has_request_body
+from src.services.proxy.service import UpstreamStreamingResponse, forward_request
+from src.services.request_tracking.middleware import GatewayTimings
 
 
 @final
@@ -23,6 +38,10 @@ class GatewayMiddleware:
         self.rules.append(rule)
         return self
 
+    async def close(self) -> None:
+        for rule in self.rules:
+            await rule.close()
+
     async def process_request(self, request: Request, call_next):
         """Process the request through all rules and forward it"""
         request_path = request.url.path
@@ -31,38 +50,139 @@ class GatewayMiddleware:
         if request_path.startswith("/admin"):
             return await call_next(request)
             
-        # Get route configuration
-        route_config = await get_route_config(request_path)
-        if not route_config:
+        # Resolve the route once, every rule shares the same context
+        route = get_route_table().resolve(request_path)
+        if not route:
             self.logger.error(f"No Config found for route {request_path}")
             raise HTTPException(status_code=404, detail="Route not found")
-            
-        target_url, _, _ = route_config
-        
+
+        context = RouteContext.from_route(route)
+        request.state.route_context = context
+        try:
+            response = await self._process_route(request, route, context)
+        except BaseException:
+            await asyncio.shield(context.finalize())
+            raise
+        if not context.finalizers:
+            return response
+        if isinstance(response, StreamingResponse):
+            # Finalized once the body is sent, or the client disconnected, whichever the response is
+            return FinalizedResponse(response, context)
+        await context.finalize()
+        return response
+
+    async def _process_route(self, request: Request, route: CompiledRoute, context: RouteContext) -> Response:
+        """Rules and forwarding of a request matching `route`"""
+        request_path = request.url.path
+        timings = GatewayTimings()
+        request.state.gateway_timings = timings
+        started = time.perf_counter()
+
         # Apply pre-processing rules
         for rule in self.rules:
             if rule.phase in [RulePhase.PRE, RulePhase.BOTH]:
                 try:
-                    result = await rule.pre_process(request, self.settings, self.logger)
+                    result = await rule.run_pre_process(request, self.settings, self.logger, context)
                     if result is not None:
                         # Rule returned a response, short-circuit
+                        timings.rules = time.perf_counter() - started
                         return result
                 except Exception as e:
                     self.logger.error(f"Error in rule {rule.name} pre-process: {str(e)}")
                     
         # Forward the request
-        response = await forward_request(request, target_url, self.logger)
+        forwarding = time.perf_counter()
+        timings.rules = forwarding - started
+        try:
+            body = None
+            if route.buffer_body and has_request_body(request):
+                # Spool the body so it can be replayed, instead of piping it straight through
+                check_content_length(request, route.max_body_size)
+                body = await SpooledRequestBody.from_request(
+                    request,
+                    self.settings.PROXY_BODY_SPOOL_MAX_MEMORY,
+                    route.max_body_size
+                )
+            def fetch():
+                return forward_request(
+                    request,
+                    context.target_url,
+                    self.logger,
+                    request.app.state.upstream_pool,
+                    stream=self.settings.PROXY_STREAM_RESPONSES,
+                    max_body_size=route.max_body_size,
+                    body=body,
+                    balancer=route.balancer,
+                    extra_headers=context.upstream_headers
+                )
+
+            coalescer: RequestCoalescer | None = getattr(request.app.state, "request_coalescer", None)
+            if route.coalesce and coalescer is not None and request.method in ("GET", "HEAD") and not has_request_body(request):
+                # Identical concurrent requests share a single upstream call
+                key = coalesce_key(request, route.prefix, route.coalesce.vary_headers, context.upstream_headers)
+                response = await coalescer.forward(key, fetch, route.coalesce.max_wait, route.coalesce.max_buffer_size)
+            else:
+                response = await fetch()
+        except RequestBodyTooLarge as e:
+            self.logger.warning(f"Rejected request to {request_path}: {str(e)}")
+            return JSONResponse(
+                status_code=413,
+                content={"detail": str(e)}
+            )
+        except NoHealthyUpstream as e:
+            # Fail fast, the upstreams are ejected until their circuit breaker lets a probe through,
+            # or at their adaptive limit and would only queue the request
+            self.logger.warning(f"{str(e)} for {request_path}")
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": str(e)},
+                headers={"Retry-After": str(math.ceil(e.retry_after))}
+            )
+        except httpx.RequestError as e:
+            timed_out = isinstance(e.__cause__, httpx.TimeoutException)
+            response = JSONResponse(
+                status_code=504 if timed_out else 502,
+                content={"detail": "Upstream timed out" if timed_out else "Upstream unavailable"}
+            )
         
-        # Apply post-processing rules
-        for rule in self.rules:
+        # Apply post-processing rules, in reverse order so the first rule has the last word
+        # Upstream failures go through them too, e.g. for the cache to serve a stale response
+        post_started = time.perf_counter()
+        timings.upstream = post_started - forwarding
+        upstream_response = response
+        for rule in reversed(self.rules):
             if rule.phase in [RulePhase.POST, RulePhase.BOTH]:
                 try:
-                    response = await rule.post_process(request, response, self.settings, self.logger)
+                    response = await rule.run_post_process(request, response, self.settings, self.logger, context)
                 except Exception as e:
                     self.logger.error(f"Error in rule {rule.name} post-process: {str(e)}")
-                    
+
+        # A rule replaced the upstream response, it will never be sent so release it now
+        if response is not upstream_response and isinstance(upstream_response, UpstreamStreamingResponse):
+            await upstream_response.aclose()
+
+        timings.rules += time.perf_counter() - post_started
         return response
 
+@final
+class FinalizedResponse(Response):
+    """`response` running the finalizers of `context` once it is sent, fails or the client goes away"""
+    def __init__(self, response: Response, context: RouteContext):
+        self.response = response
+        self.context = context
+        self.status_code = response.status_code
+        self.raw_headers = response.raw_headers
+        self.background = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            # Shielded so a disconnect cancelling the response still runs them
+            with anyio.CancelScope(shield=True):
+                await self.context.finalize()
+
+
 def setup_gateway(app: FastAPI, settings: Settings, logger: Logger) -> GatewayMiddleware:
     """Setup gateway middleware with configurable rules"""
     
@@ -74,8 +194,15 @@ def setup_gateway(app: FastAPI, settings: Settings, logger: Logger) -> GatewayMi
         RateLimitRule()
     ).add_rule(
         UrlRewriteRule()
+    ).add_rule(
+        CacheRule()
+    ).add_rule(
+        # Last of the pre rules, cache hits and rejected requests never take an upstream slot
+        ConcurrencyRule()
     )
     
+    app.state.gateway = gateway
+
     # Register middleware with FastAPI
     @app.middleware("http")
     async def gateway_middleware(request: Request, call_next):
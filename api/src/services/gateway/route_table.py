@@ -0,0 +1,131 @@
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import final
+from src.database.models import GatewayConfig
+from src.services.cache.policy import CachePolicy
+from src.services.proxy.adaptive import AdaptivePolicy
+from src.services.proxy.balancer import Balancer, HealthPolicy, create_balancer
+from src.services.proxy.coalesce import CoalescePolicy
+from src.services.rate_limit.concurrency import ConcurrencyPolicy
+from src.services.rate_limit.hybrid import HybridPolicy
+from src.services.rate_limit.keys import LimitSpec, compile_limits
+
+
+@final
+@dataclass(frozen=True, slots=True, eq=False)
+class CompiledRoute:
+    """Immutable snapshot of an active GatewayConfig row"""
+    prefix: str
+    target_url: str
+    rate_limit: int
+    url_rewrite: dict[str, str] = field(default_factory=dict)
+    max_body_size: int | None = None
+    buffer_body: bool = False
+    # None uses RATE_LIMIT_ALGORITHM
+    rate_limit_algorithm: str | None = None
+    # Local spending of quota leased from Redis, None decides every request in Redis
+    rate_limit_hybrid: HybridPolicy | None = None
+    # Limits stacked on top of rate_limit, all counted at once
+    rate_limits: tuple[LimitSpec, ...] = ()
+    # "local", "open" or "closed" while Redis is unavailable
+    rate_limit_failure_mode: str = "local"
+    # Bumped on every change of the route, its limits then start over under new keys
+    rate_limit_generation: int = 0
+    # Cap on in-flight requests, None when the route does not limit them
+    concurrency: ConcurrencyPolicy | None = None
+    # Live upstream selection state, None forwards everything to target_url
+    balancer: Balancer | None = None
+    # Response caching policy, None when the route does not cache
+    cache: CachePolicy | None = None
+    # Single-flight of identical concurrent requests, None when the route does not coalesce
+    coalesce: CoalescePolicy | None = None
+
+    @classmethod
+    def from_config(cls, config: GatewayConfig, previous: "CompiledRoute | None" = None) -> "CompiledRoute":
+        # A route without an explicit upstream list is served by its target_url alone
+        targets = [(upstream["url"], upstream.get("weight", 1)) for upstream in config.upstreams or []]
+        if not targets:
+            targets = [(config.target_url, 1)]
+        return cls(
+            prefix=config.route_prefix,
+            target_url=config.target_url,
+            rate_limit=config.rate_limit,
+            url_rewrite=dict(config.url_rewrite or {}),
+            max_body_size=config.max_body_size,
+            buffer_body=bool(config.buffer_body),
+            rate_limit_algorithm=config.rate_limit_algorithm,
+            rate_limit_hybrid=HybridPolicy.from_options(config.rate_limit_hybrid),
+            rate_limits=compile_limits(config.rate_limits),
+            rate_limit_failure_mode=config.rate_limit_failure_mode or "local",
+            rate_limit_generation=config.rate_limit_generation or 0,
+            concurrency=ConcurrencyPolicy.from_options(config.concurrency),
+            balancer=create_balancer(
+                config.load_balancer,
+                targets,
+                previous.balancer if previous else None,
+                HealthPolicy(**(config.health_check or {})),
+                AdaptivePolicy.from_options(config.adaptive_concurrency),
+            ),
+            cache=CachePolicy.from_options(config.cache),
+            coalesce=CoalescePolicy.from_options(config.coalesce),
+        )
+
+
+@final
+class _TrieNode:
+    __slots__ = ("children", "route")
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = {}
+        self.route: CompiledRoute | None = None
+
+
+@final
+class RouteTable:
+    """
+    Read-only prefix trie over the active routes.
+    Built once from the database and swapped as a whole, lookups never do I/O.
+    """
+    __slots__ = ("_root", "_routes", "version")
+
+    def __init__(self, routes: Iterable[CompiledRoute] = (), version: int = 0):
+        self.version: int = version
+        self._root = _TrieNode()
+        self._routes: dict[str, CompiledRoute] = {}
+        for route in routes:
+            node = self._root
+            for char in route.prefix:
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = _TrieNode()
+                node = child
+            node.route = route
+            self._routes[route.prefix] = route
+
+    @classmethod
+    def from_configs(cls, configs: Iterable[GatewayConfig], version: int = 0, previous: "RouteTable | None" = None) -> "RouteTable":
+        """Compile the configurations, upstream state of routes in `previous` is carried over"""
+        previous_routes = previous._routes if previous else {}
+        return cls(
+            (CompiledRoute.from_config(config, previous_routes.get(config.route_prefix)) for config in configs),
+            version
+        )
+
+    def resolve(self, path: str) -> CompiledRoute | None:
+        """Return the route with the longest prefix matching `path`, in O(len(path))"""
+        node = self._root
+        match = node.route
+        for char in path:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.route is not None:
+                match = node.route
+        return match
+
+    @property
+    def routes(self) -> dict[str, CompiledRoute]:
+        return dict(self._routes)
+
+    def __len__(self) -> int:
+        return len(self._routes)
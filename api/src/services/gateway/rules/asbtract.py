@@ -1,7 +1,9 @@
 import abc
+import inspect
 from typing import final
 from logging import Logger
 from fastapi import Request, Response
+from src.services.gateway.context import RouteContext
 from src.settings import Settings
 
 
@@ -12,18 +14,45 @@ class RulePhase:
     POST = "post"    # Rules applied after receiving the response
     BOTH = "both"    # Rules applied both before and after
 
+def _accepts_context(method) -> bool:
+    return "context" in inspect.signature(method).parameters
+
 class Rule(abc.ABC):
-    """Base class for middleware rules"""
+    """
+    Base class for middleware rules
+    Rules declaring a `context` parameter receive the RouteContext resolved by the gateway,
+    rules written against the older (request, settings, logger) signature keep working.
+    """
     def __init__(self, name: str, phase: str = RulePhase.PRE):
         self.name: str = name
         self.phase: str = phase
-        
+        self._pre_accepts_context: bool = _accepts_context(self.pre_process)
+        self._post_accepts_context: bool = _accepts_context(self.post_process)
+
     @abc.abstractmethod
-    async def pre_process(self, request: Request, settings: Settings, logger: Logger) -> Response | None:
+    async def pre_process(self, request: Request, settings: Settings, logger: Logger, context: RouteContext | None = None) -> Response | None:
         """Process before forwarding. Return Response to short-circuit or None to continue."""
         return None
-        
+
     @abc.abstractmethod
-    async def post_process(self, request: Request, response: Response, settings: Settings, logger: Logger) -> Response:
+    async def post_process(self, request: Request, response: Response, settings: Settings, logger: Logger, context: RouteContext | None = None) -> Response:
         """Process after receiving response. Must return the (possibly modified) response."""
         return response
+
+    async def close(self) -> None:
+        """Stop the background work of the rule, at shutdown"""
+        return None
+
+    @final
+    async def run_pre_process(self, request: Request, settings: Settings, logger: Logger, context: RouteContext) -> Response | None:
+        """Call pre_process with the route context if the rule supports it"""
+        if self._pre_accepts_context:
+            return await self.pre_process(request, settings, logger, context=context)
+        return await self.pre_process(request, settings, logger)
+
+    @final
+    async def run_post_process(self, request: Request, response: Response, settings: Settings, logger: Logger, context: RouteContext) -> Response:
+        """Call post_process with the route context if the rule supports it"""
+        if self._post_accepts_context:
+            return await self.post_process(request, response, settings, logger, context=context)
+        return await self.post_process(request, response, settings, logger)
@@ -0,0 +1,279 @@
+import asyncio
+from collections.abc import AsyncIterator, Mapping
+from logging import Logger
+import time
+from typing import final, override
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from src.services.cache.policy import (
+    CREDENTIAL_HEADERS,
+    CacheLifetime,
+    CachePolicy,
+    request_bypasses_cache,
+    request_requires_revalidation,
+    response_lifetime,
+)
+from src.services.cache.store import CachedResponse, ResponseCache
+from src.services.gateway.context import RouteContext, resolve_route_context
+from src.services.gateway.rules.asbtract import Rule, RulePhase
+from src.services.gateway.rules.rate_limiter import rate_limit_headers
+from src.services.proxy.pool import UpstreamClientPool
+from src.services.proxy.service import forward_request
+from src.services.rate_limit.algorithms import RateLimitResult
+from src.settings import Settings
+
+
+def cache_key(request: Request, context: RouteContext) -> str:
+    """Routes rewriting to the same path still get their own entries"""
+    path = getattr(request.state, "rewritten_path", request.url.path)
+    query = request.url.query
+    return f"{context.prefix}|{request.method}|{path}?{query}" if query else f"{context.prefix}|{request.method}|{path}"
+
+
+def served(request: Request, entry: CachedResponse, cache_status: str, now: float, settings: Settings) -> Response:
+    """
+    Response of an entry answered from pre_process, no post rule runs for it:
+    the rate limit headers of the current client are added here
+    """
+    response = entry.to_response(cache_status, now)
+    result: RateLimitResult | None = getattr(request.state, "rate_limit_result", None)
+    if result is not None:
+        response.headers.update(rate_limit_headers(result, settings.RATE_LIMIT_HEADERS))
+    return response
+
+
+def validation_request(request: Request, entry: CachedResponse) -> Request | None:
+    """
+    Conditional GET of the upstream resource of `request` carrying none of its headers
+    but the ones the entry varies on, None when those are credentials
+    """
+    # Credentials would make a background revalidation act on behalf of the client
+    if any(name in CREDENTIAL_HEADERS for name in entry.vary):
+        return None
+    path = getattr(request.state, "rewritten_path", request.url.path)
+    headers = [(name.encode("latin-1"), request.headers[name].encode("latin-1")) for name in entry.vary if name in request.headers]
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": request.url.query.encode(),
+        "headers": headers,
+        "state": {"rewritten_path": path},
+    })
+
+
+@final
+class CacheRule(Rule):
+    """
+    Serve GETs of routes with caching enabled from the response cache.
+    Stale entries are revalidated with the upstream through conditional requests,
+    and served anyway while revalidating or when the upstream fails, as allowed by the route and the response.
+    """
+    def __init__(self):
+        super().__init__("cache", RulePhase.BOTH)
+        # Background revalidations in flight, one per key
+        self._revalidating: dict[str, asyncio.Task[None]] = {}
+
+    @override
+    async def pre_process(self, request: Request, settings: Settings, logger: Logger, context: RouteContext | None = None) -> Response | None:
+        context = context or resolve_route_context(request)
+        cache: ResponseCache | None = getattr(request.app.state, "response_cache", None)
+        if not context or not context.route.cache or not cache:
+            return None
+        if request.method != "GET" or request_bypasses_cache(request.headers):
+            return None
+
+        key = cache_key(request, context)
+        context.state["cache_key"] = key
+        entry = await cache.get(key, request.headers)
+        if entry is None:
+            cache.record_miss()
+            return None
+
+        now = time.time()
+        if not request_requires_revalidation(request.headers):
+            if now < entry.fresh_until:
+                cache.record_hit()
+                return served(request, entry, "HIT", now, settings)
+            if now < entry.stale_while_revalidate_until:
+                cache.record_hit(stale=True)
+                self._schedule_revalidation(request, context, cache, key, entry, logger)
+                return served(request, entry, "STALE", now, settings)
+
+        # Go to the upstream, conditionally when the entry has validators
+        context.state["cache_entry"] = entry
+        context.upstream_headers.update(entry.validators())
+        cache.record_miss()
+        return None
+
+    @override
+    async def post_process(self, request: Request, response: Response, settings: Settings, logger: Logger, context: RouteContext | None = None) -> Response:
+        context = context or resolve_route_context(request)
+        cache: ResponseCache | None = getattr(request.app.state, "response_cache", None)
+        if not context or not cache or "cache_key" not in context.state:
+            return response
+        policy = context.route.cache
+        assert policy is not None, "cache_key is only set for routes with caching enabled"
+        key: str = context.state["cache_key"]
+        entry: CachedResponse | None = context.state.get("cache_entry")
+        now = time.time()
+
+        # Responses returned from here still go through the rate limit rule, which adds the client's headers
+        if entry is not None and response.status_code == 304:
+            cache.record_revalidation()
+            entry = await self._refresh(cache, key, entry, request.headers, response.headers, policy, now)
+            return entry.to_response("REVALIDATED", now)
+        if entry is not None and response.status_code >= 500 and now < entry.stale_if_error_until:
+            logger.warning(f"Upstream answered {response.status_code} for {request.url.path}, serving stale response")
+            cache.record_hit(stale=True)
+            return entry.to_response("STALE", now)
+
+        lifetime = response_lifetime(response.status_code, response.headers, policy, now)
+        if lifetime is None:
+            return response
+        max_object_size = policy.max_object_size or cache.max_object_size
+        content_length = response.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_object_size:
+            return response
+
+        # Copied now, the rules running after this one add headers meant for this client only
+        headers = dict(response.headers)
+        response.headers["x-cache"] = "MISS"
+        if isinstance(response, StreamingResponse):
+            # Keep streaming to the client, the entry is stored once the whole body went through
+            response.body_iterator = self._store_when_complete(
+                response.body_iterator, cache, key, request.headers, response.status_code, headers, lifetime, now, max_object_size, logger
+            )
+        else:
+            await cache.set(key, request.headers, CachedResponse.create(
+                response.status_code, headers, bytes(response.body), lifetime, now
+            ))
+        return response
+
+    async def _store_when_complete(
+        self,
+        body: AsyncIterator[bytes],
+        cache: ResponseCache,
+        key: str,
+        request_headers: Mapping[str, str],
+        status_code: int,
+        headers: Mapping[str, str],
+        lifetime: CacheLifetime,
+        now: float,
+        max_object_size: int,
+        logger: Logger
+    ) -> AsyncIterator[bytes]:
+        chunks: list[bytes] | None = []
+        size = 0
+        async for chunk in body:
+            if chunks is not None:
+                size += len(chunk)
+                if size <= max_object_size:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+            yield chunk
+        if chunks is None:
+            return
+        try:
+            await cache.set(key, request_headers, CachedResponse.create(
+                status_code, headers, b"".join(chunks), lifetime, now
+            ))
+        except Exception as e:
+            logger.error(f"Error storing response in cache: {str(e)}")
+
+    async def _refresh(
+        self,
+        cache: ResponseCache,
+        key: str,
+        entry: CachedResponse,
+        request_headers: Mapping[str, str],
+        not_modified_headers: Mapping[str, str],
+        policy: CachePolicy,
+        now: float
+    ) -> CachedResponse:
+        """Extend the life of an entry the upstream confirmed with a 304"""
+        headers = dict(entry.headers)
+        headers.update({name.lower(): value for name, value in not_modified_headers.items()})
+        lifetime = response_lifetime(entry.status_code, headers, policy, now)
+        if lifetime is None:
+            return entry
+        entry = entry.refreshed(not_modified_headers, lifetime, now)
+        await cache.set(key, request_headers, entry)
+        return entry
+
+    def _schedule_revalidation(
+        self,
+        request: Request,
+        context: RouteContext,
+        cache: ResponseCache,
+        key: str,
+        entry: CachedResponse,
+        logger: Logger
+    ) -> None:
+        if key in self._revalidating:
+            return
+        upstream_request = validation_request(request, entry)
+        if upstream_request is None:
+            return
+        task = asyncio.create_task(self._revalidate(
+            upstream_request,
+            dict(request.headers),
+            getattr(request.app.state, "upstream_pool", None),
+            context,
+            cache,
+            key,
+            entry,
+            logger
+        ))
+        self._revalidating[key] = task
+        task.add_done_callback(lambda _: self._revalidating.pop(key, None))
+
+    @override
+    async def close(self) -> None:
+        tasks = list(self._revalidating.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._revalidating.clear()
+
+    async def _revalidate(
+        self,
+        request: Request,
+        request_headers: Mapping[str, str],
+        pool: UpstreamClientPool | None,
+        context: RouteContext,
+        cache: ResponseCache,
+        key: str,
+        entry: CachedResponse,
+        logger: Logger
+    ) -> None:
+        """
+        Refresh a stale entry in the background while it keeps being served. `request` is the validation
+        request, `request_headers` those of the client request, selecting the variant to store.
+        """
+        policy = context.route.cache
+        assert policy is not None
+        try:
+            response = await forward_request(
+                request,
+                context.target_url,
+                logger,
+                pool,
+                stream=False,
+                balancer=context.route.balancer,
+                extra_headers=entry.validators()
+            )
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            now = time.time()
+            if response.status_code == 304:
+                cache.record_revalidation()
+                await self._refresh(cache, key, entry, request_headers, response.headers, policy, now)
+                return
+            lifetime = response_lifetime(response.status_code, response.headers, policy, now)
+            if lifetime is not None and len(body) <= (policy.max_object_size or cache.max_object_size):
+                await cache.set(key, request_headers, CachedResponse.create(
+                    response.status_code, response.headers, body, lifetime, now
+                ))
+        except Exception as e:
+            logger.warning(f"Background revalidation of {request.url.path} failed: {str(e)}")
@@ -0,0 +1,47 @@
+from logging import Logger
+import math
+from typing import final, override
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from src.services.gateway.context import RouteContext, resolve_route_context
+from src.services.gateway.rules.asbtract import Rule, RulePhase
+from src.services.rate_limit.concurrency import ConcurrencyLimiter
+from src.services.rate_limit.keys import route_namespace
+from src.settings import Settings
+
+
+@final
+class ConcurrencyRule(Rule):
+    """
+    Cap the in-flight requests of routes with a concurrency policy, in total and per key.
+    Slots are held until the upstream body is relayed or the client goes away, requests finding
+    them busy wait up to the route queue timeout then get a 503.
+    """
+    def __init__(self):
+        super().__init__("concurrency", RulePhase.PRE)
+
+    @override
+    async def pre_process(self, request: Request, settings: Settings, logger: Logger, context: RouteContext | None = None) -> Response | None:
+        context = context or resolve_route_context(request)
+        limiter: ConcurrencyLimiter | None = getattr(request.app.state, "concurrency_limiter", None)
+        if not context or not context.route.concurrency or not limiter:
+            return None
+
+        policy = context.route.concurrency
+        slots = policy.slots(request, route_namespace(context.prefix, context.route.rate_limit_generation))
+        if not slots:
+            return None
+        permit = await limiter.acquire(slots, policy)
+        if permit is None:
+            logger.debug(f"Too many in-flight requests on {context.prefix}")
+            return JSONResponse(
+                status_code=503,
+                content={"detail": "Too many concurrent requests"},
+                headers={"Retry-After": str(max(math.ceil(policy.queue_timeout), 1))}
+            )
+        context.finalizers.append(permit.release)
+        return None
+
+    @override
+    async def post_process(self, request: Request, response: Response, settings: Settings, logger: Logger, context: RouteContext | None = None) -> Response:
+        return response
@@ -1,66 +1,187 @@
+from collections.abc import Awaitable, Callable, Sequence
 from logging import Logger
 from typing import final, override
 from fastapi import Request, Response, HTTPException
 from redis.asyncio import Redis
-from src.services.gateway.config_service import get_route_config
+from src.services.gateway.context import RouteContext, resolve_route_context
 from src.services.gateway.rules.asbtract import Rule, RulePhase
+from src.services.rate_limit.algorithms import (
+    ALGORITHMS,
+    GCRAAlgorithm,
+    RateLimitResult,
+    SlidingWindowLogAlgorithm,
+    StackedLimit,
+    check_stacked,
+    get_algorithm,
+)
+from src.services.rate_limit.blocked import BlockedClients
+from src.services.rate_limit.hybrid import HybridPolicy, QuotaLeases
+from src.services.rate_limit.keys import ClientIpKey, LimitSpec, route_namespace
+from src.services.rate_limit.local import LocalRateLimiter
+from src.services.storage.breaker import RedisBreakers, RedisUnavailable
+from src.services.storage.sharding import RateLimitRedis, tagged
 from src.settings import Settings
-import time
+import math
 from fastapi.responses import JSONResponse
 
 
 @final
 class RateLimiter:
-    def __init__(self, redis: Redis, requests_per_minute: int = 60, logger: Logger | None = None, settings: Settings | None = None):
+    def __init__(
+        self,
+        redis: Redis,
+        requests_per_minute: int = 60,
+        logger: Logger | None = None,
+        settings: Settings | None = None,
+        algorithm: str | None = None,
+        hybrid: HybridPolicy | None = None,
+        leases: QuotaLeases | None = None,
+        blocked: BlockedClients | None = None,
+        store: RateLimitRedis | None = None,
+        breakers: RedisBreakers | None = None
+    ):
         self.redis = redis
+        self.store = store
+        self.breakers = breakers
         self.requests_per_minute = requests_per_minute
         self.window = settings.RATE_LIMIT_WINDOW_SECONDS if settings else 60  # Use settings if provided
+        self.algorithm = get_algorithm(algorithm, settings.RATE_LIMIT_ALGORITHM if settings else "gcra")
+        # Leases are taken from the GCRA state, a hybrid route shares it with the global limiter
+        self.hybrid = hybrid if leases is not None else None
+        self.leases = leases
+        if self.hybrid:
+            self.algorithm = ALGORITHMS[GCRAAlgorithm.name]
+        self.blocked = blocked
         self.logger = logger
 
+    def key_for(self, base_key: str) -> str:
+        """
+        Each algorithm keeps a different Redis type, switching a route's algorithm must not reuse the state.
+        The script states are only meaningful for one limit and window, routes sharing a target
+        with different limits keep their own.
+        """
+        if self.algorithm.name == SlidingWindowLogAlgorithm.name:
+            return base_key
+        return f"{base_key}:{self.algorithm.name}:{self.requests_per_minute}/{self.window}"
+
+    async def _run[T](self, redis: Redis, operation: Callable[[], Awaitable[T]]) -> T:
+        """A call goes through the breaker of the client it is sent to, raises RedisUnavailable while that one is tripped"""
+        if self.breakers is None:
+            return await operation()
+        return await self.breakers.run(redis, operation)
+
+    async def check(self, key: str) -> RateLimitResult:
+        """Count the request and tell whether it is allowed, in one Redis round trip or from a local lease"""
+        state_key = self.key_for(key)
+        if self.blocked is not None:
+            # Clients already told to wait are not worth a round trip, nor a slot in the log
+            result = self.blocked.get(state_key)
+            if result is not None:
+                return result
+        redis = self.store.client_for(state_key) if self.store else self.redis
+        if self.hybrid and self.leases is not None:
+            leases, hybrid = self.leases, self.hybrid
+            result = await self._run(
+                redis, lambda: leases.check(redis, state_key, self.requests_per_minute, self.window, hybrid)
+            )
+        else:
+            result = await self._run(
+                redis, lambda: self.algorithm.check(redis, state_key, self.requests_per_minute, self.window)
+            )
+        if self.blocked is not None and not result.allowed:
+            self.blocked.block(state_key, result)
+        if self.logger:
+            self.logger.debug(
+                f"Rate limit {self.algorithm.name} check for key {key}: allowed={result.allowed}, "
+                f"remaining={result.remaining}/{result.limit}, reset={result.reset}s"
+            )
+        return result
+
+    async def check_stacked(self, limits: Sequence[StackedLimit]) -> RateLimitResult:
+        """Count the request against several limits in one script call, stacked limits always use GCRA"""
+        if self.blocked is not None:
+            for limit in limits:
+                result = self.blocked.get(limit.key)
+                if result is not None:
+                    return result
+        if self.store:
+            groups = self.store.group([limit.key for limit in limits])
+        else:
+            groups = [(self.redis, list(range(len(limits))))]
+        decided, result = await self._check_groups(groups, limits)
+        if self.blocked is not None and not result.allowed:
+            self.blocked.block(decided.key, result)
+        if self.logger:
+            self.logger.debug(
+                f"Rate limit check of {len(limits)} stacked limits decided by {decided.key}: allowed={result.allowed}, "
+                f"remaining={result.remaining}/{result.limit}, reset={result.reset}s"
+            )
+        return result
+
+    async def _check_groups(
+        self,
+        groups: Sequence[tuple[Redis, list[int]]],
+        limits: Sequence[StackedLimit]
+    ) -> tuple[StackedLimit, RateLimitResult]:
+        """
+        One script call per shard or slot holding some of the limits. When a later group denies
+        the request, what the earlier ones counted is given back.
+        """
+        counted: list[tuple[Redis, list[StackedLimit]]] = []
+        decision: tuple[StackedLimit, RateLimitResult] | None = None
+        for redis, indexes in groups:
+            group = [limits[index] for index in indexes]
+            decided, result = await self._run(redis, lambda: check_stacked(redis, group))
+            if not result.allowed:
+                for counted_redis, counted_limits in counted:
+                    await self._run(counted_redis, lambda: check_stacked(counted_redis, counted_limits, cost=-1))
+                return decided, result
+            counted.append((redis, group))
+            if decision is None or result.remaining < decision[1].remaining:
+                decision = decided, result
+        assert decision is not None, "at least one limit is checked"
+        return decision
+
     async def is_rate_limited(self, key: str) -> tuple[bool, int | None]:
         """
         Check if the request should be rate limited
         Returns (is_limited, retry_after)
         """
-        current = time.time()
-        current_ms = int(current * 1000000)  # Convert to microseconds for uniqueness
-        window_start = int(current - self.window)
+        result = await self.check(key)
+        if result.allowed:
+            return False, None
+        return True, max(math.ceil(result.retry_after), 1)
 
-        if self.logger:
-            self.logger.debug(f"Rate limit check for key: {key}")
-            self.logger.debug(f"Current time: {current}, Window start: {window_start}")
-
-        async with self.redis.pipeline(transaction=True) as pipe:
-            # Remove old requests
-            await pipe.zremrangebyscore(key, 0, window_start)
-            # Add current request with microsecond precision to ensure uniqueness
-            await pipe.zadd(key, {f"{current_ms}": current})
-            # Get count of all requests in window AFTER adding current request
-            await pipe.zcount(key, window_start, '+inf')  # Use '+inf' to count all requests
-            # Set key expiration
-            await pipe.expire(key, self.window)
-            _, _, count, _ = await pipe.execute()
-
-            if self.logger:
-                self.logger.debug(f"Request count in window: {count}/{self.requests_per_minute}")
-
-        # Check if the current count exceeds the limit
-        if count > self.requests_per_minute:
-            retry_after = self.window - (int(current) - window_start)
-            if self.logger:
-                self.logger.debug(f"Rate limit exceeded. Retry after: {retry_after}s")
-            return True, retry_after
 
-        if self.logger:
-            self.logger.debug("Request allowed")
-        return False, None
+def rate_limit_headers(result: RateLimitResult, style: str = "legacy") -> dict[str, str]:
+    """
+    Response headers describing the limit, `style` is "legacy" (X-RateLimit-*),
+    "ietf" (RateLimit/RateLimit-Policy of draft-ietf-httpapi-ratelimit-headers) or "both"
+    """
+    reset = str(math.ceil(result.reset))
+    headers: dict[str, str] = {}
+    if style in ("legacy", "both"):
+        headers["X-RateLimit-Limit"] = str(result.limit)
+        headers["X-RateLimit-Remaining"] = str(result.remaining)
+        headers["X-RateLimit-Reset"] = reset
+    if style in ("ietf", "both"):
+        headers["RateLimit-Policy"] = f'"{result.policy}";q={result.limit};w={math.ceil(result.window)}'
+        headers["RateLimit"] = f'"{result.policy}";r={result.remaining};t={reset}'
+    return headers
+
 
 async def check_rate_limit(
     request: Request,
     target_url: str,
     rate_limit: int,
     logger: Logger,
-    settings: Settings
+    settings: Settings,
+    algorithm: str | None = None,
+    hybrid: HybridPolicy | None = None,
+    limits: Sequence[LimitSpec] = (),
+    prefix: str = "",
+    failure_mode: str = "local",
+    generation: int = 0
 ) -> None | JSONResponse:
     """Check rate limit for the request. Raises HTTPException if rate limited."""
     logger.debug(f"Starting rate limit check for target_url: {target_url}, rate_limit: {rate_limit}")
@@ -72,38 +193,66 @@ async def check_rate_limit(
         return
 
     logger.debug("Redis connection available")
-    rate_limiter = RateLimiter(redis, rate_limit, logger, settings)
-    
-    # Use IP address and path prefix as the rate limit key
-    # Get client IP address, prioritizing X-Forwarded-For header if present
-    forwarded_for = request.headers.get("X-Forwarded-For")
-    if forwarded_for:
-        # Use the first IP in the X-Forwarded-For chain (the original client)
-        client_ip = forwarded_for.split(",")[0].strip()
-    else:
-        # Fall back to direct client IP
-        client_ip = request.client.host if request.client else "unknown"
+    # Limits stacked on the route, those whose key parts the request lacks do not apply
+    window = settings.RATE_LIMIT_WINDOW_SECONDS
+    namespace = route_namespace(prefix, generation)
+    stacked: list[StackedLimit] = []
+    for spec in limits:
+        spec_key = spec.key(request, namespace)
+        if spec_key is not None:
+            spec_window = spec.window or window
+            stacked.append(StackedLimit(spec.name, f"{spec_key}:gcra:{spec.limit}/{spec_window}", spec.limit, spec_window))
+    has_stacked = bool(stacked)
+    if has_stacked:
+        algorithm, hybrid = GCRAAlgorithm.name, None
+
+    leases: QuotaLeases | None = getattr(request.app.state, "quota_leases", None)
+    blocked: BlockedClients | None = getattr(request.app.state, "blocked_clients", None)
+    store: RateLimitRedis | None = getattr(request.app.state, "rate_limit_redis", None)
+    breakers: RedisBreakers | None = getattr(request.app.state, "redis_breakers", None)
+    rate_limiter = RateLimiter(redis, rate_limit, logger, settings, algorithm, hybrid, leases, blocked, store, breakers)
     
+    # The route limit is counted per route generation and client address
+    client_ip = ClientIpKey(settings.RATE_LIMIT_TRUSTED_PROXIES).extract(request)
     logger.debug(f"Client IP: {client_ip}")
-    logger.debug(f"Client IP: {client_ip}")
-    
-    config = await get_route_config(request.url.path)
-    if not config:
-        logger.error(f"No matching path prefix found for path: {request.url.path}")
-        raise HTTPException(status_code=404, detail="Invalid route not found")
-    path_prefix, _, _ = config
-    logger.debug(f"Found path_prefix: {path_prefix}")
-
-    key = f"rate_limit:{path_prefix}:{client_ip}"
+
+    key = f"rate_limit:{namespace}:{tagged(f'client_ip={client_ip}')}"
     logger.debug(f"Generated rate limit key: {key}")
 
+    if rate_limit:
+        stacked.insert(0, StackedLimit("route", rate_limiter.key_for(key), rate_limit, window))
+    if not stacked:
+        return None
+
     try:
-        is_limited, retry_after = await rate_limiter.is_rate_limited(key)
-        if is_limited:
+        try:
+            if has_stacked:
+                result = await rate_limiter.check_stacked(stacked)
+            else:
+                result = await rate_limiter.check(key)
+        except RedisUnavailable:
+            # Redis is degraded, the route decides between limiting here, letting through or rejecting
+            if failure_mode == "open":
+                request.state.rate_limit_decision = "failed_open"
+                return None
+            local: LocalRateLimiter | None = getattr(request.app.state, "local_rate_limiter", None)
+            if failure_mode == "closed" or local is None:
+                request.state.rate_limit_decision = "failed_closed"
+                return JSONResponse(
+                    status_code=503,
+                    content={"detail": "Rate limiting unavailable"},
+                    headers={"Retry-After": str(math.ceil(settings.REDIS_BREAKER_PROBE_SECONDS))}
+                )
+            _, result = local.check(stacked)
+            request.state.rate_limit_decision = "local_allowed" if result.allowed else "local_limited"
+        else:
+            request.state.rate_limit_decision = "allowed" if result.allowed else "limited"
+        # Kept for post_process, the response headers then cost no Redis I/O
+        request.state.rate_limit_result = result
+        if not result.allowed:
             headers = {
-                "Retry-After": str(retry_after),
-                "X-RateLimit-Limit": str(rate_limit),
-                "X-RateLimit-Reset": str(retry_after)
+                "Retry-After": str(max(math.ceil(result.retry_after), 1)),
+                **rate_limit_headers(result, settings.RATE_LIMIT_HEADERS)
             }
             logger.debug(f"Request rate limited. Headers: {headers}")
             return JSONResponse(
@@ -133,61 +282,39 @@ class RateLimitRule(Rule):
         super().__init__("rate_limit", RulePhase.BOTH)
         
     @override
-    async def pre_process(self, request: Request, settings: Settings, logger: Logger) -> Response | None:
-        request_path = request.url.path
-        route_config = await get_route_config(request_path)
-        if not route_config:
-            logger.debug(f"No config for {request_path} -> Skipping")
+    async def pre_process(self, request: Request, settings: Settings, logger: Logger, context: RouteContext | None = None) -> Response | None:
+        context = context or resolve_route_context(request)
+        if not context:
+            logger.debug(f"No config for {request.url.path} -> Skipping")
             return None
             
-        target_url, rate_limit, _ = route_config
-        if not rate_limit:
+        if not context.rate_limit and not context.route.rate_limits:
             return None
             
         redis: Redis = request.app.state.redis
         if not redis:
             return None
 
-        rate_limiter = RateLimiter(redis, rate_limit, logger, settings)
-        response = await check_rate_limit(request, target_url, rate_limit, logger, settings)
+        response = await check_rate_limit(
+            request,
+            context.target_url,
+            context.rate_limit,
+            logger,
+            settings,
+            context.route.rate_limit_algorithm,
+            context.route.rate_limit_hybrid,
+            context.route.rate_limits,
+            context.prefix,
+            context.route.rate_limit_failure_mode,
+            context.route.rate_limit_generation
+        )
         return response
         
     @override
-    async def post_process(self, request: Request, response: Response, settings: Settings, logger: Logger) -> Response:
-        request_path = request.url.path
-        route_config = await get_route_config(request_path)
-        if not route_config or not hasattr(request.app.state, 'redis'):
+    async def post_process(self, request: Request, response: Response, settings: Settings, logger: Logger, context: RouteContext | None = None) -> Response:
+        # Decision made by pre_process, absent when the route is not limited or Redis is down
+        result: RateLimitResult | None = getattr(request.state, "rate_limit_result", None)
+        if result is None:
             return response
-            
-        _, rate_limit, _ = route_config
-        if not rate_limit:
-            return response
-            
-        redis: Redis = request.app.state.redis
-        if not redis:
-            return response
-            
-        try:
-            client_ip = request.client.host if request.client else "unknown"
-            config = await get_route_config(request.url.path)
-            if not config:
-                logger.error(f"No matching path prefix found for path: {request.url.path}")
-                raise HTTPException(status_code=404, detail="Invalid route not found")
-            path_prefix, _, _ = config
-            key = f"rate_limit:{path_prefix}:{client_ip}"
-            
-            # Get current request count
-            current = int(time.time())
-            window_start = current - 60
-            request_count: int = await redis.zcount(key, window_start, current)
-            remaining = max(0, rate_limit - request_count)
-            
-            # Add headers to response
-            response.headers["X-RateLimit-Limit"] = str(rate_limit)
-            response.headers["X-RateLimit-Remaining"] = str(remaining)
-            response.headers["X-RateLimit-Reset"] = str(60 - (current % 60))
-        except Exception as e:
-            logger.error(f"Error adding rate limit headers: {str(e)}")
-            
+        response.headers.update(rate_limit_headers(result, settings.RATE_LIMIT_HEADERS))
         return response
-
@@ -1,7 +1,7 @@
 from logging import Logger
 from typing import final, override
 from fastapi import Request, Response
-from src.services.gateway.config_service import get_route_config
+from src.services.gateway.context import RouteContext, resolve_route_context
 from src.services.gateway.rules.asbtract import Rule, RulePhase
 from src.settings import Settings
 
@@ -14,12 +14,12 @@ class UrlRewriteRule(Rule):
         super().__init__("path_rewrite", RulePhase.PRE)
         
     @override
-    async def pre_process(self, request: Request, settings: Settings, logger: Logger) -> Response | None:
+    async def pre_process(self, request: Request, settings: Settings, logger: Logger, context: RouteContext | None = None) -> Response | None:
         original_path = request.url.path
-        route_config = await get_route_config(original_path)
-        if not route_config:
+        context = context or resolve_route_context(request)
+        if not context:
             return None
-        _, _, rewrite_rules = route_config
+        rewrite_rules = context.url_rewrite
          
         # Apply rewrite rules
         rewritten_path = original_path
@@ -42,5 +42,5 @@ class UrlRewriteRule(Rule):
         return None
 
     @override
-    async def post_process(self, request: Request, response: Response, settings: Settings, logger: Logger) -> Response:
-        return await super().post_process(request, response, settings, logger)
+    async def post_process(self, request: Request, response: Response, settings: Settings, logger: Logger, context: RouteContext | None = None) -> Response:
+        return await super().post_process(request, response, settings, logger, context)
@@ -0,0 +1,114 @@
+import abc
+from collections.abc import Mapping
+from dataclasses import dataclass
+import math
+from typing import Any, final, override
+
+# Weight of the newest sample in the long-term latency of the gradient limit, about the last 500 responses
+LONG_RTT_ALPHA = 2 / 501
+
+
+@final
+@dataclass(frozen=True, slots=True)
+class AdaptivePolicy:
+    """Per-route adaptive concurrency of each upstream, learned from the latency and errors of its responses"""
+    algorithm: str = "gradient"
+    initial_limit: int = 20
+    min_limit: int = 1
+    max_limit: int = 1000
+    backoff_ratio: float = 0.9          # Limit kept on an error, or with aimd on a slow response
+    latency_threshold: float = 1.0      # aimd: seconds until the headers above which a response counts as a drop
+    tolerance: float = 1.5              # gradient: latency allowed above the long-term one before the limit shrinks
+    smoothing: float = 0.2              # gradient: share of each new estimate taken into the limit
+
+    @classmethod
+    def from_options(cls, options: Mapping[str, Any] | None) -> "AdaptivePolicy | None":
+        """Build the policy of a route from its stored `adaptive_concurrency` column, None when upstreams are not limited"""
+        if not options or not options.get("enabled"):
+            return None
+        return cls(**{name: value for name, value in options.items() if name != "enabled" and value is not None})
+
+
+class AdaptiveLimit(abc.ABC):
+    """Concurrency an upstream is currently allowed, updated with the outcome of each of its requests"""
+    algorithm: str
+
+    def __init__(self, policy: AdaptivePolicy):
+        self.policy = policy
+        self.limit: float = float(min(max(policy.initial_limit, policy.min_limit), policy.max_limit))
+
+    @property
+    def current(self) -> int:
+        return max(int(self.limit), self.policy.min_limit)
+
+    def update(self, latency: float | None, error: bool, in_flight: int) -> None:
+        """
+        `error` is a transport error, a timeout or a 502/503/504 answer: an application 500 is a response
+        like any other, a buggy path must not shed the traffic of the others. `latency` is None when no response
+        was received, `in_flight` includes the request that completed. Requests given up on the client side never get here.
+        """
+        if error:
+            self._set(self.limit * self.policy.backoff_ratio)
+            return
+        if latency is not None:
+            self.sample(latency, in_flight)
+
+    @abc.abstractmethod
+    def sample(self, latency: float, in_flight: int) -> None:
+        ...
+
+    def _set(self, limit: float) -> None:
+        self.limit = min(max(limit, float(self.policy.min_limit)), float(self.policy.max_limit))
+
+
+@final
+class AIMDLimit(AdaptiveLimit):
+    """Additive increase while the limit is in use, multiplicative decrease on slow responses"""
+    algorithm = "aimd"
+
+    @override
+    def sample(self, latency: float, in_flight: int) -> None:
+        if latency > self.policy.latency_threshold:
+            self._set(self.limit * self.policy.backoff_ratio)
+        elif in_flight * 2 >= self.limit:
+            self._set(self.limit + 1)
+
+
+@final
+class GradientLimit(AdaptiveLimit):
+    """
+    Compares each latency to the long-term one: the limit shrinks as queueing builds up at the upstream
+    and grows by about its square root while latency stays flat.
+    """
+    algorithm = "gradient"
+
+    def __init__(self, policy: AdaptivePolicy):
+        super().__init__(policy)
+        self.long_latency: float = 0.0
+
+    @override
+    def sample(self, latency: float, in_flight: int) -> None:
+        latency = max(latency, 1e-6)
+        if self.long_latency == 0.0:
+            self.long_latency = latency
+        else:
+            self.long_latency += LONG_RTT_ALPHA * (latency - self.long_latency)
+        # Recover faster once a slow period is over, instead of waiting on the average to drift back
+        if self.long_latency > latency * 2:
+            self.long_latency *= 0.95
+        # An idle upstream tells nothing about what it could take
+        if in_flight * 2 < self.limit:
+            return
+        gradient = max(0.5, min(1.0, self.policy.tolerance * self.long_latency / latency))
+        estimate = self.limit * gradient + math.sqrt(self.limit)
+        self._set(self.limit * (1 - self.policy.smoothing) + estimate * self.policy.smoothing)
+
+
+LIMITS: dict[str, type[AdaptiveLimit]] = {limit.algorithm: limit for limit in (AIMDLimit, GradientLimit)}
+
+
+def create_limit(policy: AdaptivePolicy, previous: AdaptiveLimit | None = None) -> AdaptiveLimit:
+    """The limit learned so far is kept across configuration reloads that do not change the policy"""
+    if previous is not None and previous.policy == policy:
+        return previous
+    return LIMITS[policy.algorithm](policy)
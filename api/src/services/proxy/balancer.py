@@ -0,0 +1,257 @@
+import abc
+import random
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import final
+from src.services.proxy.adaptive import AdaptiveLimit, AdaptivePolicy, create_limit
+
+# Weight of the newest sample in the latency moving average
+EWMA_ALPHA = 0.3
+# Repeated ejections double the ejection time, up to this factor
+MAX_EJECTION_BACKOFF = 10
+# Statuses telling the upstream itself is unwell, a 500 is the answer of one path of the application
+FAILURE_STATUSES = frozenset({502, 503, 504})
+
+
+def is_upstream_failure(status_code: int) -> bool:
+    return status_code in FAILURE_STATUSES
+
+
+@final
+@dataclass(frozen=True, slots=True)
+class HealthPolicy:
+    """Per-route active health check and passive outlier ejection settings"""
+    path: str | None = None         # Active checks are disabled without a path
+    interval: float = 10.0
+    timeout: float = 2.0
+    expected_status: int = 200
+    max_failures: int = 5           # Consecutive errors/timeouts before ejecting the upstream
+    ejection_seconds: float = 30.0
+    passive_ejection: bool = False  # Requests failing also eject, never the last upstream in rotation
+
+
+@final
+class CircuitState:
+    CLOSED = "closed"           # Healthy, receives traffic
+    OPEN = "open"               # Ejected, receives nothing until the ejection expires
+    HALF_OPEN = "half_open"     # Ejection expired, a single probe decides between closed and open
+
+
+class NoHealthyUpstream(Exception):
+    """Every upstream of the route is ejected"""
+    def __init__(self, retry_after: float, message: str = "No healthy upstream available"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamOverloaded(NoHealthyUpstream):
+    """Every available upstream of the route is at its adaptive concurrency limit"""
+    def __init__(self):
+        super().__init__(1.0, "Upstream concurrency limit reached")
+
+
+@final
+class Upstream:
+    """Live state of one upstream target of a route, including its circuit breaker"""
+    __slots__ = (
+        "url", "weight", "health", "outstanding", "requests", "errors", "ewma_latency",
+        "state", "consecutive_failures", "ejections", "ejected_until", "probing", "next_health_check",
+        "adaptive", "shed", "peers",
+    )
+
+    def __init__(self, url: str, weight: int = 1, health: HealthPolicy | None = None):
+        self.url: str = url
+        self.weight: int = weight
+        self.health: HealthPolicy = health or HealthPolicy()
+        self.outstanding: int = 0
+        self.requests: int = 0
+        self.errors: int = 0
+        self.ewma_latency: float = 0.0     # Seconds until the response headers, 0 until sampled
+        self.state: str = CircuitState.CLOSED
+        self.consecutive_failures: int = 0
+        self.ejections: int = 0            # Consecutive ejections, drives the backoff
+        self.ejected_until: float = 0.0
+        self.probing: bool = False
+        self.next_health_check: float = 0.0
+        self.adaptive: AdaptiveLimit | None = None     # None when in-flight requests are not limited
+        self.shed: int = 0                              # Requests turned away at the adaptive limit
+        self.peers: list[Upstream] = []                 # Upstreams of the route, set by its balancer
+
+    def is_available(self, now: float) -> bool:
+        """Whether the upstream may take a request, moves an expired ejection to half-open"""
+        if self.state == CircuitState.OPEN and now >= self.ejected_until:
+            self.state = CircuitState.HALF_OPEN
+        if self.state == CircuitState.HALF_OPEN:
+            return not self.probing
+        return self.state == CircuitState.CLOSED
+
+    def has_capacity(self) -> bool:
+        return self.adaptive is None or self.outstanding < self.adaptive.current
+
+    def acquire(self) -> None:
+        self.outstanding += 1
+        self.requests += 1
+        if self.state == CircuitState.HALF_OPEN:
+            self.probing = True
+
+    def release(self, latency: float | None, error: bool | None) -> None:
+        """
+        Record the outcome of a request, `latency` is None when no response was received.
+        `error` is a transport error, a timeout or a FAILURE_STATUSES answer.
+        `error` None is a request given up on the client side (disconnect, body too large):
+        it tells nothing about the upstream, and neither feeds the breaker nor the adaptive limit.
+        Requests only feed the breaker with passive ejection.
+        """
+        if error is None:
+            self.outstanding -= 1
+            self.probing = False
+            return
+        if self.adaptive is not None:
+            self.adaptive.update(latency, error, self.outstanding)
+        self.outstanding -= 1
+        if error:
+            self.errors += 1
+        if latency is not None:
+            if self.ewma_latency == 0.0:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency += EWMA_ALPHA * (latency - self.ewma_latency)
+        if self.health.passive_ejection:
+            self.record(not error, passive=True)
+        else:
+            self.probing = False
+
+    def record(self, success: bool, passive: bool = False) -> None:
+        """
+        Feed the circuit breaker with the outcome of a health check, or of a request when `passive`.
+        Requests never eject the last upstream of the route in rotation: the route would answer 503
+        to everything over errors that may be those of a few paths.
+        """
+        self.probing = False
+        if success:
+            self.consecutive_failures = 0
+            self.ejections = 0
+            self.state = CircuitState.CLOSED
+            return
+        self.consecutive_failures += 1
+        if self.state == CircuitState.HALF_OPEN or (
+            self.state == CircuitState.CLOSED and self.consecutive_failures >= self.health.max_failures
+        ):
+            if passive and not any(peer is not self and peer.state == CircuitState.CLOSED for peer in self.peers):
+                return
+            self.eject()
+
+    def eject(self) -> None:
+        backoff = min(2 ** self.ejections, MAX_EJECTION_BACKOFF)
+        self.ejections += 1
+        self.state = CircuitState.OPEN
+        self.ejected_until = time.monotonic() + self.health.ejection_seconds * backoff
+
+
+class Balancer(abc.ABC):
+    """Picks the upstream serving each request of a route among the ones not ejected"""
+    policy: str
+
+    def __init__(self, upstreams: list[Upstream]):
+        self.upstreams = upstreams
+        for upstream in upstreams:
+            upstream.peers = upstreams
+
+    def pick(self) -> Upstream:
+        """
+        Raises NoHealthyUpstream instead of waiting on a dead backend,
+        and UpstreamOverloaded instead of queueing on backends at their adaptive limit
+        """
+        now = time.monotonic()
+        candidates = [upstream for upstream in self.upstreams if upstream.is_available(now)]
+        if not candidates:
+            retry_after = min(upstream.ejected_until for upstream in self.upstreams) - now
+            raise NoHealthyUpstream(max(retry_after, 1.0))
+        with_capacity = [upstream for upstream in candidates if upstream.has_capacity()]
+        if not with_capacity:
+            for upstream in candidates:
+                upstream.shed += 1
+            raise UpstreamOverloaded()
+        return self.choose(with_capacity)
+
+    @abc.abstractmethod
+    def choose(self, candidates: list[Upstream]) -> Upstream:
+        ...
+
+
+@final
+class RoundRobinBalancer(Balancer):
+    """Smooth weighted round-robin, spreads heavier upstreams instead of sending them bursts"""
+    policy = "round_robin"
+
+    def __init__(self, upstreams: list[Upstream]):
+        super().__init__(upstreams)
+        self._current: dict[Upstream, int] = {upstream: 0 for upstream in upstreams}
+
+    def choose(self, candidates: list[Upstream]) -> Upstream:
+        total = 0
+        best: Upstream | None = None
+        for upstream in candidates:
+            self._current[upstream] += upstream.weight
+            total += upstream.weight
+            if best is None or self._current[upstream] > self._current[best]:
+                best = upstream
+        assert best is not None, "a route always has at least one upstream"
+        self._current[best] -= total
+        return best
+
+
+@final
+class LeastOutstandingBalancer(Balancer):
+    """Upstream with the fewest in-flight requests relative to its weight"""
+    policy = "least_outstanding"
+
+    def choose(self, candidates: list[Upstream]) -> Upstream:
+        return min(candidates, key=lambda upstream: (upstream.outstanding + 1) / upstream.weight)
+
+
+@final
+class PowerOfTwoChoicesBalancer(Balancer):
+    """
+    Sample two upstreams by weight and keep the one with the lowest latency * load,
+    adapts to slow upstreams without the herding of always choosing the global best
+    """
+    policy = "p2c_ewma"
+
+    def choose(self, candidates: list[Upstream]) -> Upstream:
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.choices(candidates, weights=[upstream.weight for upstream in candidates], k=2)
+        return min(first, second, key=lambda upstream: upstream.ewma_latency * (upstream.outstanding + 1))
+
+
+BALANCERS: dict[str, type[Balancer]] = {
+    balancer.policy: balancer
+    for balancer in (RoundRobinBalancer, LeastOutstandingBalancer, PowerOfTwoChoicesBalancer)
+}
+
+
+def create_balancer(
+    policy: str,
+    targets: Iterable[tuple[str, int]],
+    previous: Balancer | None = None,
+    health: HealthPolicy | None = None,
+    adaptive: AdaptivePolicy | None = None
+) -> Balancer:
+    """
+    Build the balancer of a route from its (url, weight) targets
+    Upstreams already known by `previous` keep their live state across configuration reloads
+    With `adaptive` each upstream gets its own concurrency limit
+    """
+    health = health or HealthPolicy()
+    known = {upstream.url: upstream for upstream in previous.upstreams} if previous else {}
+    upstreams: list[Upstream] = []
+    for url, weight in targets:
+        upstream = known.get(url) or Upstream(url, weight, health)
+        upstream.weight = weight
+        upstream.health = health
+        upstream.adaptive = create_limit(adaptive, upstream.adaptive) if adaptive else None
+        upstreams.append(upstream)
+    balancer_class = BALANCERS.get(policy, RoundRobinBalancer)
+    return balancer_class(upstreams)
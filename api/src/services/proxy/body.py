@@ -0,0 +1,90 @@
+import tempfile
+from collections.abc import AsyncIterator
+from typing import final
+import anyio
+from fastapi import Request
+
+SPOOL_READ_CHUNK_SIZE = 64 * 1024
+
+
+class RequestBodyTooLarge(Exception):
+    """The client sent more bytes than the route allows"""
+    def __init__(self, max_body_size: int):
+        super().__init__(f"Request body exceeds {max_body_size} bytes")
+        self.max_body_size = max_body_size
+
+
+def has_request_body(request: Request) -> bool:
+    """Whether the client announced a body, GETs without one must not be sent chunked upstream"""
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        return content_length != "0"
+    return "transfer-encoding" in request.headers
+
+
+def check_content_length(request: Request, max_body_size: int | None) -> None:
+    """Reject a body announced as too large before reading any of it"""
+    content_length = request.headers.get("content-length")
+    if max_body_size is not None and content_length and content_length.isdigit():
+        if int(content_length) > max_body_size:
+            raise RequestBodyTooLarge(max_body_size)
+
+
+async def stream_request_body(request: Request, max_body_size: int | None = None) -> AsyncIterator[bytes]:
+    """Relay the client body as it is received, enforcing the size limit on the fly"""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if max_body_size is not None and received > max_body_size:
+            raise RequestBodyTooLarge(max_body_size)
+        if chunk:
+            yield chunk
+
+
+@final
+class SpooledRequestBody:
+    """
+    Request body kept in memory up to `max_memory` bytes and spilled to a temporary file beyond.
+    Unlike a streamed body it can be iterated several times, e.g. to replay it on a retry.
+    """
+    def __init__(self, max_memory: int):
+        self.max_memory = max_memory
+        self.size = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+
+    @classmethod
+    async def from_request(cls, request: Request, max_memory: int, max_body_size: int | None = None) -> "SpooledRequestBody":
+        body = cls(max_memory)
+        try:
+            async for chunk in stream_request_body(request, max_body_size):
+                await body.write(chunk)
+        except BaseException:
+            body.close()
+            raise
+        return body
+
+    @property
+    def on_disk(self) -> bool:
+        return self.size > self.max_memory
+
+    async def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        # Once spilled, file I/O goes to a worker thread to keep the event loop free
+        if self.on_disk:
+            await anyio.to_thread.run_sync(self._file.write, chunk)
+        else:
+            self._file.write(chunk)
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        self._file.seek(0)
+        while True:
+            if self.on_disk:
+                chunk = await anyio.to_thread.run_sync(self._file.read, SPOOL_READ_CHUNK_SIZE)
+            else:
+                chunk = self._file.read(SPOOL_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self) -> None:
+        self._file.close()
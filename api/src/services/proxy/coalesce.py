@@ -0,0 +1,255 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable, Mapping
+from dataclasses import dataclass
+from logging import Logger
+from typing import Any, final
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from src.services.cache.policy import CREDENTIAL_HEADERS
+from src.services.proxy.service import UpstreamStreamingResponse
+
+# Bytes of body kept for followers, larger responses stop being shared
+MAX_BUFFER_SIZE = 1024 * 1024
+
+
+@final
+@dataclass(frozen=True, slots=True)
+class CoalescePolicy:
+    """Per-route single-flight settings"""
+    vary_headers: tuple[str, ...] = ("accept", "accept-encoding")    # Request headers that select a distinct response
+    max_wait: float = 10.0      # Seconds a follower waits for the shared response before going upstream itself
+    max_buffer_size: int = MAX_BUFFER_SIZE     # Bytes of body kept for followers
+
+    @classmethod
+    def from_options(cls, options: Mapping[str, Any] | None) -> "CoalescePolicy | None":
+        """Build the policy of a route from its stored `coalesce` column, None when coalescing is off"""
+        if not options or not options.get("enabled"):
+            return None
+        vary_headers = options.get("vary_headers")
+        return cls(
+            vary_headers=tuple(name.lower() for name in vary_headers) if vary_headers is not None else cls.vary_headers,
+            max_wait=options.get("max_wait", cls.max_wait),
+            max_buffer_size=options.get("max_buffer_size", MAX_BUFFER_SIZE),
+        )
+
+
+def coalesce_key(request: Request, prefix: str, vary_headers: Iterable[str], extra_headers: Mapping[str, str]) -> str:
+    """Identical upstream requests share a key: method, route, target path and selecting headers"""
+    path = getattr(request.state, "rewritten_path", request.url.path)
+    parts = [request.method, prefix, f"{path}?{request.url.query}"]
+    # Credentials are always part of the key, responses are never shared between different clients
+    parts.extend(f"{name}={request.headers.get(name, '')}" for name in (*CREDENTIAL_HEADERS, *vary_headers))
+    parts.extend(f"{name}={value}" for name, value in sorted(extra_headers.items()))
+    return "\n".join(parts)
+
+
+@final
+class _Flight:
+    """
+    One upstream call, its body recorded so every waiting request can replay it.
+    Once the flight stops being shared, chunks every reader is past are dropped,
+    and the upstream is read no faster than the slowest reader, within `max_buffer_size` bytes.
+    """
+    __slots__ = (
+        "headers_ready", "changed", "drained", "status_code", "headers", "chunks", "offset", "size", "buffered",
+        "max_buffer_size", "shared", "positions", "readers", "pump", "done", "error",
+    )
+
+    def __init__(self, max_buffer_size: int):
+        self.headers_ready = asyncio.Event()
+        self.changed = asyncio.Condition()
+        self.drained = asyncio.Event()      # Set when the pump may read on
+        self.status_code: int = 0
+        self.headers: list[tuple[str, str]] = []
+        self.chunks: list[bytes] = []
+        self.offset: int = 0        # Chunks dropped from the front of `chunks`
+        self.size: int = 0          # Bytes received from upstream
+        self.buffered: int = 0      # Bytes of `chunks`
+        self.max_buffer_size = max_buffer_size
+        self.shared: bool = True    # Requests may still join
+        self.positions: dict[int, int] = {}     # Next chunk of every reader
+        self.readers: int = 0
+        self.pump: asyncio.Task[None] | None = None
+        self.done: bool = False
+        self.error: BaseException | None = None
+
+    def join(self) -> int:
+        reader = self.readers
+        self.readers += 1
+        self.positions[reader] = 0
+        return reader
+
+    def leave(self, reader: int) -> None:
+        self.positions.pop(reader, None)
+        self._trim()
+        if not self.shared and not self.positions and not self.done and self.pump is not None:
+            # Nobody left to read the rest of the body
+            self.pump.cancel()
+
+    def append(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self.buffered += len(chunk)
+
+    async def wait_for_readers(self) -> None:
+        """Hold the pump while the slowest reader is more than `max_buffer_size` bytes behind"""
+        while not self.shared and self.positions and self.buffered > self.max_buffer_size:
+            self.drained.clear()
+            await self.drained.wait()
+
+    def stop_sharing(self) -> None:
+        self.shared = False
+        self._trim()
+
+    def _trim(self) -> None:
+        if self.shared:
+            return
+        oldest = min(self.positions.values(), default=self.offset + len(self.chunks))
+        if oldest > self.offset:
+            dropped = oldest - self.offset
+            self.buffered -= sum(len(chunk) for chunk in self.chunks[:dropped])
+            del self.chunks[:dropped]
+            self.offset = oldest
+        if self.buffered <= self.max_buffer_size or not self.positions:
+            self.drained.set()
+
+    async def replay(self, reader: int) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                while self.positions[reader] < self.offset + len(self.chunks):
+                    chunk = self.chunks[self.positions[reader] - self.offset]
+                    self.positions[reader] += 1
+                    self._trim()
+                    yield chunk
+                if self.done:
+                    break
+                async with self.changed:
+                    await self.changed.wait_for(lambda: self.done or self.positions[reader] < self.offset + len(self.chunks))
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.leave(reader)
+
+    async def notify(self) -> None:
+        async with self.changed:
+            self.changed.notify_all()
+
+
+@final
+class RequestCoalescer:
+    """
+    Single-flight for proxied requests: concurrent identical requests share one upstream call.
+    The upstream body is pumped by a task of its own and replayed to every request in the flight,
+    so a leader disconnecting does not cut the response of its followers.
+    Past `max_buffer_size` bytes the flight takes no more followers and keeps only the chunks
+    its readers still need, requests arriving later go upstream on their own. The upstream is then read
+    at the pace of the slowest reader, and given up once every reader has left.
+    """
+    def __init__(self, logger: Logger):
+        self.logger = logger
+        self.flights = 0        # Upstream calls made on behalf of a flight
+        self.joined = 0         # Requests served by a flight they did not start
+        self._flights: dict[str, _Flight] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def forward(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[StreamingResponse]],
+        max_wait: float,
+        max_buffer_size: int = MAX_BUFFER_SIZE
+    ) -> StreamingResponse:
+        """
+        Join the flight of `key` or start it with `fetch`, a follower not answered within `max_wait`
+        or whose flight stopped being shared fetches on its own
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(max_buffer_size)
+            self._flights[key] = flight
+            self.flights += 1
+            reader = flight.join()
+            task = flight.pump = asyncio.create_task(self._pump(key, flight, fetch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            try:
+                await flight.headers_ready.wait()
+            except BaseException:
+                flight.leave(reader)
+                raise
+        else:
+            reader = flight.join()
+            try:
+                await asyncio.wait_for(flight.headers_ready.wait(), max_wait)
+            except asyncio.TimeoutError:
+                flight.leave(reader)
+                self.logger.warning(f"Coalesced request waited more than {max_wait}s, forwarding it on its own")
+                return await fetch()
+            except BaseException:
+                flight.leave(reader)
+                raise
+            if not flight.shared:
+                flight.leave(reader)
+                return await fetch()
+            self.joined += 1
+
+        if flight.error is not None and not flight.status_code:
+            flight.leave(reader)
+            raise flight.error
+        response = StreamingResponse(flight.replay(reader), status_code=flight.status_code)
+        # Raw headers keep repeated ones such as Set-Cookie
+        response.raw_headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in flight.headers]
+        return response
+
+    def _stop_sharing(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        flight.stop_sharing()
+
+    async def _pump(self, key: str, flight: _Flight, fetch: Callable[[], Awaitable[StreamingResponse]]) -> None:
+        response: StreamingResponse | None = None
+        try:
+            response = await fetch()
+            flight.status_code = response.status_code
+            flight.headers = list(response.headers.items())
+            content_length = response.headers.get("content-length")
+            if content_length and content_length.isdigit() and int(content_length) > flight.max_buffer_size:
+                # Followers waiting for the headers go upstream on their own
+                self._stop_sharing(key, flight)
+            flight.headers_ready.set()
+            async for chunk in response.body_iterator:
+                flight.append(chunk if isinstance(chunk, bytes) else bytes(chunk))
+                if flight.shared and flight.size > flight.max_buffer_size:
+                    self._stop_sharing(key, flight)
+                await flight.notify()
+                await flight.wait_for_readers()
+                if not flight.shared and not flight.positions:
+                    break       # Every reader left before the flight stopped being shared
+        except BaseException as e:
+            flight.error = e
+            if not isinstance(e, Exception):
+                raise
+            if flight.status_code:
+                self.logger.error(f"Upstream body of a coalesced request failed: {str(e)}")
+        finally:
+            # Requests arriving from now on start a new flight
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.done = True
+            flight.headers_ready.set()
+            await flight.notify()
+            if response is not None:
+                # A body left midway is closed now rather than when collected
+                close_body = getattr(response.body_iterator, "aclose", None)
+                if close_body is not None:
+                    await close_body()
+            if isinstance(response, UpstreamStreamingResponse):
+                await response.aclose()
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
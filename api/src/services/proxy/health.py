@@ -0,0 +1,81 @@
+import asyncio
+from logging import Logger
+import time
+from typing import final
+import httpx
+from src.services.gateway.config_service import get_route_table
+from src.services.proxy.balancer import CircuitState, Upstream
+from src.services.proxy.pool import UpstreamClientPool
+
+# How often the scheduler looks for upstreams due for a check, per-route intervals are multiples of it
+HEALTH_CHECK_TICK_SECONDS = 1.0
+
+
+@final
+class HealthChecker:
+    """
+    Background scheduler probing the upstreams of every route with a health check path.
+    Probe outcomes feed the same circuit breaker as proxied requests: failures eject
+    the upstream, a successful probe brings an ejected one back.
+    """
+    def __init__(self, pool: UpstreamClientPool, logger: Logger, tick: float = HEALTH_CHECK_TICK_SECONDS):
+        self.pool = pool
+        self.logger = logger
+        self.tick = tick
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def check_due(self) -> None:
+        """Probe, concurrently, every upstream whose check interval has elapsed"""
+        now = time.monotonic()
+        due: list[Upstream] = []
+        for route in get_route_table().routes.values():
+            if not route.balancer:
+                continue
+            for upstream in route.balancer.upstreams:
+                # A half-open upstream already serving its trial request is left to that request
+                if upstream.health.path and not upstream.probing and upstream.next_health_check <= now:
+                    upstream.next_health_check = now + upstream.health.interval
+                    due.append(upstream)
+        if due:
+            await asyncio.gather(*(self.probe(upstream) for upstream in due))
+
+    async def probe(self, upstream: Upstream) -> bool:
+        health = upstream.health
+        url = f"{upstream.url}{health.path}"
+        try:
+            response = await self.pool.get_client(upstream.url).get(url, timeout=health.timeout)
+            healthy = response.status_code == health.expected_status
+            reason = f"status {response.status_code}"
+        except httpx.HTTPError as e:
+            healthy = False
+            reason = f"{type(e).__name__}: {str(e)}"
+
+        was_closed = upstream.state == CircuitState.CLOSED
+        upstream.record(healthy)
+        if healthy and not was_closed:
+            self.logger.info(f"Upstream {upstream.url} passed its health check, back in rotation")
+        elif not healthy:
+            self.logger.warning(f"Health check {url} failed ({reason}), upstream is {upstream.state}")
+        return healthy
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.check_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Health check scheduler error: {str(e)}")
+            await asyncio.sleep(self.tick)
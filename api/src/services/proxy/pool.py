@@ -0,0 +1,86 @@
+import importlib.util
+from logging import Logger
+from typing import final
+from fastapi import Request
+import httpx
+from src.settings import Settings
+from src.types.upstream import UpstreamPoolStats
+
+
+def upstream_origin(url: str) -> str:
+    """Normalize a target URL to the scheme://host:port used as pool key"""
+    parsed = httpx.URL(url)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    return f"{parsed.scheme}://{parsed.host}:{port}"
+
+
+@final
+class UpstreamClientPool:
+    """
+    Long-lived HTTP clients, one per upstream origin, so connections are kept alive
+    and reused between proxied requests instead of a new TCP/TLS handshake per call.
+    """
+    def __init__(self, settings: Settings, logger: Logger):
+        self.logger = logger
+        self.limits = httpx.Limits(
+            max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY_SECONDS,
+        )
+        self.timeout = httpx.Timeout(
+            settings.UPSTREAM_TIMEOUT_SECONDS,
+            connect=settings.UPSTREAM_CONNECT_TIMEOUT_SECONDS,
+        )
+        self.http2 = settings.UPSTREAM_HTTP2
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("UPSTREAM_HTTP2 is enabled but the 'h2' package is not installed, falling back to HTTP/1.1")
+            self.http2 = False
+        self._clients: dict[str, httpx.AsyncClient] = {}
+
+    def get_client(self, target_url: str) -> httpx.AsyncClient:
+        """Get the client for the upstream serving `target_url`, created on first use"""
+        origin = upstream_origin(target_url)
+        client = self._clients.get(origin)
+        if client is None:
+            self.logger.info(f"Opening connection pool to upstream {origin} (http2={self.http2})")
+            client = httpx.AsyncClient(
+                follow_redirects=True,
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+            )
+            self._clients[origin] = client
+        return client
+
+    def stats(self) -> dict[str, UpstreamPoolStats]:
+        """Connection usage per upstream, read from the underlying httpcore pools"""
+        stats: dict[str, UpstreamPoolStats] = {}
+        for origin, client in self._clients.items():
+            # httpx does not expose its pool, reach through the default transport when we can
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+            requests = list(getattr(pool, "_requests", []))
+            idle = sum(1 for connection in connections if connection.is_idle())
+            waiting = sum(1 for request in requests if request.is_queued())
+            stats[origin] = UpstreamPoolStats(
+                connections=len(connections),
+                idle=idle,
+                active=len(connections) - idle,
+                waiting=waiting,
+                max_connections=self.limits.max_connections,
+                http2=self.http2,
+            )
+        return stats
+
+    async def close(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+async def get_upstream_pool(request: Request) -> UpstreamClientPool | None:
+    """
+    Dependency that provides the upstream client pool from app state.
+    Ex: pool: UpstreamClientPool | None = Depends(get_upstream_pool)
+    """
+    return getattr(request.app.state, "upstream_pool", None)
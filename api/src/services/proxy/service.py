@@ -1,15 +1,138 @@
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable, Mapping
 from logging import Logger
+import time
+from typing import final
+import anyio
 from fastapi import Request
 from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
 import httpx
+from src.services.proxy.balancer import Balancer, NoHealthyUpstream, is_upstream_failure
+from src.services.proxy.body import (
+    SpooledRequestBody,
+    check_content_length,
+    has_request_body,
+    stream_request_body,
+)
+from src.services.proxy.pool import UpstreamClientPool
 
+# Headers only meaningful for a single connection, never relayed by a proxy (RFC 9110 7.6.1)
+HOP_BY_HOP_HEADERS = frozenset({
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+})
 
-async def forward_request(request: Request, target_url: str, logger: Logger) -> StreamingResponse:
+
+def relayed_headers(headers: Mapping[str, str]) -> dict[str, str]:
+    """Upstream response headers to send back, Content-Length is kept so the body is not re-chunked"""
+    return {key: value for key, value in headers.items() if key.lower() not in HOP_BY_HOP_HEADERS}
+
+
+@final
+class UpstreamStreamingResponse(StreamingResponse):
+    """
+    Relay the upstream body chunk by chunk as it arrives.
+    The client socket applies backpressure on the upstream read, and the upstream stream
+    is always released, including when the client disconnects mid-body.
+    """
+    def __init__(self, upstream: httpx.Response, on_close: Callable[[], Awaitable[None]] | None = None):
+        super().__init__(
+            self._relay(upstream),
+            status_code=upstream.status_code,
+            headers=relayed_headers(upstream.headers),
+        )
+        self.upstream = upstream
+        self.on_close = on_close
+        self.completed = False      # The whole body was relayed
+        self.failed = False         # The upstream failed mid-body
+        self._closed = False
+
+    async def _relay(self, upstream: httpx.Response) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in upstream.aiter_raw():
+                yield chunk
+        except httpx.HTTPError:
+            self.failed = True
+            raise
+        self.completed = True
+
+    async def aclose(self) -> None:
+        """Release the upstream connection, safe to call more than once"""
+        if self._closed:
+            return
+        self._closed = True
+        await self.upstream.aclose()
+        if self.on_close:
+            await self.on_close()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Shielded so a disconnect cancelling the response still closes the upstream stream
+            with anyio.CancelScope(shield=True):
+                await self.aclose()
+
+
+async def forward_request(
+    request: Request,
+    target_url: str,
+    logger: Logger,
+    pool: UpstreamClientPool | None = None,
+    stream: bool = True,
+    max_body_size: int | None = None,
+    body: SpooledRequestBody | None = None,
+    balancer: Balancer | None = None,
+    extra_headers: Mapping[str, str] | None = None
+) -> StreamingResponse:
     """
     Forward the incoming request to the target URL while preserving headers and method
+    Uses a pooled keep-alive client when `pool` is given, else a one-shot client
+    With `stream` the upstream body is relayed as it arrives, else it is buffered first
+    The client body is piped upstream as it is received unless an already spooled `body` is given,
+    raises RequestBodyTooLarge once more than `max_body_size` bytes are received
+    With a `balancer` the upstream is picked per request and replaces `target_url`,
+    raises NoHealthyUpstream right away when all of them are ejected or at their adaptive concurrency limit
+    `extra_headers` are added to, or replace, the client headers sent upstream
     """
-    client = httpx.AsyncClient(follow_redirects=True)
-    
+    try:
+        upstream = balancer.pick() if balancer else None
+    except NoHealthyUpstream:
+        # No response will release the body, a spooled one may hold a temporary file
+        if body is not None:
+            body.close()
+        raise
+    if upstream:
+        target_url = upstream.url
+        upstream.acquire()
+    # Latency of the request is also accounted to the upstream that served it
+    request.state.upstream_url = target_url
+    client = pool.get_client(target_url) if pool else httpx.AsyncClient(follow_redirects=True)
+    started = time.perf_counter()
+    latency: float | None = None
+    # None until the upstream tells something: a request given up on the client side leaves the breaker alone
+    error: bool | None = None
+    relayed: UpstreamStreamingResponse | None = None
+
+    async def release():
+        """Free everything held for this request, once the response is fully relayed"""
+        if body is not None:
+            body.close()
+        if not pool:
+            await client.aclose()
+        if upstream:
+            outcome = error
+            if relayed is not None and not relayed.completed:
+                # Failing mid-body is an upstream error, a client leaving mid-body says nothing of a healthy answer
+                outcome = True if relayed.failed else (error or None)
+            upstream.release(latency, outcome)
+
     # Build the target URL - use rewritten path if it exists
     path = getattr(request.state, "rewritten_path", request.url.path)
     query = str(request.url.query)
@@ -18,44 +141,69 @@ async def forward_request(request: Request, target_url: str, logger: Logger) ->
         target_path = f"{target_path}?{query}"
 
     logger.debug(f"Forwarding request to: {target_path}")
-    
-    # Get the request body if it exists
-    body = await request.body()
-    
-    # Forward all headers except host
-    headers = dict(request.headers)
+
+    # Forward all headers except host and the ones tied to the client connection
+    headers = {key: value for key, value in request.headers.items() if key not in HOP_BY_HOP_HEADERS}
     headers.pop("host", None)
-    
+    if extra_headers:
+        headers.update(extra_headers)
+
     try:
-        # Make the request to the target service
+        # Pick the body source, it is only read while the upstream request is being sent
+        content: AsyncIterable[bytes] | None = None
+        if body is not None:
+            content = body
+            headers["content-length"] = str(body.size)
+        elif has_request_body(request):
+            check_content_length(request, max_body_size)
+            content = stream_request_body(request, max_body_size)
+
+        # Make the request to the target service, only the headers are read here
         logger.debug("Making request to target service")
-        response = await client.request(
+        upstream_request = client.build_request(
             method=request.method,
             url=target_path,
             headers=headers,
-            content=body,
-            timeout=30.0
+            content=content,
+            timeout=pool.timeout if pool else 30.0
         )
+        response = await client.send(upstream_request, stream=True)
+        latency = time.perf_counter() - started
+        error = is_upstream_failure(response.status_code)
         logger.debug(f"Received response from target service. Status: {response.status_code}, Content-Length: {response.headers.get('content-length')}")
-
-        # Read the entire response content
-        content = await response.aread()
-        logger.debug(f"Read response content, size: {len(content)} bytes")
-        await client.aclose()
-
-        # Create an async generator to stream the buffered content
-        async def response_generator():
-            logger.debug("Starting to stream buffered response")
-            yield content
-            logger.debug("Finished streaming buffered response")
-
-        logger.debug("Creating StreamingResponse")
-        return StreamingResponse(
-            response_generator(),
-            status_code=response.status_code,
-            headers=dict(response.headers)
-        )
     except httpx.RequestError as e:
-        await client.aclose()
+        error = True
+        await release()
         logger.error(f"Error forwarding request to {target_path}: {str(e)}")
-        raise httpx.RequestError(f"Error forwarding request: {str(e)}") 
+        raise httpx.RequestError(f"Error forwarding request: {str(e)}") from e
+    except BaseException:
+        await release()
+        raise
+
+    if stream:
+        relayed = UpstreamStreamingResponse(response, on_close=release)
+        return relayed
+
+    # Buffered mode: read the entire (still encoded) response content before answering
+    try:
+        buffered = b"".join([chunk async for chunk in response.aiter_raw()])
+        logger.debug(f"Read response content, size: {len(buffered)} bytes")
+    except httpx.HTTPError:
+        error = True
+        raise
+    except BaseException:
+        # Cancelled on the client side, a healthy answer is not blamed for it
+        error = error or None
+        raise
+    finally:
+        await response.aclose()
+        await release()
+
+    async def response_generator():
+        yield buffered
+
+    return StreamingResponse(
+        response_generator(),
+        status_code=response.status_code,
+        headers=relayed_headers(response.headers)
+    )
@@ -0,0 +1,145 @@
+import abc
+from collections.abc import Sequence
+from dataclasses import dataclass
+import math
+import time
+from typing import final
+from redis.asyncio import Redis
+from src.services.rate_limit.scripts import GCRA, GCRA_MULTI, SLIDING_WINDOW_COUNTER, LuaScript
+
+
+@final
+@dataclass(frozen=True, slots=True)
+class RateLimitResult:
+    """Outcome of one rate limit check, durations in seconds"""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: float            # Until the limit is fully available again
+    retry_after: float      # Until the next request may be allowed, 0 when allowed
+    window: float
+    algorithm: str
+    policy: str = "route"   # Name of the limit, as reported in RateLimit-Policy
+
+
+class RateLimitAlgorithm(abc.ABC):
+    """Decides, in a single Redis round trip, whether a request under `key` is allowed"""
+    name: str
+
+    @abc.abstractmethod
+    async def check(self, redis: Redis, key: str, limit: int, window: float, cost: int = 1) -> RateLimitResult:
+        ...
+
+
+class _ScriptAlgorithm(RateLimitAlgorithm):
+    """Algorithm run as a Lua script keeping O(1) state per key"""
+    script: LuaScript
+
+    async def check(self, redis: Redis, key: str, limit: int, window: float, cost: int = 1) -> RateLimitResult:
+        allowed, remaining, reset_ms, retry_after_ms = await self.script(
+            redis, [key], [limit, max(int(window * 1000), 1), cost]
+        )
+        return RateLimitResult(
+            allowed=bool(allowed),
+            limit=limit,
+            remaining=int(remaining),
+            reset=int(reset_ms) / 1000,
+            retry_after=int(retry_after_ms) / 1000,
+            window=window,
+            algorithm=self.name,
+        )
+
+
+@final
+class GCRAAlgorithm(_ScriptAlgorithm):
+    """Generic Cell Rate Algorithm, smooth rate with bursts up to the limit"""
+    name = "gcra"
+    script = GCRA
+
+
+@final
+class SlidingWindowCounterAlgorithm(_ScriptAlgorithm):
+    """Weighted current + previous fixed window counts, approximates a sliding window"""
+    name = "sliding_window_counter"
+    script = SLIDING_WINDOW_COUNTER
+
+
+@final
+class SlidingWindowLogAlgorithm(RateLimitAlgorithm):
+    """
+    Exact sliding window keeping one sorted set member per request, memory grows with the limit.
+    Kept for routes relying on its exact counting.
+    """
+    name = "sliding_window_log"
+
+    async def check(self, redis: Redis, key: str, limit: int, window: float, cost: int = 1) -> RateLimitResult:
+        current = time.time()
+        current_us = int(current * 1000000)  # Microseconds for uniqueness
+        window_start = current - window
+
+        async with redis.pipeline(transaction=True) as pipe:
+            # Remove old requests, add the current ones and count the window
+            await pipe.zremrangebyscore(key, 0, window_start)
+            await pipe.zadd(key, {f"{current_us}:{index}": current for index in range(cost)})
+            await pipe.zcount(key, window_start, '+inf')
+            await pipe.zrange(key, 0, 0, withscores=True)
+            await pipe.expire(key, max(math.ceil(window), 1))
+            _, _, count, oldest, _ = await pipe.execute()
+
+        # The window frees up as the oldest request in it expires
+        oldest_score = oldest[0][1] if oldest else current
+        reset = max(oldest_score + window - current, 0.0)
+        allowed = count <= limit
+        return RateLimitResult(
+            allowed=allowed,
+            limit=limit,
+            remaining=max(limit - count, 0),
+            reset=reset,
+            retry_after=0.0 if allowed else reset,
+            window=window,
+            algorithm=self.name,
+        )
+
+
+ALGORITHMS: dict[str, RateLimitAlgorithm] = {
+    algorithm.name: algorithm
+    for algorithm in (GCRAAlgorithm(), SlidingWindowCounterAlgorithm(), SlidingWindowLogAlgorithm())
+}
+
+
+def get_algorithm(name: str | None, default: str) -> RateLimitAlgorithm:
+    return ALGORITHMS.get(name or default) or ALGORITHMS[default]
+
+
+@final
+@dataclass(frozen=True, slots=True)
+class StackedLimit:
+    """One limit applying to a request, with the Redis key it is counted under"""
+    name: str
+    key: str
+    limit: int
+    window: float
+
+
+async def check_stacked(redis: Redis, limits: Sequence[StackedLimit], cost: int = 1) -> tuple[StackedLimit, RateLimitResult]:
+    """
+    Evaluate GCRA for every limit in one script call, the request is counted in all of them or in none.
+    Returns the limit that decided, the one to wait for the longest when denied, else the one with the least left.
+    """
+    arguments: list[int] = [cost]
+    for limit in limits:
+        arguments.extend((limit.limit, max(int(limit.window * 1000), 1)))
+    allowed, index, remaining, reset_ms, retry_after_ms = await GCRA_MULTI(
+        redis, [limit.key for limit in limits], arguments
+    )
+    decided = limits[int(index) - 1]
+    return decided, RateLimitResult(
+        allowed=bool(allowed),
+        limit=decided.limit,
+        remaining=int(remaining),
+        reset=int(reset_ms) / 1000,
+        retry_after=int(retry_after_ms) / 1000,
+        window=decided.window,
+        algorithm=GCRAAlgorithm.name,
+        policy=decided.name,
+    )
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from dataclasses import replace
+import time
+from typing import final
+from fastapi import Request
+from src.services.rate_limit.algorithms import RateLimitResult
+
+
+@final
+class BlockedClients:
+    """
+    Negative cache of rate limited keys: until the limiter said the next request may be allowed,
+    requests under the key are rejected without any Redis I/O. Bounded, the oldest blocks go first.
+    """
+    def __init__(self, max_keys: int = 10_000):
+        self.max_keys = max_keys
+        self.rejections = 0     # Requests rejected from the cache
+        # key -> (monotonic time the block ends, the denial that started it and when)
+        self._blocked: OrderedDict[str, tuple[float, float, RateLimitResult]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._blocked)
+
+    def block(self, key: str, result: RateLimitResult) -> None:
+        if result.allowed or result.retry_after <= 0:
+            return
+        now = time.monotonic()
+        self._blocked.pop(key, None)
+        self._blocked[key] = (now + result.retry_after, now, result)
+        if len(self._blocked) > self.max_keys:
+            self._blocked.popitem(last=False)
+
+    def get(self, key: str) -> RateLimitResult | None:
+        """The denial of a blocked key, times counted from now, None when the key is not blocked"""
+        blocked = self._blocked.get(key)
+        if blocked is None:
+            return None
+        until, since, result = blocked
+        now = time.monotonic()
+        if now >= until:
+            del self._blocked[key]
+            return None
+        self.rejections += 1
+        elapsed = now - since
+        return replace(
+            result,
+            remaining=0,
+            reset=max(result.reset - elapsed, 0.0),
+            retry_after=until - now,
+        )
+
+    def clear(self) -> None:
+        self._blocked.clear()
+
+
+def get_blocked_clients(request: Request) -> BlockedClients | None:
+    return getattr(request.app.state, "blocked_clients", None)
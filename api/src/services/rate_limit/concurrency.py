@@ -0,0 +1,228 @@
+import asyncio
+from collections import deque
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass, field
+from itertools import count
+from logging import Logger
+import time
+from typing import Any, final
+import uuid
+from fastapi import Request
+from src.services.rate_limit.keys import KeyExtractor, create_extractor
+from src.services.rate_limit.scripts import CONCURRENCY_ACQUIRE
+from src.services.storage.breaker import RedisBreakers, RedisUnavailable
+from src.services.storage.sharding import RateLimitRedis, tagged
+
+# Back-off of a request polling Redis for a slot while queued
+POLL_MIN_SECONDS = 0.005
+POLL_MAX_SECONDS = 0.1
+
+
+@final
+@dataclass(frozen=True, slots=True)
+class ConcurrencyPolicy:
+    """In-flight requests allowed on a route, in total and per key"""
+    limit: int | None = None            # Whole route, None for no cap
+    per_key_limit: int | None = None    # Per value of the key, None for no cap
+    extractors: tuple[KeyExtractor, ...] = field(default=())
+    queue_timeout: float = 0.0          # Seconds a request waits for a slot, 0 rejects at once
+    distributed: bool = False           # Leases in Redis shared by every node, else per worker
+    lease_seconds: float = 60.0         # Leases not released by then are dropped, covers a node dying mid-request
+
+    @classmethod
+    def from_options(cls, options: Mapping[str, Any] | None) -> "ConcurrencyPolicy | None":
+        """Build the policy of a route from its stored `concurrency` column, None when in-flight requests are not capped"""
+        if not options or not options.get("enabled"):
+            return None
+        if options.get("limit") is None and options.get("per_key_limit") is None:
+            return None
+        return cls(
+            limit=options.get("limit"),
+            per_key_limit=options.get("per_key_limit"),
+            extractors=tuple(create_extractor(key) for key in options.get("key") or [{"type": "client_ip"}]),
+            queue_timeout=options.get("queue_timeout", cls.queue_timeout),
+            distributed=options.get("distributed", cls.distributed),
+            lease_seconds=options.get("lease_seconds", cls.lease_seconds),
+        )
+
+    def slots(self, request: Request, namespace: str) -> list[tuple[str, int]]:
+        """
+        (key, limit) of the slots the request takes, the per key one first so a busy client is turned
+        away before it holds a route slot. The per key cap does not apply when the request lacks a key part.
+        """
+        slots: list[tuple[str, int]] = []
+        if self.per_key_limit is not None:
+            parts: list[str] = []
+            for extractor in self.extractors:
+                value = extractor.extract(request)
+                if value is None:
+                    break
+                parts.append(f"{extractor.kind}={value}")
+            else:
+                key = f"rate_limit:{namespace}:in_flight:{tagged(parts[0])}{''.join(f':{part}' for part in parts[1:])}"
+                slots.append((key, self.per_key_limit))
+        if self.limit is not None:
+            slots.append((f"rate_limit:{namespace}:in_flight", self.limit))
+        return slots
+
+
+@final
+class _Slots:
+    """Holders and queued requests of one key"""
+    __slots__ = ("in_flight", "waiters")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.waiters: deque[asyncio.Future[None]] = deque()
+
+
+@final
+class LocalConcurrencyLimiter:
+    """Per worker semaphores, keys are dropped once nothing holds nor waits on them"""
+    def __init__(self):
+        self._slots: dict[str, _Slots] = {}
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def in_flight(self, key: str) -> int:
+        slots = self._slots.get(key)
+        return slots.in_flight if slots else 0
+
+    async def acquire(self, key: str, limit: int, timeout: float) -> bool:
+        slots = self._slots.setdefault(key, _Slots())
+        if slots.in_flight < limit and not slots.waiters:
+            slots.in_flight += 1
+            return True
+        if timeout <= 0:
+            self._drop_idle(key, slots)
+            return False
+        # Queued in arrival order, a released slot is handed over to the oldest waiter
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        slots.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended
+                self.release(key)
+            else:
+                try:
+                    slots.waiters.remove(waiter)
+                except ValueError:
+                    pass
+                self._drop_idle(key, slots)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return False
+
+    def release(self, key: str) -> None:
+        slots = self._slots.get(key)
+        if slots is None:
+            return
+        while slots.waiters:
+            waiter = slots.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        slots.in_flight -= 1
+        self._drop_idle(key, slots)
+
+    def _drop_idle(self, key: str, slots: _Slots) -> None:
+        if slots.in_flight <= 0 and not slots.waiters:
+            self._slots.pop(key, None)
+
+    def clear(self) -> None:
+        self._slots.clear()
+
+
+@final
+class ConcurrencyPermit:
+    """Slots held by one request, released once whatever the number of calls"""
+    __slots__ = ("_limiter", "_held")
+
+    def __init__(self, limiter: "ConcurrencyLimiter", held: list[tuple[str, str | None]]):
+        self._limiter = limiter
+        self._held = held
+
+    async def release(self) -> None:
+        held, self._held = self._held, []
+        await self._limiter.release(held)
+
+
+@final
+class ConcurrencyLimiter:
+    """
+    Caps in-flight requests. Slots are taken from per worker semaphores, or with `distributed` policies
+    from Redis leases shared by every node, falling back to the semaphores while Redis is unavailable.
+    """
+    def __init__(self, logger: Logger, store: RateLimitRedis | None = None, breakers: RedisBreakers | None = None):
+        self.logger = logger
+        self.store = store
+        self.breakers = breakers
+        self.local = LocalConcurrencyLimiter()
+        self.rejected = 0
+        self._node = uuid.uuid4().hex[:12]
+        self._leases = count()
+
+    async def acquire(self, slots: Sequence[tuple[str, int]], policy: ConcurrencyPolicy) -> ConcurrencyPermit | None:
+        """Take every slot or none of them, None when one is still busy after the queue timeout"""
+        deadline = time.monotonic() + policy.queue_timeout
+        held: list[tuple[str, str | None]] = []
+        try:
+            for key, limit in slots:
+                lease = await self._acquire(key, limit, policy, deadline)
+                if lease is False:
+                    self.rejected += 1
+                    await self.release(held)
+                    return None
+                held.append((key, lease))
+        except BaseException:
+            await asyncio.shield(self.release(held))
+            raise
+        return ConcurrencyPermit(self, held)
+
+    async def _acquire(self, key: str, limit: int, policy: ConcurrencyPolicy, deadline: float) -> str | None | bool:
+        """Lease id of a Redis slot, None for a local one, False when none was free in time"""
+        if policy.distributed and self.store is not None:
+            try:
+                return await self._acquire_lease(key, limit, policy, deadline)
+            except RedisUnavailable:
+                self.logger.debug(f"Redis unavailable, counting in-flight requests of {key} in process")
+        taken = await self.local.acquire(key, limit, max(deadline - time.monotonic(), 0.0))
+        return None if taken else False
+
+    async def _acquire_lease(self, key: str, limit: int, policy: ConcurrencyPolicy, deadline: float) -> str | bool:
+        assert self.store is not None
+        redis = self.store.client_for(key)
+        lease = f"{self._node}:{next(self._leases)}"
+        args = (limit, int(policy.lease_seconds * 1000), lease)
+        delay = POLL_MIN_SECONDS
+        async def operation():
+            return await CONCURRENCY_ACQUIRE(redis, [key], args)
+
+        while True:
+            if await (self.breakers.run(redis, operation) if self.breakers else operation()):
+                return lease
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return False
+            await asyncio.sleep(min(delay, left))
+            delay = min(delay * 2, POLL_MAX_SECONDS)
+
+    async def release(self, held: Sequence[tuple[str, str | None]]) -> None:
+        for key, lease in held:
+            if lease is None:
+                self.local.release(key)
+                continue
+            assert self.store is not None
+            try:
+                await self.store.client_for(key).zrem(key, lease)
+            except Exception as e:
+                # The lease expires on its own
+                self.logger.warning(f"Failed to release in-flight lease of {key}: {str(e)}")
+
+
+def get_concurrency_limiter(request: Request) -> ConcurrencyLimiter | None:
+    return getattr(request.app.state, "concurrency_limiter", None)
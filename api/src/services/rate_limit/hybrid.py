@@ -0,0 +1,156 @@
+import asyncio
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass
+from logging import Logger
+import time
+from typing import Any, final
+from fastapi import Request
+from redis.asyncio import Redis
+from src.services.rate_limit.algorithms import GCRAAlgorithm, RateLimitResult
+from src.services.rate_limit.scripts import GCRA_LEASE
+
+
+@final
+@dataclass(frozen=True, slots=True)
+class HybridPolicy:
+    """Per-route split between local and global limiting, the lower the fractions the more accurate"""
+    lease_fraction: float = 0.05    # Share of the limit a worker leases from Redis at once
+    strict_fraction: float = 0.1    # Below this share of the limit left, every request is decided by Redis
+
+    @classmethod
+    def from_options(cls, options: Mapping[str, Any] | None) -> "HybridPolicy | None":
+        """Build the policy of a route from its stored `rate_limit_hybrid` column, None when limiting is global only"""
+        if not options or not options.get("enabled"):
+            return None
+        return cls(
+            lease_fraction=options.get("lease_fraction", cls.lease_fraction),
+            strict_fraction=options.get("strict_fraction", cls.strict_fraction),
+        )
+
+    def lease_size(self, limit: int) -> int:
+        return max(int(limit * self.lease_fraction), 1)
+
+    def lease_seconds(self, window: float) -> float:
+        """GCRA gives a lease worth of quota back in that time, older tokens would let the rate drift above the limit"""
+        return window * self.lease_fraction
+
+
+@final
+class _Lease:
+    """Quota of one key held by this worker, times are monotonic"""
+    __slots__ = ("tokens", "denied", "remaining", "reset_at", "retry_at", "expires_at", "refill")
+
+    def __init__(self, limit: int):
+        self.tokens: int = 0                # Requests that may still be allowed locally
+        self.denied: bool = False           # Redis had nothing left to lease last time
+        self.remaining: int = limit         # Quota left globally after the last lease
+        self.reset_at: float = 0.0
+        self.retry_at: float = 0.0
+        self.expires_at: float = 0.0
+        self.refill: asyncio.Task[None] | None = None
+
+    def near_limit(self, limit: int, policy: HybridPolicy) -> bool:
+        return self.denied or self.remaining < limit * policy.strict_fraction
+
+
+@final
+class QuotaLeases:
+    """
+    Hybrid local/global rate limiting. Requests are allowed from quota each worker leases from Redis
+    in batches, so a client far below its limit costs a Redis round trip per lease instead of per request.
+    A lease running low is refilled in the background, the tokens left in an expired one are given back
+    with the next lease. Near the limit leases shrink to a single request and Redis decides each of them.
+    """
+    def __init__(self, logger: Logger, max_keys: int = 10_000):
+        self.logger = logger
+        self.max_keys = max_keys
+        self.local_hits = 0     # Requests allowed without Redis I/O
+        self.lease_calls = 0    # Redis round trips
+        self._leases: OrderedDict[str, _Lease] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._leases)
+
+    async def check(self, redis: Redis, key: str, limit: int, window: float, policy: HybridPolicy) -> RateLimitResult:
+        """Spend one request of `key`, `key` holds the same GCRA state as the global limiter"""
+        lease = self._leases.get(key)
+        if lease is None:
+            lease = self._leases[key] = _Lease(limit)
+            if len(self._leases) > self.max_keys:
+                # Tokens of the evicted lease are lost, which only errs on the strict side
+                self._leases.popitem(last=False)
+        else:
+            self._leases.move_to_end(key)
+
+        while True:
+            now = time.monotonic()
+            if lease.tokens > 0 and now < lease.expires_at:
+                lease.tokens -= 1
+                self.local_hits += 1
+                if lease.tokens <= policy.lease_size(limit) // 2 and not lease.near_limit(limit, policy):
+                    self._refill(redis, key, lease, limit, window, policy)
+                return self._result(True, lease, limit, window, now)
+
+            # Every request waiting on an empty lease shares a single refill, one of them giving up must not cancel it
+            await asyncio.shield(self._refill(redis, key, lease, limit, window, policy))
+            if lease.denied:
+                return self._result(False, lease, limit, window, time.monotonic())
+
+    def _refill(self, redis: Redis, key: str, lease: _Lease, limit: int, window: float, policy: HybridPolicy) -> asyncio.Task[None]:
+        if lease.refill is None:
+            lease.refill = asyncio.create_task(self._lease(redis, key, lease, limit, window, policy))
+            lease.refill.add_done_callback(self._log_failure)
+        return lease.refill
+
+    async def _lease(self, redis: Redis, key: str, lease: _Lease, limit: int, window: float, policy: HybridPolicy) -> None:
+        try:
+            refund = 0
+            if lease.tokens and time.monotonic() >= lease.expires_at:
+                refund, lease.tokens = lease.tokens, 0
+            requested = 1 if lease.near_limit(limit, policy) else policy.lease_size(limit)
+            granted, remaining, reset_ms, retry_after_ms = await GCRA_LEASE(
+                redis, [key], [limit, max(int(window * 1000), 1), requested, refund]
+            )
+            self.lease_calls += 1
+            now = time.monotonic()
+            lease.denied = not granted
+            lease.remaining = int(remaining)
+            lease.reset_at = now + int(reset_ms) / 1000
+            lease.retry_at = now + int(retry_after_ms) / 1000
+            if granted:
+                lease.tokens += int(granted)
+                lease.expires_at = now + policy.lease_seconds(window)
+        finally:
+            lease.refill = None
+
+    def _log_failure(self, task: asyncio.Task[None]) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(f"Error leasing rate limit quota: {str(task.exception())}")
+
+    @staticmethod
+    def _result(allowed: bool, lease: _Lease, limit: int, window: float, now: float) -> RateLimitResult:
+        return RateLimitResult(
+            allowed=allowed,
+            limit=limit,
+            # Tokens held here are not spent yet
+            remaining=min(lease.remaining + lease.tokens, limit) if allowed else 0,
+            reset=max(lease.reset_at - now, 0.0),
+            retry_after=0.0 if allowed else max(lease.retry_at - now, 0.0),
+            window=window,
+            algorithm=GCRAAlgorithm.name,
+        )
+
+    def clear(self) -> None:
+        self._leases.clear()
+
+    async def close(self) -> None:
+        tasks = [lease.refill for lease in self._leases.values() if lease.refill is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._leases.clear()
+
+
+def get_quota_leases(request: Request) -> QuotaLeases | None:
+    return getattr(request.app.state, "quota_leases", None)
@@ -0,0 +1,219 @@
+import abc
+import base64
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass, field
+import functools
+import hashlib
+import ipaddress
+import json
+from typing import Any, final, override
+from fastapi import Request
+from src.services.storage.sharding import tagged
+
+
+class KeyExtractor(abc.ABC):
+    """Reads one part of a rate limit key from the request, None when the request does not have it"""
+    kind: str
+
+    @abc.abstractmethod
+    def extract(self, request: Request) -> str | None:
+        ...
+
+
+def _digest(value: str) -> str:
+    """Credentials and free-form values are not written to Redis as is"""
+    return hashlib.sha256(value.encode()).hexdigest()[:32]
+
+
+@functools.cache
+def parse_network(value: str) -> ipaddress.IPv4Network | ipaddress.IPv6Network:
+    """Address or CIDR network of a trusted proxy, raises ValueError when it is neither"""
+    return ipaddress.ip_network(value.strip(), strict=False)
+
+
+@final
+class ClientIpKey(KeyExtractor):
+    """
+    Address of the client. X-Forwarded-For is only read when the peer is one of `trusted_proxies`
+    (addresses or CIDR networks), the client is then its right-most address that is not a trusted proxy:
+    the addresses left of it were written by the client and prove nothing.
+    """
+    kind = "client_ip"
+
+    def __init__(self, trusted_proxies: Iterable[str] = ()):
+        self.networks = tuple(parse_network(proxy) for proxy in trusted_proxies)
+
+    def _trusted(self, address: str) -> bool:
+        try:
+            parsed = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(parsed in network for network in self.networks)
+
+    @override
+    def extract(self, request: Request) -> str | None:
+        peer = request.client.host if request.client else "unknown"
+        forwarded_for = request.headers.get("x-forwarded-for")
+        if not forwarded_for or not self.networks or not self._trusted(peer):
+            return peer
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        # Each trusted proxy appended the address it received the request from
+        for hop in reversed(hops):
+            if not self._trusted(hop):
+                return hop
+        return hops[0] if hops else peer
+
+
+@final
+class ApiKeyKey(KeyExtractor):
+    """API key sent in a header, or in a query parameter when `query` is set"""
+    kind = "api_key"
+
+    def __init__(self, header: str = "x-api-key", query: str | None = None):
+        self.header = header
+        self.query = query
+
+    @override
+    def extract(self, request: Request) -> str | None:
+        value = request.headers.get(self.header)
+        if not value and self.query:
+            value = request.query_params.get(self.query)
+        return _digest(value) if value else None
+
+
+@final
+class HeaderKey(KeyExtractor):
+    kind = "header"
+
+    def __init__(self, header: str):
+        self.header = header
+
+    @override
+    def extract(self, request: Request) -> str | None:
+        value = request.headers.get(self.header)
+        return _digest(value) if value else None
+
+
+@final
+class CookieKey(KeyExtractor):
+    kind = "cookie"
+
+    def __init__(self, cookie: str):
+        self.cookie = cookie
+
+    @override
+    def extract(self, request: Request) -> str | None:
+        value = request.cookies.get(self.cookie)
+        return _digest(value) if value else None
+
+
+@final
+class JwtClaimKey(KeyExtractor):
+    """
+    Claim of the bearer token. The signature is not verified here, keying on a claim is only
+    as trustworthy as the authentication in front of the upstream.
+    """
+    kind = "jwt_claim"
+
+    def __init__(self, claim: str, header: str = "authorization"):
+        self.claim = claim
+        self.header = header
+
+    @override
+    def extract(self, request: Request) -> str | None:
+        token = request.headers.get(self.header, "")
+        if token.lower().startswith("bearer "):
+            token = token[7:]
+        parts = token.strip().split(".")
+        if len(parts) != 3:
+            return None
+        try:
+            payload = parts[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        except (ValueError, UnicodeDecodeError):
+            return None
+        value = claims.get(self.claim) if isinstance(claims, dict) else None
+        return _digest(str(value)) if value is not None else None
+
+
+@final
+class PathSegmentKey(KeyExtractor):
+    """Segment of the request path, 0 being the first one after the leading slash"""
+    kind = "path_segment"
+
+    def __init__(self, index: int):
+        self.index = index
+
+    @override
+    def extract(self, request: Request) -> str | None:
+        segments = [segment for segment in request.url.path.split("/") if segment]
+        try:
+            return _digest(segments[self.index])
+        except IndexError:
+            return None
+
+
+EXTRACTORS: dict[str, type[KeyExtractor]] = {
+    extractor.kind: extractor
+    for extractor in (ClientIpKey, ApiKeyKey, HeaderKey, CookieKey, JwtClaimKey, PathSegmentKey)
+}
+
+
+def create_extractor(options: Mapping[str, Any]) -> KeyExtractor:
+    """Build an extractor from its stored options, `type` selects it and the other entries are its arguments"""
+    arguments = {name: value for name, value in options.items() if name != "type" and value is not None}
+    return EXTRACTORS[options["type"]](**arguments)
+
+
+@final
+@dataclass(frozen=True, slots=True)
+class LimitSpec:
+    """One of the limits stacked on a route"""
+    name: str
+    limit: int
+    window: float | None = None         # Seconds, None for RATE_LIMIT_WINDOW_SECONDS
+    scope: str = "route"                # "route" counts per route, "global" across every route using the same name
+    extractors: tuple[KeyExtractor, ...] = field(default=())
+
+    @classmethod
+    def from_options(cls, options: Mapping[str, Any]) -> "LimitSpec":
+        return cls(
+            name=options["name"],
+            limit=options["limit"],
+            window=options.get("window"),
+            scope=options.get("scope", "route"),
+            extractors=tuple(create_extractor(key) for key in options.get("key") or [{"type": "client_ip"}]),
+        )
+
+    def key(self, request: Request, namespace: str) -> str | None:
+        """
+        Redis key of the limit for this request, None when the request lacks one of its parts.
+        The first part is the hash tag, limits keyed on the same client stay on one slot or shard.
+        Route scoped limits live under the route `namespace`, see route_namespace.
+        """
+        parts: list[str] = []
+        for extractor in self.extractors:
+            value = extractor.extract(request)
+            if value is None:
+                return None
+            parts.append(f"{extractor.kind}={value}")
+        scope = namespace if self.scope == "route" else "*"
+        return f"rate_limit:{scope}:{self.name}:{tagged(parts[0])}{''.join(f':{part}' for part in parts[1:])}"
+
+
+def route_namespace(prefix: str, generation: int) -> str:
+    """
+    Key segment of the limits of a route. Bumping the route generation moves its limits to fresh keys,
+    the previous ones are no longer read and expire on their own.
+    """
+    return f"{prefix}@g{generation}"
+
+
+def namespace_pattern(prefix: str, generation: int) -> str:
+    """SCAN pattern matching the keys of one generation of a route"""
+    escaped = "".join(f"\\{char}" if char in "*?[]\\" else char for char in route_namespace(prefix, generation))
+    return f"rate_limit:{escaped}:*"
+
+
+def compile_limits(options: Iterable[Mapping[str, Any]] | None) -> tuple[LimitSpec, ...]:
+    return tuple(LimitSpec.from_options(limit) for limit in options or [])
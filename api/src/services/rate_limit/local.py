@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from collections.abc import Sequence
+import time
+from typing import final
+from fastapi import Request
+from src.services.rate_limit.algorithms import GCRAAlgorithm, RateLimitResult, StackedLimit
+
+
+@final
+class LocalRateLimiter:
+    """
+    In-process GCRA standing in for Redis while it is unavailable. Each worker counts on its own,
+    so the effective limit is multiplied by the number of workers until Redis is back.
+    """
+    def __init__(self, max_keys: int = 10_000):
+        self.max_keys = max_keys
+        self.decisions = 0
+        # key -> theoretical arrival time, monotonic seconds
+        self._tats: OrderedDict[str, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+    def check(self, limits: Sequence[StackedLimit], cost: int = 1) -> tuple[StackedLimit, RateLimitResult]:
+        """Same decision as the GCRA_MULTI script: counted in every limit or in none"""
+        self.decisions += 1
+        now = time.monotonic()
+        new_tats: list[float] = []
+        denied: tuple[StackedLimit, RateLimitResult] | None = None
+        decided: tuple[StackedLimit, RateLimitResult] | None = None
+        for limit in limits:
+            interval = limit.window / limit.limit
+            tat = max(self._tats.get(limit.key, now), now)
+            new_tat = tat + interval * cost
+            allow_at = new_tat - limit.window
+            if allow_at > now:
+                if denied is None or allow_at - now > denied[1].retry_after:
+                    denied = limit, self._result(False, limit, tat, now, allow_at - now)
+            else:
+                new_tats.append(new_tat)
+                result = self._result(True, limit, new_tat, now, 0.0)
+                if decided is None or result.remaining < decided[1].remaining:
+                    decided = limit, result
+        if denied is not None:
+            return denied
+        assert decided is not None, "at least one limit is checked"
+        for limit, new_tat in zip(limits, new_tats):
+            self._tats.pop(limit.key, None)
+            self._tats[limit.key] = new_tat
+        while len(self._tats) > self.max_keys:
+            self._tats.popitem(last=False)
+        return decided
+
+    @staticmethod
+    def _result(allowed: bool, limit: StackedLimit, tat: float, now: float, retry_after: float) -> RateLimitResult:
+        interval = limit.window / limit.limit
+        return RateLimitResult(
+            allowed=allowed,
+            limit=limit.limit,
+            remaining=max(int((limit.window - (tat - now)) / interval + 1e-9), 0),
+            reset=max(tat - now, 0.0),
+            retry_after=retry_after,
+            window=limit.window,
+            algorithm=GCRAAlgorithm.name,
+            policy=limit.name,
+        )
+
+    def clear(self) -> None:
+        self._tats.clear()
+
+
+def get_local_rate_limiter(request: Request) -> LocalRateLimiter | None:
+    return getattr(request.app.state, "local_rate_limiter", None)
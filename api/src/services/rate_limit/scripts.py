@@ -0,0 +1,218 @@
+import hashlib
+from collections.abc import Sequence
+from typing import final
+from redis.asyncio import Redis
+from redis.exceptions import NoScriptError
+
+
+@final
+class LuaScript:
+    """
+    Server-side script run with EVALSHA, the source is only sent again (SCRIPT LOAD)
+    when Redis does not know it yet, e.g. after a restart or a failover
+    """
+    def __init__(self, source: str):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+
+    async def load(self, redis: Redis) -> None:
+        await redis.script_load(self.source)
+
+    async def __call__(self, redis: Redis, keys: Sequence[str], args: Sequence[int | float | str]):
+        try:
+            return await redis.evalsha(self.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            await self.load(redis)
+            return await redis.evalsha(self.sha, len(keys), *keys, *args)
+
+
+# The scripts read the clock of the Redis server so every worker agrees on time,
+# the rate limit ones reply {allowed, remaining, reset_ms, retry_after_ms}
+
+# Generic Cell Rate Algorithm: a single "theoretical arrival time" per key.
+# Each request pushes it by limit/window, requests are allowed while it stays within one window of now.
+# KEYS[1] state key, ARGV[1] limit, ARGV[2] window (ms), ARGV[3] cost
+GCRA = LuaScript("""
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local interval = window / limit
+
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+local new_tat = tat + interval * cost
+local allow_at = new_tat - window
+
+if allow_at > now then
+    local remaining = math.max(math.floor((window - (tat - now)) / interval), 0)
+    return {0, remaining, math.ceil(tat - now), math.ceil(allow_at - now)}
+end
+
+redis.call('SET', KEYS[1], string.format('%.3f', new_tat), 'PX', math.ceil(new_tat - now))
+local remaining = math.max(math.floor((window - (new_tat - now)) / interval), 0)
+return {1, remaining, math.ceil(new_tat - now), 0}
+""")
+
+# Sliding window counter: counts of the current and previous fixed windows in a hash,
+# the previous one weighted by how much of it still overlaps the sliding window.
+# KEYS[1] state key, ARGV[1] limit, ARGV[2] window (ms), ARGV[3] cost
+SLIDING_WINDOW_COUNTER = LuaScript("""
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local current_start = now - (now % window)
+local previous_start = current_start - window
+local current_field = string.format('%d', current_start)
+local counts = redis.call('HMGET', KEYS[1], current_field, string.format('%d', previous_start))
+local current = tonumber(counts[1]) or 0
+local previous = tonumber(counts[2]) or 0
+local elapsed = now - current_start
+local estimated = previous * (window - elapsed) / window + current
+local reset = window - elapsed
+
+if estimated + cost > limit then
+    local retry_after
+    if current + cost > limit or previous == 0 then
+        retry_after = reset
+    else
+        -- Wait until the previous window weighs little enough
+        local weight = (limit - current - cost) / previous
+        retry_after = math.max(math.ceil(window * (1 - weight) - elapsed), 1)
+    end
+    return {0, math.max(math.floor(limit - estimated), 0), reset, retry_after}
+end
+
+redis.call('HINCRBY', KEYS[1], current_field, cost)
+if redis.call('HLEN', KEYS[1]) > 2 then
+    -- Older windows no longer count, keep the hash at two fields at most
+    for _, field in ipairs(redis.call('HKEYS', KEYS[1])) do
+        if tonumber(field) < previous_start then
+            redis.call('HDEL', KEYS[1], field)
+        end
+    end
+end
+redis.call('PEXPIRE', KEYS[1], window * 2)
+return {1, math.max(math.floor(limit - estimated - cost), 0), reset, 0}
+""")
+
+# Quota lease on the GCRA state: grants up to ARGV[3] requests at once to be spent locally,
+# fewer when less is left. Tokens unused by the previous lease of the caller (ARGV[4]) are given back first.
+# Replies {granted, remaining, reset_ms, retry_after_ms}, retry_after_ms is 0 unless nothing was granted.
+# KEYS[1] state key (shared with GCRA), ARGV[1] limit, ARGV[2] window (ms), ARGV[3] requested, ARGV[4] refund
+GCRA_LEASE = LuaScript("""
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local refund = tonumber(ARGV[4])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local interval = window / limit
+
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+if refund > 0 then
+    tat = math.max(tat - interval * refund, now)
+end
+
+local granted = math.max(math.min(requested, math.floor((window - (tat - now)) / interval)), 0)
+if granted == 0 then
+    if refund > 0 then
+        if tat > now then
+            redis.call('SET', KEYS[1], string.format('%.3f', tat), 'PX', math.ceil(tat - now))
+        else
+            redis.call('DEL', KEYS[1])
+        end
+    end
+    return {0, 0, math.ceil(tat - now), math.max(math.ceil(tat + interval - window - now), 1)}
+end
+
+local new_tat = tat + interval * granted
+redis.call('SET', KEYS[1], string.format('%.3f', new_tat), 'PX', math.ceil(new_tat - now))
+local remaining = math.max(math.floor((window - (new_tat - now)) / interval), 0)
+return {granted, remaining, math.ceil(new_tat - now), 0}
+""")
+
+# GCRA over several stacked limits at once: the request is counted in all of them or in none.
+# Replies {allowed, index, remaining, reset_ms, retry_after_ms} for the limit that decided: the one
+# with the longest wait when denied, else the one with the least left. Indexes start at 1.
+# A negative cost gives requests back, to undo a part of a check that was denied elsewhere.
+# KEYS[i] state key of limit i, ARGV[1] cost, ARGV[2i] limit i, ARGV[2i + 1] window i (ms)
+GCRA_MULTI = LuaScript("""
+local cost = tonumber(ARGV[1])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local new_tats = {}
+local denied = {0, 0, 0, 0, 0}
+local binding = {1, 1, math.huge, 0, 0}
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[2 * i])
+    local window = tonumber(ARGV[2 * i + 1])
+    local interval = window / limit
+    local tat = tonumber(redis.call('GET', key))
+    if not tat or tat < now then
+        tat = now
+    end
+    local new_tat = tat + interval * cost
+    local allow_at = new_tat - window
+    if allow_at > now then
+        if allow_at - now > denied[5] then
+            local remaining = math.max(math.floor((window - (tat - now)) / interval), 0)
+            denied = {0, i, remaining, math.ceil(tat - now), math.ceil(allow_at - now)}
+        end
+    else
+        new_tats[i] = new_tat
+        local remaining = math.max(math.floor((window - (new_tat - now)) / interval), 0)
+        if remaining < binding[3] then
+            binding = {1, i, remaining, math.ceil(new_tat - now), 0}
+        end
+    end
+end
+
+if denied[2] > 0 then
+    return denied
+end
+for i, key in ipairs(KEYS) do
+    if new_tats[i] > now then
+        redis.call('SET', key, string.format('%.3f', new_tats[i]), 'PX', math.ceil(new_tats[i] - now))
+    else
+        redis.call('DEL', key)
+    end
+end
+return binding
+""")
+
+# In-flight requests shared by every node: a sorted set of leases scored by their expiry,
+# a lease is taken while fewer than the limit are live. Leases of a node that died expire on their own.
+# KEYS[1] leases, ARGV[1] limit, ARGV[2] lease duration (ms), ARGV[3] lease id; replies 1 when taken
+CONCURRENCY_ACQUIRE = LuaScript("""
+local limit = tonumber(ARGV[1])
+local duration = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + duration, ARGV[3])
+redis.call('PEXPIRE', KEYS[1], duration)
+return 1
+""")
+
+SCRIPTS = (GCRA, SLIDING_WINDOW_COUNTER, GCRA_LEASE, GCRA_MULTI, CONCURRENCY_ACQUIRE)
+
+
+async def load_scripts(redis: Redis) -> None:
+    """Register the rate limiting scripts once at startup, later calls only send their SHA"""
+    for script in SCRIPTS:
+        await script.load(redis)
@@ -0,0 +1,79 @@
+import asyncio
+from logging import Logger
+from typing import final
+from fastapi import Request
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from src.services.storage.sharding import RateLimitRedis
+
+
+@final
+class RateLimitSweeper:
+    """
+    Reclaims the keys of superseded route generations right away instead of leaving them to their TTL.
+    Patterns are swept one after the other in the background, SCAN by batches of `batch_size` keys,
+    each batch unlinked in a single pipeline round trip.
+    """
+    def __init__(self, store: RateLimitRedis, logger: Logger, batch_size: int = 500):
+        self.store = store
+        self.logger = logger
+        self.batch_size = batch_size
+        self.swept = 0
+        self._patterns: asyncio.Queue[str] = asyncio.Queue()
+        self._task: asyncio.Task[None] | None = None
+
+    def schedule(self, pattern: str) -> None:
+        """Queue the keys matching `pattern` for removal, returns at once"""
+        self._patterns.put_nowait(pattern)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while not self._patterns.empty():
+            pattern = self._patterns.get_nowait()
+            try:
+                removed = await self.sweep(pattern)
+            except (RedisError, OSError) as e:
+                self.logger.warning(f"Sweep of {pattern} stopped, its keys are left to expire: {type(e).__name__}: {str(e)}")
+                continue
+            self.logger.info(f"Swept {removed} stale rate limit keys matching {pattern}")
+
+    async def sweep(self, pattern: str) -> int:
+        removed = 0
+        for client in self.store.clients:
+            batch: list[bytes] = []
+            async for key in client.scan_iter(match=pattern, count=self.batch_size):
+                batch.append(key)
+                if len(batch) >= self.batch_size:
+                    removed += await self._unlink(client, batch)
+                    batch = []
+            if batch:
+                removed += await self._unlink(client, batch)
+        self.swept += removed
+        return removed
+
+    @staticmethod
+    async def _unlink(client: Redis, keys: list[bytes]) -> int:
+        # One key per command so a cluster pipeline can route each of them to its node
+        async with client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.unlink(key)
+            return sum(await pipe.execute())
+
+    async def wait(self) -> None:
+        """Until the queued sweeps are done"""
+        while self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def get_rate_limit_sweeper(request: Request) -> RateLimitSweeper | None:
+    return getattr(request.app.state, "rate_limit_sweeper", None)
@@ -0,0 +1,141 @@
+import asyncio
+from collections.abc import Callable, Mapping
+import json
+from logging import Logger
+import os
+import socket
+import time
+from typing import Any, final
+from fastapi import Request
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from src.services.request_tracking.histogram import LatencyHistogram
+from src.types.request_tracking import AggregatedMetrics, AggregatedRouteMetrics
+
+# Workers publishing, scored by their last publication, and what each published
+WORKERS_KEY = "metrics:workers"
+WORKER_KEY = "metrics:worker:{}"
+# Publications missed before a worker no longer counts
+MISSED_PUBLICATIONS = 3
+
+
+@final
+class RouteTotals:
+    """Counters and latency histogram of a gateway route, addable across workers and hosts"""
+    __slots__ = ("requests", "success", "errors", "rate_limited", "latency")
+
+    def __init__(self, requests: int = 0, success: int = 0, errors: int = 0, rate_limited: int = 0, latency: LatencyHistogram | None = None):
+        self.requests = requests
+        self.success = success
+        self.errors = errors
+        self.rate_limited = rate_limited
+        self.latency = latency if latency is not None else LatencyHistogram()
+
+    def merge(self, other: "RouteTotals") -> None:
+        self.requests += other.requests
+        self.success += other.success
+        self.errors += other.errors
+        self.rate_limited += other.rate_limited
+        self.latency.merge(other.latency)
+
+    def to_metrics(self) -> AggregatedRouteMetrics:
+        return AggregatedRouteMetrics(
+            total_requests=self.requests,
+            success_count=self.success,
+            error_count=self.errors,
+            rate_limited_count=self.rate_limited,
+            latency=self.latency.summary()
+        )
+
+    def encode(self) -> dict[str, Any]:
+        # Most latency buckets are empty, only the others are sent
+        buckets = {str(index): count for index, count in enumerate(self.latency.counts) if count}
+        return {
+            "counters": [self.requests, self.success, self.errors, self.rate_limited],
+            "latency": {"buckets": buckets, "total": self.latency.total, "max": self.latency.max},
+        }
+
+    @classmethod
+    def decode(cls, data: Mapping[str, Any]) -> "RouteTotals":
+        latency = LatencyHistogram()
+        for index, count in data["latency"]["buckets"].items():
+            latency.counts[int(index)] = count
+            latency.count += count
+        latency.total = data["latency"]["total"]
+        latency.max = data["latency"]["max"]
+        return cls(*data["counters"], latency=latency)
+
+
+def to_aggregated(workers: int, routes: Mapping[str, RouteTotals]) -> AggregatedMetrics:
+    return AggregatedMetrics(workers=workers, routes={prefix: totals.to_metrics() for prefix, totals in routes.items()})
+
+
+@final
+class RedisMetricsAggregator:
+    """
+    Metrics of deployments spanning several hosts: every worker publishes its own route totals to Redis
+    each `interval`, readers add up those of the workers seen within the last few publications.
+    A worker that stops publishing drops out of the sums once its publication expires.
+    """
+    def __init__(self, redis: Redis, collect: Callable[[], Mapping[str, RouteTotals]], logger: Logger, interval: float):
+        self.redis = redis
+        self.collect = collect
+        self.logger = logger
+        self.interval = interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # The last counts stay readable until they expire
+
+    async def publish(self) -> None:
+        payload = json.dumps({prefix: totals.encode() for prefix, totals in self.collect().items()})
+        ttl = max(int(self.interval * MISSED_PUBLICATIONS), 1)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(WORKER_KEY.format(self.worker_id), payload, ex=ttl)
+            pipe.zadd(WORKERS_KEY, {self.worker_id: time.time()})
+            await pipe.execute()
+
+    async def read(self) -> AggregatedMetrics:
+        """Sum of the routes of every worker that published recently"""
+        oldest = time.time() - self.interval * MISSED_PUBLICATIONS
+        await self.redis.zremrangebyscore(WORKERS_KEY, "-inf", f"({oldest}")
+        workers = await self.redis.zrange(WORKERS_KEY, 0, -1)
+        payloads = await self.redis.mget([WORKER_KEY.format(worker.decode()) for worker in workers]) if workers else []
+        routes: dict[str, RouteTotals] = {}
+        published = 0
+        for payload in payloads:
+            if payload is None:
+                continue
+            published += 1
+            for prefix, data in json.loads(payload).items():
+                totals = RouteTotals.decode(data)
+                if prefix in routes:
+                    routes[prefix].merge(totals)
+                else:
+                    routes[prefix] = totals
+        return to_aggregated(published, routes)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.publish()
+            except asyncio.CancelledError:
+                raise
+            except (RedisError, OSError) as e:
+                self.logger.warning(f"Failed to publish metrics to Redis: {type(e).__name__}: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+
+def get_metrics_aggregator(request: Request) -> RedisMetricsAggregator | None:
+    return getattr(request.app.state, "metrics_aggregator", None)
@@ -0,0 +1,101 @@
+from array import array
+from typing import final
+from src.types.request_tracking import LatencyPercentiles
+
+# Log-linear buckets over microseconds, as HdrHistogram does: values below 2 ** SUB_BITS get a bucket each,
+# every higher power of two is split in 2 ** (SUB_BITS - 1) buckets, a relative error under 1/32
+SUB_BITS = 6
+EXACT = 1 << SUB_BITS
+HALF = 1 << (SUB_BITS - 1)
+# Longer durations are counted in the last bucket, about 19 hours
+MAX_MICROSECONDS = (1 << 36) - 1
+BUCKETS = EXACT + (36 - SUB_BITS) * HALF
+
+
+def bucket_index(microseconds: int) -> int:
+    if microseconds < EXACT:
+        return max(microseconds, 0)
+    microseconds = min(microseconds, MAX_MICROSECONDS)
+    shift = microseconds.bit_length() - SUB_BITS
+    return EXACT + (shift - 1) * HALF + (microseconds >> shift) - HALF
+
+
+def bucket_upper_bound(index: int) -> int:
+    """Highest value counted in the bucket, in microseconds"""
+    if index < EXACT:
+        return index
+    offset = index - EXACT
+    shift = offset // HALF + 1
+    return (((offset % HALF + HALF) + 1) << shift) - 1
+
+
+@final
+class LatencyHistogram:
+    """
+    Fixed buckets so recording is an index computation and an increment, and histograms of
+    other workers or hosts merge by adding their counts bucket by bucket
+    """
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = array("q", bytes(8 * BUCKETS))
+        self.count = 0
+        self.total = 0      # Microseconds
+        self.max = 0
+
+    def record(self, seconds: float) -> None:
+        microseconds = int(seconds * 1_000_000)
+        self.counts[bucket_index(microseconds)] += 1
+        self.count += 1
+        self.total += microseconds
+        if microseconds > self.max:
+            self.max = microseconds
+
+    @classmethod
+    def from_counts(cls, counts: bytes, total: int, maximum: int) -> "LatencyHistogram":
+        """Histogram of bucket counts (int64) recorded elsewhere, `total` and `maximum` in microseconds"""
+        histogram = cls.__new__(cls)
+        histogram.counts = array("q", counts)
+        histogram.count = sum(histogram.counts)
+        histogram.total = total
+        histogram.max = maximum
+        return histogram
+
+    def copy(self) -> "LatencyHistogram":
+        """Frozen view of the histogram, to read while recording goes on"""
+        other = LatencyHistogram.__new__(LatencyHistogram)
+        other.counts = array("q", self.counts)
+        other.count = self.count
+        other.total = self.total
+        other.max = self.max
+        return other
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound in seconds of the bucket holding that share of the values, 0 when empty"""
+        if not self.count:
+            return 0.0
+        rank = max(fraction * self.count, 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_upper_bound(index), self.max) / 1_000_000
+        return self.max / 1_000_000
+
+    def summary(self) -> LatencyPercentiles:
+        return LatencyPercentiles(
+            count=self.count,
+            mean_ms=self.total / self.count / 1000 if self.count else 0.0,
+            p50_ms=self.percentile(0.5) * 1000,
+            p95_ms=self.percentile(0.95) * 1000,
+            p99_ms=self.percentile(0.99) * 1000,
+            max_ms=self.max / 1000,
+        )
@@ -0,0 +1,43 @@
+import asyncio
+from logging import Logger
+from typing import final
+from fastapi import Request
+from src.services.request_tracking.histogram import LatencyHistogram
+
+
+@final
+class EventLoopMonitor:
+    """
+    Sleeps `interval` at a time and records how late it wakes up: how long a ready callback
+    waits on a busy event loop, time added to every request in flight.
+    """
+    def __init__(self, logger: Logger, interval: float):
+        self.logger = logger
+        self.interval = interval
+        self.lag = LatencyHistogram()
+        self.last_lag = 0.0
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(loop.time() - expected, 0.0)
+            self.lag.record(self.last_lag)
+
+
+def get_loop_monitor(request: Request) -> EventLoopMonitor | None:
+    return getattr(request.app.state, "loop_monitor", None)
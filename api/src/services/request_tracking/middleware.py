@@ -1,17 +1,164 @@
 from fastapi import Request, HTTPException
-from datetime import datetime
-from typing import Dict, final
+from datetime import datetime, timezone
+from typing import final
 from src.settings import Settings
-from src.types.request_tracking import RequestMetric, RouteMetrics, RequestTrackingResponse
-from collections import defaultdict
-import asyncio
+from src.services.request_tracking.aggregation import RouteTotals
+from src.services.request_tracking.histogram import LatencyHistogram
+from src.services.request_tracking.shared_memory import SharedMetrics
+from src.services.request_tracking.timeseries import RouteRollups, clamp, query
+from src.types.request_tracking import LatencyMetrics, RequestMetric, RouteMetrics, RequestTrackingResponse, TimeSeriesResponse
+import time
 from logging import Logger
 from fastapi.responses import JSONResponse
 
+# Requests kept per route for the dashboard
+RECENT_REQUESTS = 100
+
+
+@final
+class GatewayTimings:
+    """Where the gateway spent the time of a request, set by the gateway middleware on request.state"""
+    __slots__ = ("rules", "upstream")
+
+    def __init__(self):
+        self.rules: float = 0.0
+        self.upstream: float | None = None     # None when the request was not forwarded
+
+
+@final
+class _LatencyStats:
+    """Histograms of the three phases of the requests of a route or upstream"""
+    __slots__ = ("total", "rules", "upstream")
+
+    def __init__(self):
+        self.total = LatencyHistogram()
+        self.rules = LatencyHistogram()
+        self.upstream = LatencyHistogram()
+
+    def record(self, total: float, timings: GatewayTimings | None) -> None:
+        self.total.record(total)
+        if timings is not None:
+            self.rules.record(timings.rules)
+            if timings.upstream is not None:
+                self.upstream.record(timings.upstream)
+
+    def to_metrics(self) -> LatencyMetrics:
+        return LatencyMetrics(total=self.total.summary(), rules=self.rules.summary(), upstream=self.upstream.summary())
+
+
+@final
+class _RecentRequest:
+    """Slot of the recent requests ring, overwritten in place"""
+    __slots__ = ("timestamp", "status_code", "method", "client_ip", "is_rate_limited")
+
+    def __init__(self):
+        self.timestamp: float = 0.0
+        self.status_code: int = 0
+        self.method: str = ""
+        self.client_ip: str = ""
+        self.is_rate_limited: bool = False
+
+
+@final
+class _RouteStats:
+    """
+    Counters of one path, plain integers only turned into a RouteMetrics when read.
+    No latency histograms here, paths are unbounded: latency is kept per gateway route.
+    """
+    __slots__ = ("total", "success", "errors", "rate_limited", "status_codes", "recent", "next_slot")
+
+    def __init__(self):
+        self.total = 0
+        self.success = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.status_codes: dict[int, int] = {}
+        # Allocated as the route gets traffic, then reused
+        self.recent: list[_RecentRequest] = []
+        self.next_slot = 0
+
+    def record(self, status_code: int, method: str, client_ip: str, is_rate_limited: bool, now: float) -> None:
+        self.total += 1
+        if is_rate_limited:
+            self.rate_limited += 1
+        elif 200 <= status_code < 400:
+            self.success += 1
+        else:
+            self.errors += 1
+        self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+
+        if len(self.recent) < RECENT_REQUESTS:
+            self.recent.append(_RecentRequest())
+        slot = self.recent[self.next_slot]
+        self.next_slot = (self.next_slot + 1) % RECENT_REQUESTS
+        slot.timestamp = now
+        slot.status_code = status_code
+        slot.method = method
+        slot.client_ip = client_ip
+        slot.is_rate_limited = is_rate_limited
+
+    def to_metrics(self, path: str) -> RouteMetrics:
+        # Oldest first, the next slot to overwrite is the oldest once the ring is full
+        ordered = self.recent[self.next_slot:] + self.recent[:self.next_slot] if len(self.recent) == RECENT_REQUESTS else self.recent
+        return RouteMetrics(
+            total_requests=self.total,
+            success_count=self.success,
+            error_count=self.errors,
+            rate_limited_count=self.rate_limited,
+            status_codes={str(code): count for code, count in self.status_codes.items()},
+            recent_requests=[
+                RequestMetric(
+                    timestamp=datetime.fromtimestamp(slot.timestamp, timezone.utc),
+                    status_code=slot.status_code,
+                    path=path,
+                    method=slot.method,
+                    client_ip=slot.client_ip,
+                    is_rate_limited=slot.is_rate_limited
+                )
+                for slot in ordered
+            ]
+        )
+
+
+@final
+class _GatewayRouteStats:
+    """Traffic of one gateway route, across all the paths under its prefix"""
+    __slots__ = ("success", "errors", "rate_limited", "status_codes", "rate_limit_decisions", "latency", "rollups")
+
+    def __init__(self):
+        self.success = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.status_codes: dict[int, int] = {}
+        self.rate_limit_decisions: dict[str, int] = {}
+        self.latency = _LatencyStats()
+        self.rollups = RouteRollups()
+
+    def record(self, status_code: int, is_rate_limited: bool, decision: str | None, duration: float, timings: GatewayTimings | None, now: float) -> None:
+        if is_rate_limited:
+            self.rate_limited += 1
+        elif 200 <= status_code < 400:
+            self.success += 1
+        else:
+            self.errors += 1
+        self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+        if decision is not None:
+            self.rate_limit_decisions[decision] = self.rate_limit_decisions.get(decision, 0) + 1
+        self.latency.record(duration, timings)
+        self.rollups.record(now, not is_rate_limited and not 200 <= status_code < 400, is_rate_limited, duration)
+
+    def totals(self) -> RouteTotals:
+        total = self.latency.total
+        return RouteTotals(total.count, self.success, self.errors, self.rate_limited, total.copy())
+
+
 @final
 class RequestTracker:
+    """
+    Per path request counters. Recording never awaits, so it needs no lock on the event loop,
+    and costs a few integer updates and one ring slot; the pydantic models are built when the metrics are read.
+    """
     _instance = None
-    _lock = asyncio.Lock()
     _initialized = False
 
     def __new__(cls, *args, **kwargs):
@@ -22,135 +169,104 @@ class RequestTracker:
     def initialize(self, logger: Logger | None = None):
         """Synchronous initialization for setup"""
         if not self._initialized:
-            if logger:
-                logger.debug("Initializing RequestTracker instance")
-            self.routes: dict[str, RouteMetrics] = {}
-            self.lock = asyncio.Lock()
+            self.routes: dict[str, _RouteStats] = {}
+            self.upstreams: dict[str, _LatencyStats] = {}
+            # Keyed by route prefix rather than path, so the number of series stays bounded
+            self.gateway_routes: dict[str, _GatewayRouteStats] = {}
+            # Host-wide counters, written along with the ones of this worker when the workers share memory
+            self.shared: SharedMetrics | None = None
             self.logger = logger
             self._initialized = True
             if logger:
                 logger.debug("RequestTracker instance initialized")
 
-    async def ensure_initialized(self):
-        """Async initialization check for middleware operations"""
-        if not self._initialized:
-            async with self._lock:
-                if not self._initialized:
-                    self.initialize(self.logger)
-
     def __init__(self, logger: Logger | None = None):
         # Initialize will be called separately
         pass
 
-    async def track_request(self, request: Request, status_code: int, is_rate_limited: bool = False):
-        await self.ensure_initialized()
-
-        if self.logger:
-            self.logger.debug(f"Tracking request for path: {request.url.path}, status: {status_code}, rate_limited: {is_rate_limited}")
-        
-        path = request.url.path
-        async with self.lock:
-            if path not in self.routes:
-                if self.logger:
-                    self.logger.debug(f"Creating new metrics entry for path: {path}")
-                self.routes[path] = RouteMetrics(
-                    total_requests=0,
-                    success_count=0,
-                    error_count=0,
-                    rate_limited_count=0,
-                    status_codes={},
-                    recent_requests=[]
-                )
-
-            metrics = self.routes[path]
-            
-            # Create new request metric
-            try:
-                request_metric = RequestMetric(
-                    timestamp=datetime.utcnow(),
-                    status_code=status_code,
-                    path=path,
-                    method=request.method,
-                    client_ip=request.client.host if request.client else "unknown",
-                    is_rate_limited=is_rate_limited
-                )
-                if self.logger:
-                    self.logger.debug(f"Created request metric: {request_metric}")
-            except Exception as e:
-                if self.logger:
-                    self.logger.error(f"Error creating request metric: {str(e)}")
-                raise
-
-            # Update counters
-            try:
-                metrics.total_requests += 1
-                if is_rate_limited:
-                    metrics.rate_limited_count += 1
-                elif 200 <= status_code < 400:
-                    metrics.success_count += 1
-                else:
-                    metrics.error_count += 1
-
-                # Update status code counts
-                status_str = str(status_code)
-                metrics.status_codes[status_str] = metrics.status_codes.get(status_str, 0) + 1
-
-                # Add to recent requests, keeping only last 100
-                metrics.recent_requests.append(request_metric)
-                metrics.recent_requests = metrics.recent_requests[-100:]
-
-                if self.logger:
-                    self.logger.debug(f"Updated metrics for path {path}: total={metrics.total_requests}, success={metrics.success_count}, error={metrics.error_count}, rate_limited={metrics.rate_limited_count}")
-            except Exception as e:
-                if self.logger:
-                    self.logger.error(f"Error updating metrics: {str(e)}")
-                raise
+    def track_request(self, request: Request, status_code: int, is_rate_limited: bool = False, duration: float | None = None) -> None:
+        """`duration` is the time the gateway took to answer, not recorded in the latency histograms when None"""
+        if not self._initialized:
+            self.initialize()
+        path: str = request.scope["path"]
+        stats = self.routes.get(path)
+        if stats is None:
+            stats = self.routes[path] = _RouteStats()
+        client = request.scope.get("client")
+        now = time.time()
+        stats.record(status_code, request.scope["method"], client[0] if client else "unknown", is_rate_limited, now)
+        if duration is None:
+            return
+        state = request.scope.get("state") or {}
+        timings: GatewayTimings | None = state.get("gateway_timings")
+        context = state.get("route_context")
+        if context is not None:
+            route = self.gateway_routes.get(context.prefix)
+            if route is None:
+                route = self.gateway_routes[context.prefix] = _GatewayRouteStats()
+            route.record(status_code, is_rate_limited, state.get("rate_limit_decision"), duration, timings, now)
+            if self.shared is not None:
+                self.shared.record(context.prefix, status_code, is_rate_limited, duration)
+        upstream_url: str | None = state.get("upstream_url")
+        if upstream_url is not None:
+            upstream = self.upstreams.get(upstream_url)
+            if upstream is None:
+                upstream = self.upstreams[upstream_url] = _LatencyStats()
+            upstream.record(duration, timings)
 
     async def get_metrics(self) -> RequestTrackingResponse:
-        await self.ensure_initialized()
-
-        if self.logger:
-            self.logger.debug(f"Retrieving metrics for {len(self.routes)} routes")
-            self.logger.debug(f"Current routes: {list(self.routes.keys())}")
+        if not self._initialized:
+            self.initialize()
         try:
-            async with self.lock:
-                response = RequestTrackingResponse(routes=self.routes.copy())
-                if self.logger:
-                    self.logger.debug("Successfully created metrics response")
-                return response
+            # Built without awaiting, the counters cannot move underneath
+            return RequestTrackingResponse(
+                routes={path: stats.to_metrics(path) for path, stats in self.routes.items()},
+                gateway_routes={prefix: stats.latency.to_metrics() for prefix, stats in self.gateway_routes.items()},
+                upstreams={url: stats.to_metrics() for url, stats in self.upstreams.items()}
+            )
         except Exception as e:
             if self.logger:
                 self.logger.error(f"Error creating metrics response: {str(e)}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"Failed to retrieve metrics: {str(e)}")
 
+    def route_totals(self) -> dict[str, RouteTotals]:
+        """Gateway routes of this worker, as published for the multi-host aggregation"""
+        if not self._initialized:
+            self.initialize()
+        return {prefix: stats.totals() for prefix, stats in self.gateway_routes.items()}
+
+    def get_timeseries(self, start: float, end: float, resolution: int | None = None, route: str | None = None) -> TimeSeriesResponse:
+        """Traffic of the routes between `start` and `end` (unix seconds), `resolution` None picks the finest available"""
+        if not self._initialized:
+            self.initialize()
+        now = time.time()
+        start, end = clamp(start, end, now)
+        routes = {
+            prefix: query(stats.rollups, start, end, now, resolution)
+            for prefix, stats in self.gateway_routes.items()
+            if route is None or prefix == route
+        }
+        return TimeSeriesResponse(start=start, end=end, routes=routes)
+
 def setup_request_tracking(app, settings: Settings, logger: Logger):
     if logger:
         logger.debug("Setting up request tracking middleware")
-    
+
     tracker = RequestTracker(logger)
     tracker.initialize(logger)  # Synchronous initialization
     app.state.request_tracker = tracker
 
     @app.middleware("http")
     async def request_tracking_middleware(request: Request, call_next):
-        if logger:
-            logger.debug(f"Request tracking middleware processing request to: {request.url.path}")
-        
+        path: str = request.scope["path"]
         # Skip tracking for admin routes, but NOT the metrics endpoint
-        if request.url.path.startswith("/admin") and request.url.path != "/admin/metrics":
-            if logger:
-                logger.debug(f"Skipping request tracking for admin path: {request.url.path}")
+        if path.startswith("/admin") and path != "/admin/metrics":
             return await call_next(request)
 
         try:
+            started = time.perf_counter()
             response = await call_next(request)
-            
-            # Track the request
-            is_rate_limited = response.status_code == 429
-            if logger:
-                logger.debug(f"Tracking request with status code: {response.status_code}, rate limited: {is_rate_limited}")
-            await tracker.track_request(request, response.status_code, is_rate_limited)
-            
+            tracker.track_request(request, response.status_code, response.status_code == 429, time.perf_counter() - started)
             return response
         except Exception as e:
             if logger:
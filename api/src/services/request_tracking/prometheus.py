@@ -0,0 +1,171 @@
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import final
+import numpy as np
+from src.database.base import query_latency
+from src.services.gateway.route_table import CompiledRoute
+from src.services.proxy.balancer import CircuitState
+from src.services.proxy.pool import UpstreamClientPool
+from src.services.rate_limit.concurrency import ConcurrencyLimiter
+from src.services.request_tracking.histogram import LatencyHistogram, bucket_index, bucket_upper_bound
+from src.services.request_tracking.loop_monitor import EventLoopMonitor
+from src.services.request_tracking.middleware import RequestTracker
+from src.services.request_tracking.shared_memory import SharedMetrics
+from src.services.storage.breaker import RedisBreakers
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Prometheus buckets (seconds), each counts the histogram buckets ending at or below its bound: never a value
+# above it, as `le` requires, and within the 1/32 relative error of the histogram below it
+LATENCY_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _bound_index(microseconds: int) -> int:
+    """Last histogram bucket holding no value above `microseconds`"""
+    index = bucket_index(microseconds)
+    return index if bucket_upper_bound(index) <= microseconds else index - 1
+
+
+_BOUND_INDEXES = np.array([_bound_index(round(bound * 1_000_000)) for bound in LATENCY_BOUNDS])
+
+type Sample = tuple[dict[str, str], float | LatencyHistogram]
+
+
+@final
+@dataclass(slots=True)
+class MetricFamily:
+    name: str
+    kind: str       # "counter", "gauge" or "histogram"
+    help: str
+    samples: list[Sample] = field(default_factory=list)
+
+    def add(self, value: float | LatencyHistogram, **labels: str) -> None:
+        self.samples.append((labels, value))
+
+
+def snapshot(
+    tracker: RequestTracker,
+    routes: Mapping[str, CompiledRoute],
+    pool: UpstreamClientPool | None = None,
+    breakers: RedisBreakers | None = None,
+    loop_monitor: EventLoopMonitor | None = None,
+    concurrency: ConcurrencyLimiter | None = None,
+    shared: SharedMetrics | None = None,
+) -> list[MetricFamily]:
+    """
+    Current values of the gateway metrics. Numbers and histogram copies only: it runs on the event loop
+    without awaiting, so nothing moves underneath, and leaves the formatting to `render`.
+    """
+    requests = MetricFamily("gateway_requests_total", "counter", "Requests answered per gateway route and status code")
+    duration = MetricFamily("gateway_request_duration_seconds", "histogram", "Time the gateway took to answer, per route")
+    rules = MetricFamily("gateway_rules_duration_seconds", "histogram", "Time spent in the gateway rules, per route")
+    decisions = MetricFamily("gateway_rate_limit_decisions_total", "counter", "Rate limit decisions per route")
+    for prefix, stats in tracker.gateway_routes.items():
+        for code, count in stats.status_codes.items():
+            requests.add(count, route=prefix, code=str(code))
+        duration.add(stats.latency.total.copy(), route=prefix)
+        rules.add(stats.latency.rules.copy(), route=prefix)
+        for decision, count in stats.rate_limit_decisions.items():
+            decisions.add(count, route=prefix, decision=decision)
+
+    upstream_duration = MetricFamily("gateway_upstream_duration_seconds", "histogram", "Time until the upstream response headers, per upstream")
+    for url, stats in tracker.upstreams.items():
+        upstream_duration.add(stats.upstream.copy(), upstream=url)
+
+    outstanding = MetricFamily("gateway_upstream_outstanding", "gauge", "Requests in flight per upstream")
+    upstream_requests = MetricFamily("gateway_upstream_requests_total", "counter", "Requests sent per upstream")
+    upstream_errors = MetricFamily("gateway_upstream_errors_total", "counter", "Failed requests per upstream")
+    healthy = MetricFamily("gateway_upstream_healthy", "gauge", "1 while the upstream circuit is closed")
+    limit = MetricFamily("gateway_upstream_concurrency_limit", "gauge", "Adaptive concurrency limit per upstream")
+    shed = MetricFamily("gateway_upstream_shed_total", "counter", "Requests refused by the adaptive concurrency limit")
+    for prefix, route in routes.items():
+        if not route.balancer:
+            continue
+        for upstream in route.balancer.upstreams:
+            outstanding.add(upstream.outstanding, route=prefix, upstream=upstream.url)
+            upstream_requests.add(upstream.requests, route=prefix, upstream=upstream.url)
+            upstream_errors.add(upstream.errors, route=prefix, upstream=upstream.url)
+            healthy.add(1 if upstream.state == CircuitState.CLOSED else 0, route=prefix, upstream=upstream.url)
+            if upstream.adaptive:
+                limit.add(upstream.adaptive.current, route=prefix, upstream=upstream.url)
+                shed.add(upstream.shed, route=prefix, upstream=upstream.url)
+
+    connections = MetricFamily("gateway_upstream_pool_connections", "gauge", "Connections of the upstream client pools")
+    waiting = MetricFamily("gateway_upstream_pool_waiting", "gauge", "Requests waiting on a pooled connection")
+    for origin, stats in (pool.stats() if pool else {}).items():
+        connections.add(stats.idle, origin=origin, state="idle")
+        connections.add(stats.active, origin=origin, state="active")
+        waiting.add(stats.waiting, origin=origin)
+
+    families = [
+        requests, duration, rules, decisions, upstream_duration,
+        outstanding, upstream_requests, upstream_errors, healthy, limit, shed, connections, waiting,
+    ]
+    if concurrency:
+        rejected = MetricFamily("gateway_concurrency_rejected_total", "counter", "Requests refused by route concurrency limits")
+        rejected.add(concurrency.rejected)
+        families.append(rejected)
+    if breakers:
+        redis = MetricFamily("gateway_redis_call_duration_seconds", "histogram", "Redis calls of the request path, per rate limit client")
+        circuit = MetricFamily("gateway_redis_circuit_open", "gauge", "1 while the circuit breaker of a Redis client is open")
+        trips = MetricFamily("gateway_redis_circuit_trips_total", "counter", "Times the circuit breaker of a Redis client opened")
+        for breaker in breakers.breakers:
+            redis.add(breaker.latency.copy(), client=breaker.name)
+            circuit.add(1 if breaker.is_open else 0, client=breaker.name)
+            trips.add(breaker.trips, client=breaker.name)
+        families += [redis, circuit, trips]
+    database = MetricFamily("gateway_db_query_duration_seconds", "histogram", "Database statements")
+    database.add(query_latency.copy())
+    families.append(database)
+    if shared:
+        workers, routes = shared.read()
+        live = MetricFamily("gateway_host_workers", "gauge", "Workers of the host sharing their metrics")
+        live.add(workers)
+        host_requests = MetricFamily("gateway_host_requests_total", "counter", "Requests of all the workers of the host, per route and outcome")
+        host_duration = MetricFamily("gateway_host_request_duration_seconds", "histogram", "Gateway latency of all the workers of the host, per route")
+        for prefix, totals in routes.items():
+            host_requests.add(totals.success, route=prefix, outcome="success")
+            host_requests.add(totals.errors, route=prefix, outcome="error")
+            host_requests.add(totals.rate_limited, route=prefix, outcome="rate_limited")
+            host_duration.add(totals.latency, route=prefix)
+        families += [live, host_requests, host_duration]
+    if loop_monitor:
+        lag = MetricFamily("gateway_event_loop_lag_seconds", "histogram", "Delay of the event loop in running ready callbacks")
+        lag.add(loop_monitor.lag.copy())
+        families.append(lag)
+    return families
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Mapping[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(families: list[MetricFamily]) -> str:
+    """Prometheus text exposition format of a snapshot, can run off the event loop"""
+    lines: list[str] = []
+    for family in families:
+        if not family.samples:
+            continue
+        lines.append(f"# HELP {family.name} {family.help}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        for labels, value in family.samples:
+            if not isinstance(value, LatencyHistogram):
+                lines.append(f"{family.name}{_labels(labels)} {_value(value)}")
+                continue
+            cumulative = np.cumsum(np.frombuffer(value.counts, dtype=np.int64))[_BOUND_INDEXES]
+            for bound, count in zip(LATENCY_BOUNDS, cumulative.tolist()):
+                lines.append(f"{family.name}_bucket{_labels({**labels, 'le': str(bound)})} {count}")
+            lines.append(f"{family.name}_bucket{_labels({**labels, 'le': '+Inf'})} {value.count}")
+            lines.append(f"{family.name}_sum{_labels(labels)} {_value(value.total / 1_000_000)}")
+            lines.append(f"{family.name}_count{_labels(labels)} {value.count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,184 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+import fcntl
+from logging import Logger
+import mmap
+import os
+from typing import final
+from fastapi import Request
+import numpy as np
+from src.services.request_tracking.aggregation import RouteTotals
+from src.services.request_tracking.histogram import BUCKETS, LatencyHistogram, bucket_index
+
+MAGIC = 0x4757_4D45_5452_4943
+VERSION = 1
+# Header words: magic, version, max workers, max routes, routes registered
+HEADER_WORDS = 8
+MAGIC_WORD, VERSION_WORD, WORKERS_WORD, ROUTES_WORD, REGISTERED_WORD = range(5)
+NAME_BYTES = 128
+# Words of a route in a worker stripe: counters, latency total and max in microseconds, then the histogram
+REQUESTS, SUCCESS, ERRORS, RATE_LIMITED, TOTAL_US, MAX_US = range(6)
+HISTOGRAM = 6
+FIELDS = HISTOGRAM + BUCKETS
+
+
+class SharedMetricsUnavailable(Exception):
+    """The segment cannot be used by this worker"""
+
+
+@final
+class SharedMetrics:
+    """
+    Route counters and latency histograms of all the workers of a host, in a file mapped by each of them
+    (/dev/shm keeps it in memory). Every worker claims a stripe it alone writes to, so recording
+    is plain aligned 64-bit stores, atomic without locks; readers add the stripes up from the mapping,
+    without asking the other workers anything.
+
+    Layout: header, pid of the worker holding each stripe, route names, then the stripes
+    of max_workers x max_routes x FIELDS int64. Route names are registered under a file lock,
+    once per route and host. The counts of a worker that exits stay in its stripe and are added to
+    by the next worker claiming it, the segment is reset when no worker holding it is alive.
+    """
+    def __init__(self, path: str, max_workers: int, max_routes: int, logger: Logger):
+        self.path = path
+        self.logger = logger
+        self.max_workers = max_workers
+        self.max_routes = max_routes
+        self._pids_offset = HEADER_WORDS * 8
+        self._names_offset = self._pids_offset + max_workers * 8
+        self._data_offset = self._names_offset + -(-max_routes * NAME_BYTES // 8) * 8
+        self.size = self._data_offset + max_workers * max_routes * FIELDS * 8
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            with self._locked():
+                self._prepare()
+                self.worker = self._claim()
+        except BaseException:
+            self.close()
+            raise
+        self._mmap = mmap.mmap(self._fd, self.size)
+        self._words = np.frombuffer(self._mmap, dtype=np.int64, count=self._names_offset // 8)
+        self._data = np.frombuffer(self._mmap, dtype=np.int64, offset=self._data_offset).reshape(max_workers, max_routes, FIELDS)
+        stripe = self._data_offset + self.worker * max_routes * FIELDS * 8
+        self._view = memoryview(self._mmap)
+        self._stripe = self._view[stripe:stripe + max_routes * FIELDS * 8].cast("q")
+        self._routes: dict[str, int] = {}       # -1 for routes left out, the segment being full
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _prepare(self) -> None:
+        """Reset the file unless it has this layout and a live worker, before it is mapped"""
+        expected = np.array([MAGIC, VERSION, self.max_workers, self.max_routes], dtype=np.int64)
+        head = os.pread(self._fd, self._names_offset, 0)
+        if os.fstat(self._fd).st_size == self.size and len(head) == self._names_offset:
+            words = np.frombuffer(head, dtype=np.int64)
+            if (words[:4] == expected).all() and any(_alive(int(pid)) for pid in words[HEADER_WORDS:]):
+                return
+        os.ftruncate(self._fd, 0)
+        os.ftruncate(self._fd, self.size)
+        os.pwrite(self._fd, expected.tobytes(), 0)
+
+    def _claim(self) -> int:
+        pids = np.frombuffer(os.pread(self._fd, self.max_workers * 8, self._pids_offset), dtype=np.int64)
+        for worker, pid in enumerate(pids.tolist()):
+            if pid == 0 or not _alive(pid):
+                os.pwrite(self._fd, np.int64(os.getpid()).tobytes(), self._pids_offset + worker * 8)
+                return worker
+        raise SharedMetricsUnavailable(f"All {self.max_workers} worker stripes of {self.path} are in use")
+
+    def _names(self, registered: int) -> list[str]:
+        raw = self._mmap[self._names_offset:self._names_offset + registered * NAME_BYTES]
+        return [raw[index * NAME_BYTES:(index + 1) * NAME_BYTES].rstrip(b"\0").decode() for index in range(registered)]
+
+    def _register(self, prefix: str) -> int:
+        encoded = prefix.encode()
+        with self._locked():
+            registered = int(self._words[REGISTERED_WORD])
+            names = self._names(registered)
+            if prefix in names:
+                index = names.index(prefix)
+            elif registered == self.max_routes or len(encoded) >= NAME_BYTES or b"\0" in encoded:
+                self.logger.warning(f"Route {prefix} left out of the shared metrics, too long or {self.max_routes} routes already")
+                index = -1
+            else:
+                offset = self._names_offset + registered * NAME_BYTES
+                self._mmap[offset:offset + len(encoded)] = encoded
+                # Only counted once its name is written, readers never see a partial name
+                self._words[REGISTERED_WORD] = registered + 1
+                index = registered
+        self._routes[prefix] = index
+        return index
+
+    def record(self, prefix: str, status_code: int, is_rate_limited: bool, duration: float) -> None:
+        index = self._routes.get(prefix)
+        if index is None:
+            index = self._register(prefix)
+        if index < 0:
+            return
+        stripe = self._stripe
+        base = index * FIELDS
+        stripe[base + REQUESTS] += 1
+        if is_rate_limited:
+            stripe[base + RATE_LIMITED] += 1
+        elif 200 <= status_code < 400:
+            stripe[base + SUCCESS] += 1
+        else:
+            stripe[base + ERRORS] += 1
+        microseconds = int(duration * 1_000_000)
+        stripe[base + TOTAL_US] += microseconds
+        if microseconds > stripe[base + MAX_US]:
+            stripe[base + MAX_US] = microseconds
+        stripe[base + HISTOGRAM + bucket_index(microseconds)] += 1
+
+    def read(self) -> tuple[int, dict[str, RouteTotals]]:
+        """Live workers, and the routes summed over all the stripes"""
+        registered = int(self._words[REGISTERED_WORD])
+        stripes = self._data[:, :registered]
+        sums = stripes.sum(axis=0)
+        maxima = stripes[:, :, MAX_US].max(axis=0) if registered else []
+        routes = {
+            name: RouteTotals(
+                int(row[REQUESTS]), int(row[SUCCESS]), int(row[ERRORS]), int(row[RATE_LIMITED]),
+                LatencyHistogram.from_counts(row[HISTOGRAM:].tobytes(), int(row[TOTAL_US]), int(maximum))
+            )
+            for name, row, maximum in zip(self._names(registered), sums, maxima)
+        }
+        workers = sum(1 for pid in self._words[HEADER_WORDS:].tolist() if pid and _alive(pid))
+        return workers, routes
+
+    def close(self) -> None:
+        """Give the stripe back, its counts stay in the host totals"""
+        if getattr(self, "_mmap", None) is not None:
+            with self._locked():
+                self._words[HEADER_WORDS + self.worker] = 0
+            self._stripe.release()
+            self._view.release()
+            # The mapping only closes once no array refers to it
+            self._data = self._words = None
+            self._mmap.close()
+            self._mmap = None
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def _alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def get_shared_metrics(request: Request) -> SharedMetrics | None:
+    return getattr(request.app.state, "shared_metrics", None)
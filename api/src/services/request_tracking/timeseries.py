@@ -0,0 +1,126 @@
+import math
+from typing import final
+import numpy as np
+from src.types.request_tracking import RouteTimeSeries
+
+# Per-second buckets cover the last hour, per-minute ones the last day
+SECOND_BUCKETS = 3600
+MINUTE_BUCKETS = 1440
+# Ranges needing more points are downsampled to a coarser resolution
+MAX_POINTS = 720
+
+# Columns of a bucket
+REQUESTS, ERRORS, RATE_LIMITED, LATENCY = range(4)
+
+
+@final
+class Rollup:
+    """
+    Ring of fixed-width buckets. The open bucket is counted in plain attributes,
+    it is written to the arrays once, when the next bucket starts.
+    """
+    __slots__ = ("width", "size", "starts", "values", "current", "requests", "errors", "rate_limited", "latency")
+
+    def __init__(self, width: int, size: int):
+        self.width = width
+        self.size = size
+        self.starts = np.full(size, -1, dtype=np.int64)        # Bucket number held by each slot
+        self.values = np.zeros((size, 4), dtype=np.float64)
+        self.current = -1
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.latency = 0.0
+
+    def record(self, now: float, error: bool, rate_limited: bool, latency: float) -> None:
+        bucket = int(now // self.width)
+        if bucket != self.current:
+            self._flush()
+            self.current = bucket
+        self.requests += 1
+        if error:
+            self.errors += 1
+        if rate_limited:
+            self.rate_limited += 1
+        self.latency += latency
+
+    def _flush(self) -> None:
+        if self.current < 0:
+            return
+        slot = self.current % self.size
+        self.starts[slot] = self.current
+        self.values[slot] = (self.requests, self.errors, self.rate_limited, self.latency)
+        self.requests = self.errors = self.rate_limited = 0
+        self.latency = 0.0
+
+    def dense(self, first: int, last: int) -> np.ndarray:
+        """One row per bucket from `first` to `last` included, zeros where nothing was recorded"""
+        rows = np.zeros((last - first + 1, 4), dtype=np.float64)
+        mask = (self.starts >= first) & (self.starts <= last)
+        rows[self.starts[mask] - first] = self.values[mask]
+        if first <= self.current <= last:
+            rows[self.current - first] += (self.requests, self.errors, self.rate_limited, self.latency)
+        return rows
+
+
+@final
+class RouteRollups:
+    """Per-second and per-minute traffic of one route"""
+    __slots__ = ("seconds", "minutes")
+
+    def __init__(self):
+        self.seconds = Rollup(1, SECOND_BUCKETS)
+        self.minutes = Rollup(60, MINUTE_BUCKETS)
+
+    def record(self, now: float, error: bool, rate_limited: bool, latency: float) -> None:
+        self.seconds.record(now, error, rate_limited, latency)
+        self.minutes.record(now, error, rate_limited, latency)
+
+
+def clamp(start: float, end: float, now: float) -> tuple[float, float]:
+    """The part of a range the rollups can hold: nothing after `now`, nothing older than the per-minute ring"""
+    end = min(end, now)
+    start = min(max(start, now - MINUTE_BUCKETS * 60), end)
+    return start, end
+
+
+def plan(start: float, end: float, now: float, resolution: int | None) -> tuple[str, int]:
+    """
+    Rollup ("seconds" or "minutes") and resolution in seconds serving a range: the finest one holding it,
+    coarsened until the range fits in MAX_POINTS
+    """
+    span = max(end - start, 1.0)
+    # A second of slack, "the last hour" is asked a moment before it is served
+    use_seconds = (resolution is None or resolution < 60) and now - start <= SECOND_BUCKETS + 1
+    width = 1 if use_seconds else 60
+    resolution = max(min(resolution or width, MINUTE_BUCKETS * 60), math.ceil(span / MAX_POINTS), width)
+    # A whole number of buckets per point
+    return ("seconds" if use_seconds else "minutes"), math.ceil(resolution / width) * width
+
+
+def query(rollups: RouteRollups, start: float, end: float, now: float, resolution: int | None) -> RouteTimeSeries:
+    start, end = clamp(start, end, now)
+    source, resolution = plan(start, end, now, resolution)
+    rollup: Rollup = getattr(rollups, source)
+    factor = resolution // rollup.width
+    # Buckets older than the ring are gone, points start on a multiple of the resolution
+    oldest = int(now // rollup.width) - rollup.size + 1
+    first = max(int(start // resolution), -(-oldest // factor)) * factor
+    last = max(int(end // rollup.width), first)
+    rows = rollup.dense(first, last)
+
+    points = math.ceil(len(rows) / factor)
+    padded = np.zeros((points * factor, 4), dtype=np.float64)
+    padded[:len(rows)] = rows
+    sums = padded.reshape(points, factor, 4).sum(axis=1)
+
+    requests = sums[:, REQUESTS]
+    mean_latency = np.divide(sums[:, LATENCY], requests, out=np.zeros(points), where=requests > 0) * 1000
+    return RouteTimeSeries(
+        resolution=resolution,
+        timestamps=(first * rollup.width + np.arange(points, dtype=np.int64) * resolution).tolist(),
+        requests=requests.astype(np.int64).tolist(),
+        errors=sums[:, ERRORS].astype(np.int64).tolist(),
+        rate_limited=sums[:, RATE_LIMITED].astype(np.int64).tolist(),
+        mean_latency_ms=mean_latency.round(3).tolist(),
+    )
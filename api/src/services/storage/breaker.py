@@ -0,0 +1,119 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Sequence
+from logging import Logger
+import time
+from typing import final
+from fastapi import Request
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from src.services.proxy.balancer import CircuitState
+from src.services.request_tracking.histogram import LatencyHistogram
+from src.settings import Settings
+
+
+class RedisUnavailable(Exception):
+    """Redis is tripped, or the call failed or took too long"""
+
+
+@final
+class RedisCircuitBreaker:
+    """
+    Bounds the time the request path spends on Redis. Calls are cut at REDIS_BREAKER_TIMEOUT_SECONDS,
+    errors and calls slower than REDIS_BREAKER_SLOW_SECONDS count as failures, and after
+    REDIS_BREAKER_MAX_FAILURES in a row the breaker opens: calls fail at once while Redis is pinged
+    in the background, the first successful ping closes it again.
+    """
+    def __init__(self, redis: Redis, settings: Settings, logger: Logger, name: str = "0"):
+        self.redis = redis
+        self.name = name
+        self.logger = logger
+        self.timeout = settings.REDIS_BREAKER_TIMEOUT_SECONDS
+        self.slow = settings.REDIS_BREAKER_SLOW_SECONDS
+        self.max_failures = settings.REDIS_BREAKER_MAX_FAILURES
+        self.probe_interval = settings.REDIS_BREAKER_PROBE_SECONDS
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.latency = LatencyHistogram()      # Every call run, failed ones included
+        self._probe: asyncio.Task[None] | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != CircuitState.CLOSED
+
+    async def run[T](self, operation: Callable[[], Awaitable[T]]) -> T:
+        """Run a Redis operation within the breaker, raises RedisUnavailable instead of waiting on a degraded Redis"""
+        if self.is_open:
+            raise RedisUnavailable("Redis circuit is open")
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(operation(), self.timeout)
+        except (RedisError, OSError, asyncio.TimeoutError) as e:
+            self.latency.record(time.monotonic() - started)
+            self.record_failure(f"{type(e).__name__}: {str(e)}")
+            raise RedisUnavailable(str(e)) from e
+        elapsed = time.monotonic() - started
+        self.latency.record(elapsed)
+        if elapsed > self.slow:
+            self.record_failure(f"call took {elapsed * 1000:.0f}ms")
+        else:
+            self.consecutive_failures = 0
+        return result
+
+    def record_failure(self, reason: str) -> None:
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.max_failures and not self.is_open:
+            self.state = CircuitState.OPEN
+            self.trips += 1
+            self.logger.error(f"Redis circuit of {self.name} opened after {self.consecutive_failures} failures, last: {reason}")
+            self._probe = asyncio.create_task(self._recover())
+
+    async def _recover(self) -> None:
+        while self.is_open:
+            await asyncio.sleep(self.probe_interval)
+            self.state = CircuitState.HALF_OPEN
+            try:
+                await asyncio.wait_for(self.redis.ping(), self.timeout)
+            except (RedisError, OSError, asyncio.TimeoutError) as e:
+                self.state = CircuitState.OPEN
+                self.logger.warning(f"Redis {self.name} still unavailable: {type(e).__name__}: {str(e)}")
+                continue
+            self.state = CircuitState.CLOSED
+            self.consecutive_failures = 0
+            self.logger.info(f"Redis {self.name} reachable again, circuit closed")
+
+    async def close(self) -> None:
+        if self._probe:
+            self._probe.cancel()
+            try:
+                await self._probe
+            except asyncio.CancelledError:
+                pass
+            self._probe = None
+
+
+@final
+class RedisBreakers:
+    """
+    One breaker per rate limit Redis client: a dead shard trips and is probed on its own,
+    while the healthy ones keep serving
+    """
+    def __init__(self, clients: Sequence[Redis], settings: Settings, logger: Logger):
+        self.breakers = [
+            RedisCircuitBreaker(client, settings, logger, str(index)) for index, client in enumerate(clients)
+        ]
+
+    def for_client(self, redis: Redis) -> RedisCircuitBreaker:
+        return next(breaker for breaker in self.breakers if breaker.redis is redis)
+
+    async def run[T](self, redis: Redis, operation: Callable[[], Awaitable[T]]) -> T:
+        """Run an operation on `redis` within that client's breaker"""
+        return await self.for_client(redis).run(operation)
+
+    async def close(self) -> None:
+        for breaker in self.breakers:
+            await breaker.close()
+
+
+def get_redis_breakers(request: Request) -> RedisBreakers | None:
+    return getattr(request.app.state, "redis_breakers", None)
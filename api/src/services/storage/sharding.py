@@ -0,0 +1,111 @@
+import bisect
+from collections.abc import Sequence
+import hashlib
+from logging import Logger
+from typing import final
+from fastapi import Request
+from redis import asyncio as aioredis
+from redis.asyncio import Redis
+from redis.asyncio.cluster import RedisCluster
+from redis.crc import key_slot
+from src.settings import Settings
+
+# Points per shard on the ring, enough for an even spread of a few shards
+RING_REPLICAS = 160
+
+
+def hash_tag(key: str) -> str:
+    """Part of the key deciding its slot, as Redis Cluster does: the first non-empty {...}, else the whole key"""
+    start = key.find("{")
+    if start != -1:
+        end = key.find("}", start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def tagged(value: str) -> str:
+    """Make `value` the hash tag of a key, keys with the same tag land on the same slot and shard"""
+    return "{" + value + "}"
+
+
+def _point(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+@final
+class HashRing:
+    """Consistent hashing of tags over shards, adding a shard only moves about 1/n of the keys"""
+    def __init__(self, shards: int, replicas: int = RING_REPLICAS):
+        points = sorted((_point(f"{shard}:{replica}"), shard) for shard in range(shards) for replica in range(replicas))
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, tag: str) -> int:
+        index = bisect.bisect(self._points, _point(tag)) % len(self._points)
+        return self._shards[index]
+
+
+@final
+class RateLimitRedis:
+    """
+    Where rate limit state lives: the main Redis, a Redis Cluster, or standalone instances
+    the keys are spread over by consistent hashing of their hash tag.
+    """
+    def __init__(self, clients: Sequence[Redis | RedisCluster], mode: str = "default"):
+        self.clients = list(clients)
+        self.mode = mode
+        self._ring = HashRing(len(self.clients)) if len(self.clients) > 1 else None
+
+    def client_for(self, key: str) -> Redis:
+        if self._ring is None:
+            return self.clients[0]  # type: ignore[return-value]
+        return self.clients[self._ring.shard_for(hash_tag(key))]  # type: ignore[return-value]
+
+    def group(self, keys: Sequence[str]) -> list[tuple[Redis, list[int]]]:
+        """
+        Indexes of `keys` that a single script call can take together: those on the same shard,
+        on a cluster those on the same slot
+        """
+        groups: dict[object, tuple[Redis, list[int]]] = {}
+        for index, key in enumerate(keys):
+            if self.mode == "cluster":
+                group = key_slot(hash_tag(key).encode())
+            elif self._ring is not None:
+                group = self._ring.shard_for(hash_tag(key))
+            else:
+                group = 0
+            groups.setdefault(group, (self.client_for(key), []))[1].append(index)
+        return list(groups.values())
+
+    async def close(self) -> None:
+        if self.mode == "default":
+            return  # The main Redis is closed with the application
+        for client in self.clients:
+            await client.aclose()
+
+
+async def init_rate_limit_redis(settings: Settings, redis: Redis | None, logger: Logger) -> RateLimitRedis | None:
+    """Rate limit state on the main Redis unless RATE_LIMIT_REDIS_MODE points it elsewhere"""
+    mode = settings.RATE_LIMIT_REDIS_MODE
+    if mode == "default" or not settings.RATE_LIMIT_REDIS_URLS:
+        return RateLimitRedis([redis]) if redis else None
+    if mode == "cluster":
+        logger.info(f"Rate limit state on the Redis Cluster at {settings.RATE_LIMIT_REDIS_URLS[0]}")
+        cluster = RedisCluster.from_url(
+            settings.RATE_LIMIT_REDIS_URLS[0],
+            socket_connect_timeout=5.0,
+            socket_timeout=5.0,
+        )
+        await cluster.initialize()
+        return RateLimitRedis([cluster], mode)
+    logger.info(f"Rate limit state sharded over {len(settings.RATE_LIMIT_REDIS_URLS)} Redis instances")
+    shards = [
+        aioredis.from_url(url, socket_connect_timeout=5.0, socket_timeout=5.0)
+        for url in settings.RATE_LIMIT_REDIS_URLS
+    ]
+    return RateLimitRedis(shards, mode)
+
+
+def get_rate_limit_redis(request: Request) -> RateLimitRedis | None:
+    return getattr(request.app.state, "rate_limit_redis", None)
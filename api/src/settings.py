@@ -44,11 +44,66 @@ class Settings(BaseSettings):
 
     REDIS_URL: str = "redis://127.0.0.1:6382/0"
 
+    # Route configuration propagation between workers
+    ROUTE_CONFIG_SYNC_INTERVAL_SECONDS: float = 5.0     # Fallback version check if a pub/sub message is missed
+
     # For error reporting
     DISCORD_WEBHOOK_URL: str = ""
 
+    # Upstream connection pools (one per upstream origin)
+    UPSTREAM_MAX_CONNECTIONS: int = 100
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    UPSTREAM_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    UPSTREAM_HTTP2: bool = False                # Requires the optional 'h2' package
+    UPSTREAM_TIMEOUT_SECONDS: float = 30.0
+    UPSTREAM_CONNECT_TIMEOUT_SECONDS: float = 5.0   # Kept short so a dead host is detected quickly
+
+    # Relay upstream bodies as they arrive, False buffers the whole body first
+    PROXY_STREAM_RESPONSES: bool = True
+    # Request bodies of routes with buffer_body are kept in memory up to this size, then spilled to disk
+    PROXY_BODY_SPOOL_MAX_MEMORY: int = 1024 * 1024
+
+    # Response cache of the routes with caching enabled
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024        # In-process tier, per worker
+    RESPONSE_CACHE_MAX_OBJECT_BYTES: int = 1024 * 1024
+    RESPONSE_CACHE_SHARED: bool = True                      # Share entries between workers through Redis
+
     # Rate limiting settings
     RATE_LIMIT_WINDOW_SECONDS: int = 60
+    # gcra and sliding_window_counter keep O(1) state per key, sliding_window_log one entry per request
+    RATE_LIMIT_ALGORITHM: Literal["gcra", "sliding_window_counter", "sliding_window_log"] = "gcra"
+    # X-RateLimit-* headers, the IETF RateLimit/RateLimit-Policy ones, or both
+    RATE_LIMIT_HEADERS: Literal["legacy", "ietf", "both"] = "legacy"
+    RATE_LIMIT_HYBRID_MAX_KEYS: int = 10_000                # Quota leases held per worker by hybrid routes
+    RATE_LIMIT_BLOCKED_MAX_KEYS: int = 10_000               # Rate limited clients remembered per worker
+    # Addresses or CIDR networks of the proxies in front of the gateway, X-Forwarded-For is only read from them
+    RATE_LIMIT_TRUSTED_PROXIES: list[str] = []
+    RATE_LIMIT_FALLBACK_MAX_KEYS: int = 10_000              # Keys counted in process while Redis is unavailable
+    # Route changes move its limits to a new key generation, the old keys expire with their window.
+    # True also unlinks them in the background as soon as the route changes.
+    RATE_LIMIT_SWEEP_STALE_KEYS: bool = False
+    RATE_LIMIT_SWEEP_BATCH_SIZE: int = 500                  # Keys per SCAN call and UNLINK pipeline
+
+    # Where rate limit state lives: "default" on REDIS_URL, "cluster" on the Redis Cluster of the first
+    # RATE_LIMIT_REDIS_URLS, "sharded" spread over all of them by consistent hashing of the key hash tags
+    RATE_LIMIT_REDIS_MODE: Literal["default", "cluster", "sharded"] = "default"
+    RATE_LIMIT_REDIS_URLS: list[str] = []
+
+    # Redis circuit breaker of the request path, keeps the gateway latency bounded when Redis degrades
+    REDIS_BREAKER_TIMEOUT_SECONDS: float = 0.25     # Calls taking longer are abandoned
+    REDIS_BREAKER_SLOW_SECONDS: float = 0.1         # Calls taking longer count as failures
+    REDIS_BREAKER_MAX_FAILURES: int = 5             # Consecutive failures opening the circuit
+    REDIS_BREAKER_PROBE_SECONDS: float = 1.0        # Interval of the background pings while open
+
+    # How often the event loop lag is sampled for /admin/metrics/prometheus
+    EVENT_LOOP_MONITOR_INTERVAL_SECONDS: float = 0.5
+    # File the workers of a host map to share their route metrics, e.g. /dev/shm/gateway-metrics, None keeps them per worker
+    METRICS_SHARED_MEMORY_PATH: str | None = None
+    METRICS_SHARED_MAX_WORKERS: int = 16
+    METRICS_SHARED_MAX_ROUTES: int = 128            # Later routes are left out of the host totals
+    # Every worker publishes its route metrics to Redis for the deployment-wide totals
+    METRICS_REDIS_AGGREGATION: bool = False
+    METRICS_REDIS_PUBLISH_SECONDS: float = 10.0
 
     # Database general settings
     DB_ENGINE: SupportEngine = "sqlite"     # Which DB -> SQLite for now
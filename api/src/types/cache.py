@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+
+type Count = int
+
+class CacheStats(BaseModel):
+    hits: Count
+    stale_hits: Count           # Served stale, while revalidating or because the upstream failed
+    misses: Count
+    revalidations: Count        # Stored responses confirmed by a 304
+    stores: Count
+    evictions: Count            # Dropped from the in-process tier to stay under max_bytes
+    shared_hits: Count          # Found in Redis after a local miss
+    errors: Count               # Redis tier failures, the request went on without it
+    entries: Count
+    size_bytes: int
+    max_bytes: int
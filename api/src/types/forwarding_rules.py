@@ -1,12 +1,240 @@
 # Pydantic models for route forwarding
+import ipaddress
+from typing import Literal
 from pydantic import BaseModel, validator
 
+type LoadBalancerPolicy = Literal["round_robin", "least_outstanding", "p2c_ewma"]
+type AdaptiveLimitAlgorithm = Literal["aimd", "gradient"]
+type RateLimitAlgorithmName = Literal["gcra", "sliding_window_counter", "sliding_window_log"]
+type RateLimitFailureMode = Literal["local", "open", "closed"]
+type RateLimitKeyType = Literal["client_ip", "api_key", "header", "cookie", "jwt_claim", "path_segment"]
+
+
+class UpstreamTarget(BaseModel):
+    url: str
+    weight: int = 1
+
+    @validator('weight')
+    def validate_weight(cls, v):
+        if v < 1:
+            raise ValueError('weight must be at least 1')
+        return v
+
+class HealthCheckConfig(BaseModel):
+    path: str | None = None         # Active health check path, None for passive ejection only
+    interval: float = 10.0          # Seconds between active checks
+    timeout: float = 2.0
+    expected_status: int = 200
+    max_failures: int = 5           # Consecutive errors or timeouts before the upstream is ejected
+    ejection_seconds: float = 30.0  # Doubled on each consecutive ejection
+    passive_ejection: bool = False  # Also eject on failing requests: transport errors, timeouts, 502/503/504
+
+    @validator('path')
+    def validate_path(cls, v):
+        if v is not None and not v.startswith('/'):
+            raise ValueError('health check path must start with /')
+        return v
+
+    @validator('interval', 'timeout', 'ejection_seconds')
+    def validate_positive(cls, v):
+        if v <= 0:
+            raise ValueError('must be positive')
+        return v
+
+    @validator('max_failures')
+    def validate_max_failures(cls, v):
+        if v < 1:
+            raise ValueError('max_failures must be at least 1')
+        return v
+
+class ResponseCacheConfig(BaseModel):
+    enabled: bool = False
+    default_ttl: float = 0.0                # Seconds, used when the upstream sends no freshness information
+    stale_while_revalidate: float = 0.0     # Defaults for the Cache-Control extensions of the same name
+    stale_if_error: float = 0.0
+    max_object_size: int | None = None      # Bytes, larger responses are not cached
+
+    @validator('default_ttl', 'stale_while_revalidate', 'stale_if_error')
+    def validate_seconds(cls, v):
+        if v < 0:
+            raise ValueError('must be non-negative')
+        return v
+
+class CoalesceConfig(BaseModel):
+    enabled: bool = False
+    vary_headers: list[str] = ["accept", "accept-encoding"]     # Request headers that must match to share a response
+    max_wait: float = 10.0      # Seconds to wait for a shared response before forwarding alone
+    max_buffer_size: int = 1024 * 1024      # Bytes, larger responses stop being shared
+
+    @validator('max_wait')
+    def validate_max_wait(cls, v):
+        if v <= 0:
+            raise ValueError('max_wait must be positive')
+        return v
+
+    @validator('max_buffer_size')
+    def validate_max_buffer_size(cls, v):
+        if v <= 0:
+            raise ValueError('max_buffer_size must be positive')
+        return v
+
+class RateLimitHybridConfig(BaseModel):
+    enabled: bool = False
+    lease_fraction: float = 0.05    # Share of the limit leased by a worker at once, lower is more accurate
+    strict_fraction: float = 0.1    # Share of the limit left under which every request goes to Redis
+
+    @validator('lease_fraction', 'strict_fraction')
+    def validate_fraction(cls, v):
+        if not 0 < v <= 1:
+            raise ValueError('must be in (0, 1]')
+        return v
+
+class RateLimitKeyConfig(BaseModel):
+    type: RateLimitKeyType
+    trusted_proxies: list[str] | None = None    # client_ip: proxy addresses or networks whose X-Forwarded-For is read
+    header: str | None = None           # api_key (default x-api-key), header and jwt_claim (default authorization)
+    query: str | None = None            # api_key: query parameter used when the header is missing
+    cookie: str | None = None
+    claim: str | None = None
+    index: int | None = None            # path_segment: 0 is the first segment of the path
+
+    @validator('index', always=True)
+    def validate_required(cls, v, values):
+        # The option each type cannot do without
+        required = {"header": "header", "cookie": "cookie", "jwt_claim": "claim", "path_segment": "index"}.get(values.get('type', ''))
+        if required == 'index' and v is None:
+            raise ValueError('path_segment keys need an index')
+        if required and required != 'index' and values.get(required) is None:
+            raise ValueError(f'{values["type"]} keys need a {required}')
+        return v
+
+    @validator('trusted_proxies')
+    def validate_trusted_proxies(cls, v):
+        for proxy in v or []:
+            try:
+                ipaddress.ip_network(proxy.strip(), strict=False)
+            except ValueError:
+                raise ValueError(f'{proxy} is not an address or network')
+        return v
+
+class StackedRateLimitConfig(BaseModel):
+    name: str                           # Reported in RateLimit-Policy, limits of the same name and global scope share their count
+    limit: int
+    window: float | None = None         # Seconds, None for RATE_LIMIT_WINDOW_SECONDS
+    scope: Literal["route", "global"] = "route"
+    key: list[RateLimitKeyConfig] = [RateLimitKeyConfig(type="client_ip")]
+
+    @validator('limit')
+    def validate_limit(cls, v):
+        if v < 1:
+            raise ValueError('limit must be at least 1')
+        return v
+
+    @validator('window')
+    def validate_window(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError('window must be positive')
+        return v
+
+    @validator('key')
+    def validate_key(cls, v):
+        if not v:
+            raise ValueError('key needs at least one part')
+        return v
+
+class ConcurrencyLimitConfig(BaseModel):
+    enabled: bool = False
+    limit: int | None = None            # In-flight requests of the whole route, None for no cap
+    per_key_limit: int | None = None    # In-flight requests per key value, None for no cap
+    key: list[RateLimitKeyConfig] = [RateLimitKeyConfig(type="client_ip")]
+    queue_timeout: float = 0.0          # Seconds a request waits for a slot, 0 rejects with 503 at once
+    distributed: bool = False           # Count across nodes with Redis leases, else per worker
+    lease_seconds: float = 60.0         # Redis leases left by a dead node expire after that, keep above the longest request
+
+    @validator('limit', 'per_key_limit')
+    def validate_limit(cls, v):
+        if v is not None and v < 1:
+            raise ValueError('must be at least 1')
+        return v
+
+    @validator('queue_timeout')
+    def validate_queue_timeout(cls, v):
+        if v < 0:
+            raise ValueError('queue_timeout must be non-negative')
+        return v
+
+    @validator('lease_seconds')
+    def validate_lease_seconds(cls, v):
+        if v <= 0:
+            raise ValueError('lease_seconds must be positive')
+        return v
+
+    @validator('key')
+    def validate_key(cls, v):
+        if not v:
+            raise ValueError('key needs at least one part')
+        return v
+
+class AdaptiveConcurrencyConfig(BaseModel):
+    enabled: bool = False
+    algorithm: AdaptiveLimitAlgorithm = "gradient"
+    initial_limit: int = 20
+    min_limit: int = 1
+    max_limit: int = 1000
+    backoff_ratio: float = 0.9          # Limit kept on an upstream error, or with aimd on a slow response
+    latency_threshold: float = 1.0      # aimd: seconds until the headers above which a response counts as a drop
+    tolerance: float = 1.5              # gradient: latency allowed above the long-term one before shrinking
+    smoothing: float = 0.2              # gradient: share of each new estimate taken into the limit
+
+    @validator('initial_limit', 'min_limit', 'max_limit')
+    def validate_limit(cls, v):
+        if v < 1:
+            raise ValueError('must be at least 1')
+        return v
+
+    @validator('max_limit')
+    def validate_max_limit(cls, v, values):
+        if v < values.get('min_limit', 1):
+            raise ValueError('max_limit must be at least min_limit')
+        return v
+
+    @validator('backoff_ratio', 'smoothing')
+    def validate_fraction(cls, v):
+        if not 0 < v <= 1:
+            raise ValueError('must be in (0, 1]')
+        return v
+
+    @validator('latency_threshold')
+    def validate_latency_threshold(cls, v):
+        if v <= 0:
+            raise ValueError('latency_threshold must be positive')
+        return v
+
+    @validator('tolerance')
+    def validate_tolerance(cls, v):
+        if v < 1:
+            raise ValueError('tolerance must be at least 1')
+        return v
 
 class RouteForwardingConfig(BaseModel):
     id: int | None = None
     target_url: str
     rate_limit: int = 60
+    rate_limit_algorithm: RateLimitAlgorithmName | None = None     # None for the RATE_LIMIT_ALGORITHM default
+    rate_limit_hybrid: RateLimitHybridConfig = RateLimitHybridConfig()     # Spend quota leased from Redis locally, always GCRA
+    rate_limits: list[StackedRateLimitConfig] = []     # Per consumer, tenant... limits counted with rate_limit, always GCRA
+    # While Redis is unavailable: limit in process, let everything through, or reject with 503
+    rate_limit_failure_mode: RateLimitFailureMode = "local"
+    concurrency: ConcurrencyLimitConfig = ConcurrencyLimitConfig()     # Cap on in-flight requests, in total and per key
     url_rewrite: dict[str, str] = {}
+    max_body_size: int | None = None   # Bytes, None for no limit
+    buffer_body: bool = False           # Spool the body (memory then disk) so it can be replayed
+    upstreams: list[UpstreamTarget] = []    # Weighted targets, empty to send everything to target_url
+    load_balancer: LoadBalancerPolicy = "round_robin"
+    health_check: HealthCheckConfig = HealthCheckConfig()
+    adaptive_concurrency: AdaptiveConcurrencyConfig = AdaptiveConcurrencyConfig()  # Per upstream limit learned from its latency, 503 above it
+    cache: ResponseCacheConfig = ResponseCacheConfig()
+    coalesce: CoalesceConfig = CoalesceConfig()
 
     @validator('rate_limit')
     def validate_rate_limit(cls, v):
@@ -14,6 +242,12 @@ class RouteForwardingConfig(BaseModel):
             raise ValueError('rate_limit must be non-negative')
         return v
 
+    @validator('max_body_size')
+    def validate_max_body_size(cls, v):
+        if v is not None and v < 0:
+            raise ValueError('max_body_size must be non-negative')
+        return v
+
 class RouteForwardingResponse(BaseModel):
     routes: dict[str, RouteForwardingConfig]
 
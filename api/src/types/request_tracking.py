@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
+from src.types.cache import CacheStats
 
 class RequestMetric(BaseModel):
     timestamp: datetime
@@ -12,6 +13,19 @@ class RequestMetric(BaseModel):
 type Count = int
 type StatusCode = str
 
+class LatencyPercentiles(BaseModel):
+    count: Count
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+
+class LatencyMetrics(BaseModel):
+    total: LatencyPercentiles       # Whole gateway, until the response headers
+    rules: LatencyPercentiles       # Pre and post rules
+    upstream: LatencyPercentiles    # Upstream call, until its response headers
+
 class RouteMetrics(BaseModel):
     total_requests: Count
     success_count: Count
@@ -20,5 +34,36 @@ class RouteMetrics(BaseModel):
     status_codes: dict[StatusCode, Count]
     recent_requests: list[RequestMetric]
 
+class AggregatedRouteMetrics(BaseModel):
+    total_requests: Count
+    success_count: Count
+    error_count: Count
+    rate_limited_count: Count
+    latency: LatencyPercentiles
+
+class AggregatedMetrics(BaseModel):
+    """Gateway routes summed over several workers"""
+    workers: Count                  # Workers whose counts are included
+    routes: dict[str, AggregatedRouteMetrics]
+
 class RequestTrackingResponse(BaseModel):
-    routes: dict[str, RouteMetrics] 
+    routes: dict[str, RouteMetrics]
+    gateway_routes: dict[str, LatencyMetrics] = {}  # Latency by gateway route prefix
+    upstreams: dict[str, LatencyMetrics] = {}   # Requests by the upstream that served them
+    cache: CacheStats | None = None
+    host: AggregatedMetrics | None = None       # All the workers of this host, with shared memory metrics
+    cluster: AggregatedMetrics | None = None    # All the hosts publishing to Redis, when asked for
+
+class RouteTimeSeries(BaseModel):
+    """Columns of the points of one route, each covering `resolution` seconds from its timestamp"""
+    resolution: int
+    timestamps: list[int]           # Unix seconds
+    requests: list[Count]
+    errors: list[Count]
+    rate_limited: list[Count]
+    mean_latency_ms: list[float]
+
+class TimeSeriesResponse(BaseModel):
+    start: float
+    end: float
+    routes: dict[str, RouteTimeSeries]
@@ -0,0 +1,34 @@
+from pydantic import BaseModel
+
+type Count = int
+
+class UpstreamPoolStats(BaseModel):
+    connections: Count
+    idle: Count
+    active: Count
+    waiting: Count
+    max_connections: Count | None
+    http2: bool
+
+class UpstreamPoolResponse(BaseModel):
+    upstreams: dict[str, UpstreamPoolStats]
+
+class UpstreamStats(BaseModel):
+    url: str
+    weight: int
+    outstanding: Count
+    requests: Count
+    errors: Count
+    ewma_latency_ms: float
+    state: str
+    consecutive_failures: Count
+    ejections: Count
+    concurrency_limit: Count | None = None  # Adaptive limit of the upstream, None when not limited
+    shed: Count = 0
+
+class RouteUpstreams(BaseModel):
+    load_balancer: str
+    upstreams: list[UpstreamStats]
+
+class UpstreamsResponse(BaseModel):
+    routes: dict[str, RouteUpstreams]
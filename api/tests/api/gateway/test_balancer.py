@@ -0,0 +1,471 @@
+from collections import Counter
+import logging
+from fastapi.testclient import TestClient
+import httpx
+import pytest
+from src.services.proxy.adaptive import AdaptivePolicy, AIMDLimit, GradientLimit
+from src.services.proxy.balancer import (
+    CircuitState,
+    HealthPolicy,
+    LeastOutstandingBalancer,
+    NoHealthyUpstream,
+    PowerOfTwoChoicesBalancer,
+    RoundRobinBalancer,
+    Upstream,
+    UpstreamOverloaded,
+    create_balancer,
+)
+from src.services.proxy.body import SpooledRequestBody
+from src.services.proxy.health import HealthChecker
+from src.services.proxy.service import forward_request
+from starlette.requests import Request
+from tests.api.mock_proxy_api import configure_proxy_mock
+
+
+class TestBalancers:
+    def test_weighted_round_robin_is_smooth(self):
+        a, b = Upstream("http://a", 2), Upstream("http://b", 1)
+        balancer = RoundRobinBalancer([a, b])
+        picks = [balancer.pick().url for _ in range(6)]
+        assert picks == ["http://a", "http://b", "http://a"] * 2
+
+    def test_least_outstanding(self):
+        a, b = Upstream("http://a"), Upstream("http://b")
+        balancer = LeastOutstandingBalancer([a, b])
+        a.acquire()
+        a.acquire()
+        b.acquire()
+        assert balancer.pick() is b
+        b.acquire()
+        b.acquire()
+        assert balancer.pick() is a
+
+    def test_p2c_prefers_fast_upstream(self):
+        fast, slow = Upstream("http://fast"), Upstream("http://slow")
+        fast.acquire()
+        fast.release(0.01, error=False)
+        slow.acquire()
+        slow.release(1.0, error=False)
+        balancer = PowerOfTwoChoicesBalancer([fast, slow])
+        picks = Counter(balancer.pick().url for _ in range(1000))
+        # The slow upstream only wins when sampled twice
+        assert picks["http://fast"] > picks["http://slow"] * 2
+
+    def test_release_tracks_errors_and_latency(self):
+        upstream = Upstream("http://a")
+        upstream.acquire()
+        upstream.release(0.2, error=False)
+        upstream.acquire()
+        upstream.release(None, error=True)
+        assert upstream.outstanding == 0
+        assert upstream.requests == 2
+        assert upstream.errors == 1
+        assert upstream.ewma_latency == pytest.approx(0.2)
+
+    def test_state_kept_across_reloads(self):
+        first = create_balancer("round_robin", [("http://a", 1), ("http://b", 1)])
+        first.upstreams[0].acquire()
+        second = create_balancer("least_outstanding", [("http://a", 3), ("http://c", 1)], first)
+        assert isinstance(second, LeastOutstandingBalancer)
+        assert second.upstreams[0] is first.upstreams[0]
+        assert second.upstreams[0].weight == 3
+        assert second.upstreams[0].outstanding == 1
+        assert second.upstreams[1].requests == 0
+
+
+class TestAdaptiveConcurrency:
+    def test_aimd(self):
+        limit = AIMDLimit(AdaptivePolicy(algorithm="aimd", initial_limit=10, latency_threshold=0.5))
+        limit.update(0.1, error=False, in_flight=2)
+        assert limit.current == 10          # Not in use, nothing learned
+        limit.update(0.1, error=False, in_flight=5)
+        assert limit.current == 11
+        limit.update(0.8, error=False, in_flight=5)
+        assert limit.current == 9           # 11 * 0.9
+        limit.update(None, error=True, in_flight=5)
+        assert limit.current == 8
+
+    def test_client_abort_keeps_the_limit(self):
+        upstream = create_balancer("round_robin", [("http://a", 1)], adaptive=AdaptivePolicy(algorithm="aimd", initial_limit=10)).upstreams[0]
+        for _ in range(5):
+            upstream.acquire()
+            upstream.release(None, error=None)
+        assert upstream.adaptive is not None and upstream.adaptive.current == 10
+        upstream.acquire()
+        upstream.release(None, error=True)
+        assert upstream.adaptive.current == 9
+
+    def test_gradient_follows_latency(self):
+        limit = GradientLimit(AdaptivePolicy(initial_limit=20, max_limit=100))
+        for _ in range(50):
+            limit.update(0.05, error=False, in_flight=limit.current)
+        grown = limit.current
+        assert grown > 20
+        # Queueing at the upstream: latency triples, the limit backs off
+        for _ in range(30):
+            limit.update(0.15, error=False, in_flight=limit.current)
+        assert limit.current < grown / 2
+        assert limit.current >= 1
+
+    def test_bounded(self):
+        policy = AdaptivePolicy(algorithm="aimd", initial_limit=2, min_limit=2, max_limit=3)
+        limit = AIMDLimit(policy)
+        for _ in range(5):
+            limit.update(None, error=True, in_flight=1)
+        assert limit.current == 2
+        for _ in range(5):
+            limit.update(0.01, error=False, in_flight=3)
+        assert limit.current == 3
+
+    def test_sheds_at_the_limit(self):
+        balancer = create_balancer(
+            "round_robin", [("http://a", 1), ("http://b", 1)],
+            adaptive=AdaptivePolicy(algorithm="aimd", initial_limit=1, max_limit=1)
+        )
+        a, b = balancer.upstreams
+        first = balancer.pick()
+        first.acquire()
+        # The other upstream still has room
+        second = balancer.pick()
+        assert second is not first
+        second.acquire()
+        with pytest.raises(UpstreamOverloaded):
+            balancer.pick()
+        assert a.shed == b.shed == 1
+        first.release(0.01, error=False)
+        assert balancer.pick() is first
+
+    def test_limit_kept_across_reloads(self):
+        policy = AdaptivePolicy(algorithm="aimd", initial_limit=10)
+        first = create_balancer("round_robin", [("http://a", 1)], adaptive=policy)
+        upstream = first.upstreams[0]
+        assert upstream.adaptive is not None
+        upstream.adaptive.update(None, error=True, in_flight=1)
+        second = create_balancer("round_robin", [("http://a", 1)], first, adaptive=AdaptivePolicy(algorithm="aimd", initial_limit=10))
+        assert second.upstreams[0].adaptive is upstream.adaptive
+        assert create_balancer("round_robin", [("http://a", 1)], second).upstreams[0].adaptive is None
+
+
+def fail(upstream: Upstream, times: int = 1):
+    for _ in range(times):
+        upstream.acquire()
+        upstream.release(None, error=True)
+
+
+class TestCircuitBreaker:
+    def test_ejected_after_consecutive_failures(self):
+        a, b = Upstream("http://a", health=HealthPolicy(max_failures=3, passive_ejection=True)), Upstream("http://b")
+        balancer = RoundRobinBalancer([a, b])
+        fail(a, 2)
+        a.acquire()
+        a.release(0.01, error=False)    # A success resets the streak
+        fail(a, 2)
+        assert a.state == CircuitState.CLOSED
+        fail(a)
+        assert a.state == CircuitState.OPEN
+        assert all(balancer.pick() is b for _ in range(5))
+
+    def test_requests_only_eject_with_passive_ejection(self):
+        a, b = Upstream("http://a", health=HealthPolicy(max_failures=1)), Upstream("http://b")
+        RoundRobinBalancer([a, b])
+        fail(a, 10)
+        assert a.state == CircuitState.CLOSED
+        assert a.errors == 10
+
+    def test_last_upstream_in_rotation_is_kept(self):
+        health = HealthPolicy(max_failures=1, passive_ejection=True)
+        a, b = Upstream("http://a", health=health), Upstream("http://b", health=health)
+        balancer = RoundRobinBalancer([a, b])
+        fail(a)
+        assert a.state == CircuitState.OPEN
+        fail(b, 3)
+        assert b.state == CircuitState.CLOSED
+        assert all(balancer.pick() is b for _ in range(3))
+
+    def test_fail_fast_when_all_ejected(self):
+        a = Upstream("http://a", health=HealthPolicy(max_failures=1, ejection_seconds=30))
+        balancer = RoundRobinBalancer([a])
+        a.record(False)     # Health checks eject the last upstream too
+        with pytest.raises(NoHealthyUpstream) as e:
+            balancer.pick()
+        assert 29 < e.value.retry_after <= 30
+
+    def test_half_open_single_probe(self):
+        a = Upstream("http://a", health=HealthPolicy(max_failures=1, ejection_seconds=10, passive_ejection=True))
+        balancer = RoundRobinBalancer([a])
+        a.record(False)
+        a.ejected_until = 0.0     # Ejection expired
+        assert balancer.pick() is a
+        a.acquire()
+        assert a.state == CircuitState.HALF_OPEN
+        # Only the probe goes through until it completes
+        with pytest.raises(NoHealthyUpstream):
+            balancer.pick()
+        a.release(0.01, error=False)
+        assert a.state == CircuitState.CLOSED
+        assert a.ejections == 0
+
+    def test_client_abort_is_neutral(self):
+        a = Upstream("http://a", health=HealthPolicy(max_failures=2, ejection_seconds=10, passive_ejection=True))
+        balancer = RoundRobinBalancer([a])
+        a.acquire()
+        a.release(None, error=True)
+        a.acquire()
+        a.release(None, error=None)        # Client disconnected, nothing learned
+        assert a.consecutive_failures == 1
+        a.record(False)
+        a.ejected_until = 0.0
+        assert balancer.pick() is a
+        a.acquire()
+        a.release(None, error=None)        # The probe was given up, the circuit stays half-open
+        assert a.state == CircuitState.HALF_OPEN
+        assert a.outstanding == 0
+        assert balancer.pick() is a         # And lets the next probe through
+
+    def test_failed_probe_backs_off(self):
+        a = Upstream("http://a", health=HealthPolicy(max_failures=1, ejection_seconds=10))
+        a.record(False)
+        first_ejection = a.ejected_until
+        a.ejected_until = 0.0
+        assert a.is_available(0.0)
+        a.record(False)
+        assert a.state == CircuitState.OPEN
+        assert a.ejections == 2
+        assert a.ejected_until - first_ejection > 9     # 20s instead of 10s
+
+
+class BrokenBody:
+    status_code = 200
+    headers: dict[str, str] = {}
+
+    async def aiter_raw(self):
+        yield b"partial"
+        raise httpx.ReadError("connection reset")
+
+    async def aclose(self):
+        pass
+
+
+class ErrorPage:
+    status_code = 500
+    headers: dict[str, str] = {}
+
+    async def aiter_raw(self):
+        yield b"internal error"
+
+    async def aclose(self):
+        pass
+
+
+class FakeUpstreamClient:
+    def __init__(self, response: type = BrokenBody):
+        self.response = response
+
+    def build_request(self, **kwargs):
+        return kwargs
+
+    async def send(self, request, stream: bool = False):
+        return self.response()
+
+
+class TestForwardOutcome:
+    @pytest.mark.asyncio
+    async def test_failure_mid_body_is_an_error(self):
+        upstream = Upstream("http://a", health=HealthPolicy(passive_ejection=True))
+        balancer = RoundRobinBalancer([upstream])
+        request = Request({"type": "http", "method": "GET", "path": "/x", "query_string": b"", "headers": [], "state": {}})
+        response = await forward_request(request, "http://a", logging.getLogger("test"), FakePool(FakeUpstreamClient()), balancer=balancer)
+        with pytest.raises(httpx.ReadError):
+            async for _ in response.body_iterator:
+                pass
+        await response.aclose()
+        assert upstream.errors == 1
+        assert upstream.consecutive_failures == 1
+        assert upstream.outstanding == 0
+
+    @pytest.mark.asyncio
+    async def test_application_error_is_not_an_upstream_failure(self):
+        upstream = Upstream("http://a", health=HealthPolicy(passive_ejection=True))
+        balancer = RoundRobinBalancer([upstream])
+        request = Request({"type": "http", "method": "GET", "path": "/x", "query_string": b"", "headers": [], "state": {}})
+        response = await forward_request(request, "http://a", logging.getLogger("test"), FakePool(FakeUpstreamClient(ErrorPage)), balancer=balancer)
+        assert response.status_code == 500
+        async for _ in response.body_iterator:
+            pass
+        await response.aclose()
+        assert upstream.errors == 0
+        assert upstream.consecutive_failures == 0
+
+    @pytest.mark.asyncio
+    async def test_application_error_keeps_the_adaptive_limit(self):
+        balancer = create_balancer("round_robin", [("http://a", 1)], adaptive=AdaptivePolicy(algorithm="aimd", initial_limit=10))
+        upstream = balancer.upstreams[0]
+        request = Request({"type": "http", "method": "GET", "path": "/x", "query_string": b"", "headers": [], "state": {}})
+        for _ in range(3):
+            response = await forward_request(request, "http://a", logging.getLogger("test"), FakePool(FakeUpstreamClient(ErrorPage)), balancer=balancer)
+            async for _ in response.body_iterator:
+                pass
+            await response.aclose()
+        assert upstream.adaptive is not None and upstream.adaptive.current == 10
+
+    @pytest.mark.asyncio
+    async def test_spooled_body_closed_without_upstream(self):
+        upstream = Upstream("http://a", health=HealthPolicy(max_failures=1, ejection_seconds=30))
+        balancer = RoundRobinBalancer([upstream])
+        upstream.record(False)
+        body = SpooledRequestBody(max_memory=4)
+        await body.write(b"spilled to disk")
+        request = Request({"type": "http", "method": "POST", "path": "/x", "query_string": b"", "headers": [], "state": {}})
+        with pytest.raises(NoHealthyUpstream):
+            await forward_request(request, "http://a", logging.getLogger("test"), FakePool(FakeUpstreamClient()), body=body, balancer=balancer)
+        assert body._file.closed
+
+
+class FakeHealthClient:
+    def __init__(self, status_code: int | None):
+        self.status_code = status_code
+        self.requested: list[str] = []
+
+    async def get(self, url: str, timeout: float):
+        self.requested.append(url)
+        if self.status_code is None:
+            raise httpx.ConnectError("connection refused")
+        return httpx.Response(self.status_code)
+
+
+class FakePool:
+    timeout = 1.0
+
+    def __init__(self, client: FakeHealthClient):
+        self.client = client
+
+    def get_client(self, target_url: str):
+        return self.client
+
+
+class TestHealthChecker:
+    @pytest.mark.asyncio
+    async def test_failed_checks_eject_upstream(self):
+        client = FakeHealthClient(None)
+        checker = HealthChecker(FakePool(client), logging.getLogger("test"))
+        upstream = Upstream("http://a", health=HealthPolicy(path="/health", max_failures=2))
+        assert not await checker.probe(upstream)
+        assert not await checker.probe(upstream)
+        assert upstream.state == CircuitState.OPEN
+        assert client.requested == ["http://a/health"] * 2
+
+    @pytest.mark.asyncio
+    async def test_passing_check_restores_upstream(self):
+        checker = HealthChecker(FakePool(FakeHealthClient(204)), logging.getLogger("test"))
+        upstream = Upstream("http://a", health=HealthPolicy(path="/health", expected_status=204, max_failures=1))
+        upstream.record(False)
+        assert upstream.state == CircuitState.OPEN
+        assert await checker.probe(upstream)
+        assert upstream.state == CircuitState.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_unexpected_status_is_unhealthy(self):
+        checker = HealthChecker(FakePool(FakeHealthClient(200)), logging.getLogger("test"))
+        upstream = Upstream("http://a", health=HealthPolicy(path="/health", expected_status=204))
+        assert not await checker.probe(upstream)
+        assert upstream.consecutive_failures == 1
+
+
+@pytest.fixture
+def setup_balanced_route(test_client, settings):
+    test_client.auth = (settings.API_USERNAME, settings.API_PASSWORD)
+    response = test_client.put("/admin/routes", json={"routes": {
+        "/api/balanced": {
+            "target_url": "http://localhost:8081",
+            "rate_limit": 1000,
+            "upstreams": [
+                {"url": "http://localhost:8081", "weight": 1},
+                {"url": "http://localhost:8082", "weight": 1},
+            ],
+            "load_balancer": "round_robin",
+        }
+    }})
+    assert response.status_code == 200
+
+
+class TestBalancedRoute:
+    @pytest.fixture(autouse=True)
+    def _setup_routes(self, setup_balanced_route):
+        pass
+
+    def test_requests_spread_over_upstreams(self, test_client: TestClient, monkeypatch):
+        configure_proxy_mock(monkeypatch, {
+            "http://localhost:8081/api/balanced": (200, b"one", {"content-type": "text/plain"}),
+            "http://localhost:8082/api/balanced": (200, b"two", {"content-type": "text/plain"}),
+        })
+        bodies = [test_client.get("/api/balanced/users").content for _ in range(4)]
+        assert bodies == [b"one", b"two", b"one", b"two"]
+
+        response = test_client.get("/admin/upstreams")
+        assert response.status_code == 200
+        route = response.json()["routes"]["/api/balanced"]
+        assert route["load_balancer"] == "round_robin"
+        assert [upstream["requests"] for upstream in route["upstreams"]] == [2, 2]
+        assert all(upstream["outstanding"] == 0 for upstream in route["upstreams"])
+
+    def test_failing_upstream_is_ejected(self, test_client: TestClient, settings, monkeypatch):
+        response = test_client.put("/admin/routes", json={"routes": {
+            "/api/fragile": {
+                "target_url": "http://localhost:8083",
+                "rate_limit": 1000,
+                "upstreams": [
+                    {"url": "http://localhost:8083", "weight": 1},
+                    {"url": "http://localhost:8086", "weight": 1},
+                ],
+                "load_balancer": "round_robin",
+                "health_check": {"max_failures": 2, "ejection_seconds": 60, "passive_ejection": True},
+            }
+        }})
+        assert response.status_code == 200
+        configure_proxy_mock(monkeypatch, {
+            "http://localhost:8083/api/fragile": (502, b"down", {"content-type": "text/plain"}),
+            "http://localhost:8086/api/fragile": (200, b"up", {"content-type": "text/plain"}),
+        })
+        assert [test_client.get("/api/fragile/a").status_code for _ in range(3)] == [502, 200, 502]
+        # Ejected, every request goes to the other upstream
+        assert [test_client.get("/api/fragile/a").status_code for _ in range(3)] == [200, 200, 200]
+
+        upstreams = test_client.get("/admin/upstreams").json()["routes"]["/api/fragile"]["upstreams"]
+        assert [upstream["state"] for upstream in upstreams] == ["open", "closed"]
+        assert upstreams[0]["requests"] == 2
+
+    def test_single_upstream_is_never_ejected_by_requests(self, test_client: TestClient, monkeypatch):
+        response = test_client.put("/admin/routes", json={"routes": {
+            "/api/fragile": {
+                "target_url": "http://localhost:8083",
+                "rate_limit": 1000,
+                "health_check": {"max_failures": 2, "passive_ejection": True},
+            }
+        }})
+        assert response.status_code == 200
+        configure_proxy_mock(monkeypatch, {
+            "http://localhost:8083/api/fragile/broken": (500, b"bug", {"content-type": "text/plain"}),
+            "http://localhost:8083/api/fragile/gateway": (503, b"down", {"content-type": "text/plain"}),
+        })
+        assert [test_client.get("/api/fragile/broken").status_code for _ in range(4)] == [500] * 4
+        assert [test_client.get("/api/fragile/gateway").status_code for _ in range(4)] == [503] * 4
+        upstream = test_client.get("/admin/upstreams").json()["routes"]["/api/fragile"]["upstreams"][0]
+        assert upstream["state"] == "closed"
+        assert upstream["requests"] == 8
+
+    def test_adaptive_limit_reported(self, test_client: TestClient, monkeypatch):
+        response = test_client.put("/admin/routes", json={"routes": {
+            "/api/adaptive": {
+                "target_url": "http://localhost:8084",
+                "rate_limit": 1000,
+                "adaptive_concurrency": {"enabled": True, "algorithm": "aimd", "initial_limit": 4},
+            }
+        }})
+        assert response.status_code == 200
+        configure_proxy_mock(monkeypatch, {
+            "http://localhost:8084/api/adaptive": (503, b"down", {"content-type": "text/plain"}),
+        })
+        assert test_client.get("/api/adaptive/a").status_code == 503
+        upstream = test_client.get("/admin/upstreams").json()["routes"]["/api/adaptive"]["upstreams"][0]
+        assert upstream["concurrency_limit"] == 3   # 4 * 0.9 after the error
+        assert upstream["shed"] == 0
@@ -0,0 +1,246 @@
+import asyncio
+import time
+from typing import Any
+from fastapi.testclient import TestClient
+import httpx
+import pytest
+from src.services.cache.policy import CacheLifetime, CachePolicy, response_lifetime
+from src.services.cache.store import CachedResponse, LRUCache
+from src.services.gateway.rules.cache import CacheRule
+from tests.api.mock_proxy_api import MockAsyncClient, MockStreamResponse
+
+NOW = 1_700_000_000.0
+
+
+class TestResponseLifetime:
+    def test_s_maxage_wins_over_max_age(self):
+        lifetime = response_lifetime(200, {"cache-control": "max-age=10, s-maxage=30"}, CachePolicy(), NOW)
+        assert lifetime is not None and lifetime.ttl == 30
+
+    def test_expires_relative_to_date(self):
+        headers = {
+            "date": "Tue, 14 Nov 2023 22:13:20 GMT",
+            "expires": "Tue, 14 Nov 2023 22:14:20 GMT",
+        }
+        lifetime = response_lifetime(200, headers, CachePolicy(), NOW)
+        assert lifetime is not None and lifetime.ttl == 60
+
+    def test_age_is_subtracted(self):
+        lifetime = response_lifetime(200, {"cache-control": "max-age=60", "age": "20"}, CachePolicy(), NOW)
+        assert lifetime is not None and lifetime.ttl == 40
+
+    @pytest.mark.parametrize("headers", [
+        {"cache-control": "no-store, max-age=60"},
+        {"cache-control": "private, max-age=60"},
+        {"cache-control": "max-age=60", "set-cookie": "a=b"},
+        {"cache-control": "max-age=60", "vary": "*"},
+        {},     # No freshness information, no validator and no default ttl
+    ])
+    def test_not_storable(self, headers: dict[str, str]):
+        assert response_lifetime(200, headers, CachePolicy(), NOW) is None
+
+    def test_route_defaults_and_overrides(self):
+        policy = CachePolicy(default_ttl=5, stale_while_revalidate=10, stale_if_error=20)
+        assert response_lifetime(200, {}, policy, NOW) == CacheLifetime(5, 10, 20)
+        lifetime = response_lifetime(200, {"cache-control": "max-age=1, stale-if-error=300"}, policy, NOW)
+        assert lifetime == CacheLifetime(1, 10, 300)
+        lifetime = response_lifetime(200, {"cache-control": "max-age=1, must-revalidate"}, policy, NOW)
+        assert lifetime == CacheLifetime(1, 0, 0)
+
+    def test_no_cache_kept_for_revalidation(self):
+        lifetime = response_lifetime(200, {"cache-control": "no-cache", "etag": '"v1"'}, CachePolicy(), NOW)
+        assert lifetime is not None and lifetime.ttl == 0
+
+
+def make_entry(body: bytes = b"x", headers: dict[str, str] | None = None) -> CachedResponse:
+    return CachedResponse.create(200, headers or {}, body, CacheLifetime(60, 0, 0), NOW)
+
+
+class TestLRUCache:
+    def test_evicts_least_recently_used_by_size(self):
+        cache = LRUCache(max_bytes=250)
+        cache.set("a", make_entry(b"a" * 100))
+        cache.set("b", make_entry(b"b" * 100))
+        assert cache.get("a") is not None     # a becomes the most recent
+        cache.set("c", make_entry(b"c" * 100))
+        assert cache.get("b") is None
+        assert cache.get("a") is not None and cache.get("c") is not None
+        assert cache.evictions == 1
+        assert cache.size == 200
+
+    def test_oversized_entry_is_refused(self):
+        cache = LRUCache(max_bytes=10)
+        cache.set("a", make_entry(b"a" * 100))
+        assert len(cache) == 0 and cache.size == 0
+
+    def test_serialization_round_trip(self):
+        entry = make_entry(b"\x00binary\nbody", {"etag": '"v1"', "vary": "Accept-Language"})
+        loaded = CachedResponse.loads(entry.dumps())
+        assert loaded == entry
+        assert loaded.vary == ("accept-language",)
+        assert loaded.validators() == {"if-none-match": '"v1"'}
+
+
+class ScriptedUpstream:
+    """Upstream answering each call with the next scripted response, recording the requests"""
+    def __init__(self):
+        self.responses: list[tuple[int, bytes, dict[str, str]]] = []
+        self.requests: list[dict[str, Any]] = []
+
+    def install(self, monkeypatch):
+        upstream = self
+
+        class ScriptedAsyncClient(MockAsyncClient):
+            async def send(self, request: dict[str, Any], stream: bool = False):
+                upstream.requests.append(request)
+                status, content, headers = upstream.responses.pop(0)
+                return MockStreamResponse(status, content, headers)
+
+        monkeypatch.setattr(httpx, "AsyncClient", ScriptedAsyncClient)
+
+
+@pytest.fixture
+def upstream(monkeypatch) -> ScriptedUpstream:
+    upstream = ScriptedUpstream()
+    upstream.install(monkeypatch)
+    return upstream
+
+
+@pytest.fixture
+def admin_auth(settings) -> tuple[str, str]:
+    # Given to admin calls only, requests carrying credentials bypass the cache
+    return settings.API_USERNAME, settings.API_PASSWORD
+
+
+@pytest.fixture
+def setup_cached_route(test_client, admin_auth):
+    # Entries are shared through Redis, start from an empty cache
+    assert test_client.post("/admin/clear", auth=admin_auth).status_code == 200
+    response = test_client.put("/admin/routes", auth=admin_auth, json={"routes": {
+        "/api/cached": {
+            "target_url": "http://localhost:8081",
+            "rate_limit": 1000,
+            "cache": {"enabled": True},
+        }
+    }})
+    assert response.status_code == 200
+
+
+class TestCacheRule:
+    @pytest.fixture(autouse=True)
+    def _setup_routes(self, setup_cached_route):
+        pass
+
+    def test_fresh_response_served_from_cache(self, test_client: TestClient, upstream: ScriptedUpstream, admin_auth):
+        upstream.responses = [(200, b"hello", {"cache-control": "max-age=60", "content-length": "5"})]
+        first = test_client.get("/api/cached/a")
+        assert first.headers["x-cache"] == "MISS"
+        second = test_client.get("/api/cached/a")
+        assert second.content == b"hello"
+        assert second.headers["x-cache"] == "HIT"
+        assert len(upstream.requests) == 1
+
+        cache = test_client.get("/admin/metrics", auth=admin_auth).json()["cache"]
+        assert cache["hits"] == 1
+        assert cache["misses"] == 1
+        assert cache["stores"] == 1
+
+    def test_entries_shared_through_redis(self, test_client: TestClient, upstream: ScriptedUpstream, admin_auth):
+        upstream.responses = [(200, b"shared", {"cache-control": "max-age=60"})]
+        test_client.get("/api/cached/shared")
+        # Another worker only has the Redis tier
+        test_client.app.state.response_cache.clear_local()
+        response = test_client.get("/api/cached/shared")
+        assert response.headers["x-cache"] == "HIT"
+        assert response.content == b"shared"
+        assert test_client.get("/admin/metrics", auth=admin_auth).json()["cache"]["shared_hits"] == 1
+
+    def test_revalidated_with_etag(self, test_client: TestClient, upstream: ScriptedUpstream):
+        upstream.responses = [
+            (200, b"v1 body", {"cache-control": "no-cache", "etag": '"v1"'}),
+            (304, b"", {"cache-control": "no-cache", "etag": '"v1"'}),
+        ]
+        test_client.get("/api/cached/etag")
+        response = test_client.get("/api/cached/etag")
+        assert upstream.requests[1]["headers"]["if-none-match"] == '"v1"'
+        assert response.status_code == 200
+        assert response.content == b"v1 body"
+        assert response.headers["x-cache"] == "REVALIDATED"
+
+    def test_stale_served_on_upstream_error(self, test_client: TestClient, upstream: ScriptedUpstream):
+        upstream.responses = [
+            (200, b"good", {"cache-control": "max-age=0, stale-if-error=60"}),
+            (503, b"down", {}),
+        ]
+        test_client.get("/api/cached/flaky")
+        response = test_client.get("/api/cached/flaky")
+        assert response.status_code == 200
+        assert response.content == b"good"
+        assert response.headers["x-cache"] == "STALE"
+
+    def test_stale_while_revalidate(self, test_client: TestClient, upstream: ScriptedUpstream):
+        upstream.responses = [
+            (200, b"old", {"cache-control": "max-age=0, stale-while-revalidate=60"}),
+            (200, b"new", {"cache-control": "max-age=60"}),
+        ]
+        test_client.get("/api/cached/swr")
+        response = test_client.get("/api/cached/swr")
+        assert response.content == b"old"
+        assert response.headers["x-cache"] == "STALE"
+        assert "x-ratelimit-remaining" in response.headers
+        deadline = time.monotonic() + 2
+        while len(upstream.requests) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # The background revalidation does not act on behalf of the client
+        assert "cookie" not in upstream.requests[1]["headers"]
+        assert upstream.requests[1]["url"] == "http://localhost:8081/api/cached/swr"
+
+    def test_hits_carry_the_client_rate_limit(self, test_client: TestClient, upstream: ScriptedUpstream, admin_auth):
+        test_client.put("/admin/routes", auth=admin_auth, json={"routes": {
+            "/api/cached": {"target_url": "http://localhost:8081", "rate_limit": 3, "cache": {"enabled": True}}
+        }})
+        upstream.responses = [(200, b"hello", {"cache-control": "max-age=60"})]
+        responses = [test_client.get("/api/cached/limited") for _ in range(3)]
+        assert [response.headers["x-cache"] for response in responses] == ["MISS", "HIT", "HIT"]
+        # Not the remaining quota stored with the entry
+        assert [response.headers["x-ratelimit-remaining"] for response in responses] == ["2", "1", "0"]
+        entries = list(test_client.app.state.response_cache.local._entries.values())
+        assert entries and all(entry.header("x-ratelimit-remaining") is None for entry in entries)
+
+    def test_vary_selects_variant(self, test_client: TestClient, upstream: ScriptedUpstream):
+        upstream.responses = [
+            (200, b"english", {"cache-control": "max-age=60", "vary": "Accept-Language"}),
+            (200, b"french", {"cache-control": "max-age=60", "vary": "Accept-Language"}),
+        ]
+        assert test_client.get("/api/cached/i18n", headers={"accept-language": "en"}).content == b"english"
+        assert test_client.get("/api/cached/i18n", headers={"accept-language": "fr"}).content == b"french"
+        response = test_client.get("/api/cached/i18n", headers={"accept-language": "en"})
+        assert response.content == b"english"
+        assert response.headers["x-cache"] == "HIT"
+        assert len(upstream.requests) == 2
+
+    def test_uncacheable_requests_bypass(self, test_client: TestClient, upstream: ScriptedUpstream):
+        upstream.responses = [
+            (200, b"one", {"cache-control": "max-age=60"}),
+            (200, b"two", {"cache-control": "max-age=60"}),
+            (200, b"three", {"cache-control": "max-age=60"}),
+            (200, b"four", {"cache-control": "max-age=60"}),
+            (201, b"created", {}),
+        ]
+        test_client.get("/api/cached/private", headers={"authorization": "Bearer token"})
+        test_client.get("/api/cached/private", headers={"authorization": "Bearer token"})
+        test_client.get("/api/cached/private", headers={"cookie": "session=abc"})
+        response = test_client.get("/api/cached/private", headers={"cookie": "session=abc"})
+        assert response.content == b"four"
+        test_client.post("/api/cached/private", content=b"data")
+        assert len(upstream.requests) == 5
+
+
+@pytest.mark.asyncio
+async def test_close_cancels_revalidations():
+    rule = CacheRule()
+    task = asyncio.create_task(asyncio.sleep(60))
+    rule._revalidating["key"] = task
+    await rule.close()
+    assert task.cancelled()
+    assert not rule._revalidating
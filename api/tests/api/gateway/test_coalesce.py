@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+import httpx
+import pytest
+from src.services.proxy.coalesce import RequestCoalescer
+from tests.api.mock_proxy_api import configure_proxy_mock
+
+
+async def read_body(response: StreamingResponse) -> bytes:
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+class SlowUpstream:
+    """Fetch stub answering after `delay`, with a body streamed in several chunks"""
+    def __init__(
+        self,
+        delay: float = 0.05,
+        chunks: tuple[bytes, ...] = (b"a", b"b", b"c"),
+        error: Exception | None = None,
+        headers: dict[str, str] | None = None
+    ):
+        self.delay = delay
+        self.chunks = chunks
+        self.error = error
+        self.headers = {"x-upstream": "1", **(headers or {})}
+        self.calls = 0
+        self.produced = 0       # Chunks read from the upstream
+        self.closed = False
+
+    async def fetch(self) -> StreamingResponse:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+
+        async def body():
+            try:
+                for chunk in self.chunks:
+                    await asyncio.sleep(0.01)
+                    self.produced += 1
+                    yield chunk
+            finally:
+                self.closed = True
+
+        return StreamingResponse(body(), status_code=200, headers=self.headers)
+
+
+class TestRequestCoalescer:
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_one_call(self):
+        coalescer = RequestCoalescer(logging.getLogger("test"))
+        upstream = SlowUpstream()
+        responses = await asyncio.gather(*(coalescer.forward("key", upstream.fetch, 5.0) for _ in range(20)))
+        bodies = await asyncio.gather(*(read_body(response) for response in responses))
+        assert upstream.calls == 1
+        assert bodies == [b"abc"] * 20
+        assert all(response.headers["x-upstream"] == "1" for response in responses)
+        assert coalescer.joined == 19
+        assert len(coalescer) == 0
+
+    @pytest.mark.asyncio
+    async def test_different_keys_are_not_shared(self):
+        coalescer = RequestCoalescer(logging.getLogger("test"))
+        upstream = SlowUpstream()
+        await asyncio.gather(coalescer.forward("a", upstream.fetch, 5.0), coalescer.forward("b", upstream.fetch, 5.0))
+        assert upstream.calls == 2
+
+    @pytest.mark.asyncio
+    async def test_follower_joining_mid_body_gets_whole_body(self):
+        coalescer = RequestCoalescer(logging.getLogger("test"))
+        upstream = SlowUpstream(delay=0, chunks=(b"1", b"2", b"3", b"4"))
+        leader = await coalescer.forward("key", upstream.fetch, 5.0)
+        iterator = leader.body_iterator.__aiter__()
+        assert await iterator.__anext__() == b"1"
+        follower = await coalescer.forward("key", upstream.fetch, 5.0)
+        assert await read_body(follower) == b"1234"
+        assert upstream.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_follower_gives_up_after_max_wait(self):
+        coalescer = RequestCoalescer(logging.getLogger("test"))
+        slow = SlowUpstream(delay=0.5)
+        fast = SlowUpstream(delay=0, chunks=(b"own",))
+        leader = asyncio.create_task(coalescer.forward("key", slow.fetch, 5.0))
+        await asyncio.sleep(0)
+        follower = await coalescer.forward("key", fast.fetch, 0.05)
+        assert await read_body(follower) == b"own"
+        assert await read_body(await leader) == b"abc"
+
+    @pytest.mark.asyncio
+    async def test_large_body_stops_being_shared(self):
+        coalescer = RequestCoalescer(logging.getLogger("test"))
+        upstream = SlowUpstream(delay=0, chunks=(b"12", b"34", b"56"))
+        leader = await coalescer.forward("key", upstream.fetch, 5.0, max_buffer_size=3)
+        iterator = leader.body_iterator.__aiter__()
+        assert await iterator.__anext__() == b"12"
+        follower = await coalescer.forward("key", upstream.fetch, 5.0, max_buffer_size=3)
+        assert await iterator.__anext__() == b"34"
+        # Past the buffer size, requests no longer join the flight
+        late = await coalescer.forward("key", upstream.fetch, 5.0, max_buffer_size=3)
+        assert upstream.calls == 2
+        assert await read_body(follower) == b"123456"
+        assert await iterator.__anext__() == b"56"
+        assert await read_body(late) == b"123456"
+
+    @pytest.mark.asyncio
+    async def test_upstream_read_at_the_pace_of_the_slowest_reader(self):
+        coalescer = RequestCoalescer(logging.getLogger("test"))
+        upstream = SlowUpstream(delay=0, chunks=tuple(bytes([65 + index]) * 10 for index in range(10)))
+        leader = await coalescer.forward("key", upstream.fetch, 5.0, max_buffer_size=15)
+        iterator = leader.body_iterator.__aiter__()
+        assert await iterator.__anext__() == b"A" * 10
+        await asyncio.sleep(0.2)
+        # A slow client holds the upstream read, instead of the whole body piling up
+        assert upstream.produced <= 3
+        rest = [chunk async for chunk in iterator]
+        assert b"".join(rest) == b"".join(upstream.chunks[1:])
+
+    @pytest.mark.asyncio
+    async def test_upstream_given_up_when_every_reader_left(self):
+        coalescer = RequestCoalescer(logging.getLogger("test"))
+        upstream = SlowUpstream(delay=0, chunks=(b"1" * 10,) * 20)
+        leader = await coalescer.forward("key", upstream.fetch, 5.0, max_buffer_size=5)
+        iterator = leader.body_iterator.__aiter__()
+        await iterator.__anext__()
+        await iterator.aclose()     # The client went away
+        await asyncio.sleep(0.05)
+        assert upstream.closed
+        assert upstream.produced < 20
+        assert not coalescer._tasks
+
+    @pytest.mark.asyncio
+    async def test_followers_of_a_large_response_go_upstream(self):
+        coalescer = RequestCoalescer(logging.getLogger("test"))
+        upstream = SlowUpstream(headers={"content-length": "3"})
+        responses = await asyncio.gather(*(coalescer.forward("key", upstream.fetch, 5.0, max_buffer_size=2) for _ in range(3)))
+        bodies = await asyncio.gather(*(read_body(response) for response in responses))
+        assert bodies == [b"abc"] * 3
+        assert upstream.calls == 3
+        assert coalescer.joined == 0
+
+    @pytest.mark.asyncio
+    async def test_upstream_error_raised_to_every_request(self):
+        coalescer = RequestCoalescer(logging.getLogger("test"))
+        upstream = SlowUpstream(error=httpx.RequestError("boom"))
+        results = await asyncio.gather(
+            *(coalescer.forward("key", upstream.fetch, 5.0) for _ in range(3)),
+            return_exceptions=True
+        )
+        assert upstream.calls == 1
+        assert all(isinstance(result, httpx.RequestError) for result in results)
+
+
+@pytest.fixture
+def setup_coalesced_route(test_client, settings):
+    test_client.auth = (settings.API_USERNAME, settings.API_PASSWORD)
+    response = test_client.put("/admin/routes", json={"routes": {
+        "/api/coalesced": {
+            "target_url": "http://localhost:8081",
+            "rate_limit": 1000,
+            "coalesce": {"enabled": True, "vary_headers": ["Accept-Language"], "max_wait": 2},
+        }
+    }})
+    assert response.status_code == 200
+    assert response.json()["routes"]["/api/coalesced"]["coalesce"]["vary_headers"] == ["Accept-Language"]
+
+
+class TestCoalescedRoute:
+    @pytest.fixture(autouse=True)
+    def _setup_routes(self, setup_coalesced_route):
+        pass
+
+    def test_response_relayed_through_flight(self, test_client: TestClient, monkeypatch):
+        configure_proxy_mock(monkeypatch, {
+            "http://localhost:8081/api/coalesced": (200, b"x" * 5000, {"content-type": "text/plain", "content-length": "5000"}),
+        })
+        response = test_client.get("/api/coalesced/items")
+        assert response.status_code == 200
+        assert response.content == b"x" * 5000
+        assert response.headers["content-length"] == "5000"
+        assert test_client.app.state.request_coalescer.flights == 1
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import uuid
+from fastapi.testclient import TestClient
+import pytest
+import pytest_asyncio
+from redis.asyncio import Redis
+from src.services.gateway.config_service import get_route_table
+from src.services.rate_limit.concurrency import ConcurrencyLimiter, ConcurrencyPolicy, LocalConcurrencyLimiter
+from src.services.rate_limit.keys import route_namespace
+from src.services.storage.sharding import RateLimitRedis
+from tests.api.mock_proxy_api import configure_proxy_mock
+
+
+@pytest_asyncio.fixture
+async def redis(settings):
+    client = Redis.from_url(settings.REDIS_URL)
+    yield client
+    await client.aclose()
+
+
+class TestLocalConcurrencyLimiter:
+    @pytest.mark.asyncio
+    async def test_rejects_when_full(self):
+        limiter = LocalConcurrencyLimiter()
+        assert await limiter.acquire("a", 2, 0)
+        assert await limiter.acquire("a", 2, 0)
+        assert not await limiter.acquire("a", 2, 0)
+        limiter.release("a")
+        assert await limiter.acquire("a", 2, 0)
+        limiter.release("a")
+        limiter.release("a")
+        assert len(limiter) == 0
+
+    @pytest.mark.asyncio
+    async def test_queued_in_arrival_order(self):
+        limiter = LocalConcurrencyLimiter()
+        assert await limiter.acquire("a", 1, 0)
+        order: list[int] = []
+
+        async def wait(index: int):
+            assert await limiter.acquire("a", 1, 1.0)
+            order.append(index)
+            limiter.release("a")
+
+        waiters = [asyncio.create_task(wait(index)) for index in range(3)]
+        await asyncio.sleep(0.01)
+        assert order == []
+        limiter.release("a")
+        await asyncio.gather(*waiters)
+        assert order == [0, 1, 2]
+        assert len(limiter) == 0
+
+    @pytest.mark.asyncio
+    async def test_queue_timeout(self):
+        limiter = LocalConcurrencyLimiter()
+        assert await limiter.acquire("a", 1, 0)
+        assert not await limiter.acquire("a", 1, 0.02)
+        limiter.release("a")
+        assert len(limiter) == 0
+
+
+class TestDistributedConcurrency:
+    @pytest.mark.asyncio
+    async def test_leases_shared_between_nodes(self, redis: Redis):
+        store = RateLimitRedis([redis])
+        nodes = [ConcurrencyLimiter(logging.getLogger("test"), store) for _ in range(2)]
+        policy = ConcurrencyPolicy(limit=2, distributed=True)
+        slots = [(f"rate_limit:test:{uuid.uuid4().hex}:in_flight", 2)]
+
+        first = await nodes[0].acquire(slots, policy)
+        second = await nodes[1].acquire(slots, policy)
+        assert first is not None and second is not None
+        assert await nodes[1].acquire(slots, policy) is None
+        assert len(nodes[0].local) == 0     # Counted in Redis only
+
+        await first.release()
+        await first.release()               # Released once
+        third = await nodes[1].acquire(slots, policy)
+        assert third is not None
+        assert await redis.zcard(slots[0][0]) == 2
+        await second.release()
+        await third.release()
+        assert await redis.zcard(slots[0][0]) == 0
+
+    @pytest.mark.asyncio
+    async def test_lease_of_a_dead_node_expires(self, redis: Redis):
+        limiter = ConcurrencyLimiter(logging.getLogger("test"), RateLimitRedis([redis]))
+        policy = ConcurrencyPolicy(limit=1, distributed=True, lease_seconds=0.05, queue_timeout=0.5)
+        slots = [(f"rate_limit:test:{uuid.uuid4().hex}:in_flight", 1)]
+        assert await limiter.acquire(slots, policy) is not None     # Never released
+        # Queued until the lease expires
+        assert await limiter.acquire(slots, policy) is not None
+
+    @pytest.mark.asyncio
+    async def test_all_or_nothing(self, redis: Redis):
+        limiter = ConcurrencyLimiter(logging.getLogger("test"), RateLimitRedis([redis]))
+        policy = ConcurrencyPolicy(limit=1, per_key_limit=2, distributed=True)
+        client, route = f"rate_limit:test:{uuid.uuid4().hex}", f"rate_limit:test:{uuid.uuid4().hex}"
+        held = await limiter.acquire([(route, 1)], policy)
+        assert held is not None
+        assert await limiter.acquire([(client, 2), (route, 1)], policy) is None
+        # The client slot taken before the route one was found busy is given back
+        assert await redis.zcard(client) == 0
+        assert limiter.rejected == 1
+        await held.release()
+
+
+class TestConcurrencyRule:
+    def configure(self, test_client: TestClient, monkeypatch, coalesce: bool = False, **concurrency) -> None:
+        response = test_client.put(
+            "/admin/routes",
+            auth=(test_client.app.state.settings.API_USERNAME, test_client.app.state.settings.API_PASSWORD),
+            json={"routes": {"/api/slow": {
+                "target_url": "http://localhost:8081",
+                "rate_limit": 0,
+                "concurrency": {"enabled": True, **concurrency},
+                "coalesce": {"enabled": coalesce},
+            }}}
+        )
+        assert response.status_code == 200
+        configure_proxy_mock(monkeypatch, {
+            "http://localhost:8081/api/slow/test": (200, b'{"message": "Success"}', {"content-type": "application/json"})
+        })
+
+    def test_slots_released_after_the_response(self, test_client: TestClient, monkeypatch):
+        self.configure(test_client, monkeypatch, limit=1)
+        limiter: ConcurrencyLimiter = test_client.app.state.concurrency_limiter
+        for _ in range(3):
+            assert test_client.get("/api/slow/test").status_code == 200
+        assert len(limiter.local) == 0
+
+    def test_slots_released_after_a_coalesced_response(self, test_client: TestClient, monkeypatch):
+        # Coalesced responses are plain streaming responses replaying the flight
+        self.configure(test_client, monkeypatch, coalesce=True, limit=1)
+        limiter: ConcurrencyLimiter = test_client.app.state.concurrency_limiter
+        for _ in range(3):
+            response = test_client.get("/api/slow/test")
+            assert response.status_code == 200
+            assert response.json() == {"message": "Success"}
+        assert len(limiter.local) == 0
+
+    def test_rejected_when_busy(self, test_client: TestClient, monkeypatch):
+        self.configure(test_client, monkeypatch, limit=1)
+        limiter: ConcurrencyLimiter = test_client.app.state.concurrency_limiter
+        route = get_route_table().resolve("/api/slow/test")
+        assert route is not None
+        key = f"rate_limit:{route_namespace(route.prefix, route.rate_limit_generation)}:in_flight"
+        # A request still in flight holds the only slot
+        assert test_client.portal.call(limiter.local.acquire, key, 1, 0)
+
+        response = test_client.get("/api/slow/test")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert limiter.rejected == 1
+
+        limiter.local.release(key)
+        assert test_client.get("/api/slow/test").status_code == 200
@@ -0,0 +1,61 @@
+import time
+import pytest
+from fastapi.testclient import TestClient
+from redis import Redis
+from src.server import create_server
+from src.services.gateway.config_service import get_route_table
+from src.services.gateway.config_sync import CONFIG_CHANNEL, CONFIG_VERSION_KEY
+from src.settings import Profile
+from tests.conftest import TestSettings
+
+
+@pytest.fixture
+def redis_client(settings):
+    client = Redis.from_url(settings.REDIS_URL)
+    yield client
+    client.close()
+
+@pytest.fixture
+def fast_sync_client():
+    """TestClient checking the config version every 100ms"""
+    app = create_server(TestSettings(Profile.TEST, ROUTE_CONFIG_SYNC_INTERVAL_SECONDS=0.1))
+    with TestClient(app) as client:
+        yield client
+
+def wait_for_version(version: int, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if get_route_table().version == version:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestConfigSync:
+    def test_startup_loads_current_version(self, redis_client: Redis, settings):
+        version = redis_client.incr(CONFIG_VERSION_KEY)
+        app = create_server(TestSettings(Profile.TEST))
+        with TestClient(app):
+            assert get_route_table().version == version
+
+    def test_reload_on_published_change(self, test_client: TestClient, redis_client: Redis):
+        version = redis_client.incr(CONFIG_VERSION_KEY)
+        redis_client.publish(CONFIG_CHANNEL, version)
+        assert wait_for_version(version)
+
+    def test_reload_on_missed_message(self, fast_sync_client: TestClient, redis_client: Redis):
+        # Version bumped without a notification, the periodic check must pick it up
+        version = redis_client.incr(CONFIG_VERSION_KEY)
+        assert wait_for_version(version)
+
+    def test_admin_write_bumps_version(self, test_client: TestClient, redis_client: Redis, settings):
+        before = int(redis_client.get(CONFIG_VERSION_KEY) or 0)
+        response = test_client.put(
+            "/admin/routes",
+            auth=(settings.API_USERNAME, settings.API_PASSWORD),
+            json={"routes": {"/api/sync": {"target_url": "http://localhost:8081"}}},
+        )
+        assert response.status_code == 200
+        assert int(redis_client.get(CONFIG_VERSION_KEY)) == before + 1
+        assert get_route_table().version == before + 1
+        assert get_route_table().resolve("/api/sync/users") is not None
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+import uuid
+from fastapi.testclient import TestClient
+import pytest
+from src.services.request_tracking.histogram import LatencyHistogram
+from src.services.request_tracking.loop_monitor import EventLoopMonitor
+from src.services.request_tracking.prometheus import MetricFamily, render
+from tests.api.mock_proxy_api import configure_proxy_mock
+
+
+class TestRender:
+    def test_counters_and_label_escaping(self):
+        family = MetricFamily("gateway_requests_total", "counter", "Requests")
+        family.add(3, route='/api/"odd"\\path', code="200")
+        lines = render([family, MetricFamily("gateway_unused", "gauge", "Nothing recorded")]).splitlines()
+        assert lines == [
+            "# HELP gateway_requests_total Requests",
+            "# TYPE gateway_requests_total counter",
+            'gateway_requests_total{route="/api/\\"odd\\"\\\\path",code="200"} 3',
+        ]
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = LatencyHistogram()
+        for seconds in (0.0005, 0.003, 0.003, 0.2, 30.0):
+            histogram.record(seconds)
+        family = MetricFamily("gateway_request_duration_seconds", "histogram", "Latency")
+        family.add(histogram.copy(), route="/api")
+        histogram.record(0.0001)     # Not in the copy
+        text = render([family])
+        assert 'gateway_request_duration_seconds_bucket{route="/api",le="0.001"} 1\n' in text
+        assert 'gateway_request_duration_seconds_bucket{route="/api",le="0.005"} 3\n' in text
+        assert 'gateway_request_duration_seconds_bucket{route="/api",le="0.25"} 4\n' in text
+        assert 'gateway_request_duration_seconds_bucket{route="/api",le="10.0"} 4\n' in text
+        assert 'gateway_request_duration_seconds_bucket{route="/api",le="+Inf"} 5\n' in text
+        assert 'gateway_request_duration_seconds_count{route="/api"} 5\n' in text
+        assert 'gateway_request_duration_seconds_sum{route="/api"} 30.2065\n' in text
+
+    def test_buckets_never_count_values_above_their_bound(self):
+        histogram = LatencyHistogram()
+        # Both in the histogram bucket holding 1ms
+        histogram.record(0.000995)
+        histogram.record(0.001005)
+        family = MetricFamily("gateway_request_duration_seconds", "histogram", "Latency")
+        family.add(histogram, route="/api")
+        text = render([family])
+        assert 'gateway_request_duration_seconds_bucket{route="/api",le="0.001"} 0\n' in text
+        assert 'gateway_request_duration_seconds_bucket{route="/api",le="0.0025"} 2\n' in text
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor_records_lag():
+    monitor = EventLoopMonitor(logging.getLogger(__name__), 0.01)
+    await monitor.start()
+    await asyncio.sleep(0.015)
+    time.sleep(0.05)      # Blocks the loop past the next wakeup
+    await asyncio.sleep(0.03)
+    await monitor.stop()
+    assert monitor.lag.count >= 1
+    assert monitor.lag.max >= 30_000
+
+
+def test_prometheus_endpoint(test_client: TestClient, monkeypatch):
+    settings = test_client.app.state.settings
+    auth = (settings.API_USERNAME, settings.API_PASSWORD)
+    prefix = f"/api/scraped-{uuid.uuid4().hex[:8]}"
+    response = test_client.put("/admin/routes", auth=auth, json={"routes": {
+        prefix: {"target_url": "http://localhost:8085", "rate_limit": 100}
+    }})
+    assert response.status_code == 200
+    configure_proxy_mock(monkeypatch, {
+        f"http://localhost:8085{prefix}/a": (200, b"ok", {"content-type": "text/plain"}),
+    })
+    for _ in range(2):
+        assert test_client.get(f"{prefix}/a").status_code == 200
+
+    assert test_client.get("/admin/metrics/prometheus").status_code == 401
+    response = test_client.get("/admin/metrics/prometheus", auth=auth)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert f'gateway_requests_total{{route="{prefix}",code="200"}} 2\n' in text
+    assert f'gateway_request_duration_seconds_count{{route="{prefix}"}} 2\n' in text
+    assert f'gateway_rate_limit_decisions_total{{route="{prefix}",decision="allowed"}} 2\n' in text
+    assert "# TYPE gateway_redis_call_duration_seconds histogram" in text
+    assert "# TYPE gateway_db_query_duration_seconds histogram" in text
+    assert "# TYPE gateway_event_loop_lag_seconds histogram" in text
@@ -166,4 +166,120 @@ class TestProxyIntegration:
         # Verify 404 response is forwarded correctly
         assert response.status_code == 404
         assert response.content == test_content
-        assert response.headers["content-type"] == "application/json" 
+        assert response.headers["content-type"] == "application/json"
+
+    def test_upstream_client_reused(self, test_client: TestClient, monkeypatch):
+        test_content = b'{"message": "Success from service1"}'
+        responses = {
+            "http://localhost:8081/api/service1/users": (200, test_content, {"content-type": "application/json"})
+        }
+        configure_proxy_mock(monkeypatch, responses)
+
+        for _ in range(3):
+            response = test_client.get("/api/service1/users")
+            assert response.status_code == 200
+
+        pool = test_client.app.state.upstream_pool
+        assert list(pool.stats().keys()) == ["http://localhost:8081"]
+        assert pool.get_client("http://localhost:8081/other") is pool.get_client("http://localhost:8081")
+
+    def test_upstream_pool_stats_endpoint(self, test_client: TestClient, monkeypatch):
+        configure_proxy_mock(monkeypatch, {})
+        test_client.get("/api/service1/users")
+
+        response = test_client.get("/admin/upstreams/pool")
+        assert response.status_code == 200
+        stats = response.json()["upstreams"]["http://localhost:8081"]
+        assert {"connections", "idle", "active", "waiting"} <= stats.keys()
+
+    def test_proxy_streams_large_body(self, test_client: TestClient, monkeypatch):
+        test_content = bytes(range(256)) * 4096  # 1MiB, relayed in 1KiB chunks by the mock
+        test_headers = {
+            "content-type": "application/octet-stream",
+            "content-length": str(len(test_content)),
+            "connection": "keep-alive",
+        }
+        responses = {
+            "http://localhost:8081/api/service1/download": (200, test_content, test_headers)
+        }
+        configure_proxy_mock(monkeypatch, responses)
+
+        response = test_client.get("/api/service1/download")
+
+        assert response.status_code == 200
+        assert response.content == test_content
+        assert response.headers["content-length"] == str(len(test_content))
+        assert "transfer-encoding" not in response.headers
+        assert "connection" not in response.headers
+
+
+@pytest.fixture
+def setup_body_routes(test_client, valid_session_token):
+    test_client.cookies.set("session", valid_session_token)
+    test_routes = {
+        "/api/small": RouteForwardingConfig(
+            target_url="http://localhost:8081",
+            rate_limit=1000,
+            max_body_size=16
+        ),
+        "/api/spooled": RouteForwardingConfig(
+            target_url="http://localhost:8081",
+            rate_limit=1000,
+            max_body_size=1024,
+            buffer_body=True
+        )
+    }
+    update_request = UpdateRouteForwardingRequest(routes=test_routes)
+    response = test_client.put("/admin/routes", json=update_request.model_dump())
+    assert response.status_code == 200
+    return test_routes
+
+
+class TestRequestBodyStreaming:
+    @pytest.fixture(autouse=True)
+    def _setup_routes(self, setup_body_routes):
+        pass
+
+    def upstream_request(self, test_client: TestClient):
+        return test_client.app.state.upstream_pool.get_client("http://localhost:8081").last_request
+
+    def test_body_within_limit_is_forwarded(self, test_client: TestClient, monkeypatch):
+        configure_proxy_mock(monkeypatch, {})
+        response = test_client.post("/api/small/upload", content=b"0123456789")
+        assert response.status_code == 200
+        assert self.upstream_request(test_client)["content"] == b"0123456789"
+
+    def test_announced_body_too_large(self, test_client: TestClient, monkeypatch):
+        configure_proxy_mock(monkeypatch, {})
+        response = test_client.post("/api/small/upload", content=b"x" * 17)
+        assert response.status_code == 413
+        # Rejected from the Content-Length header, before opening the upstream request
+        assert self.upstream_request(test_client) is None
+
+    def test_chunked_body_too_large(self, test_client: TestClient, monkeypatch):
+        configure_proxy_mock(monkeypatch, {})
+        chunks = (b"x" * 8 for _ in range(4))
+        response = test_client.post("/api/small/upload", content=chunks)
+        assert response.status_code == 413
+
+    def test_get_without_body(self, test_client: TestClient, monkeypatch):
+        configure_proxy_mock(monkeypatch, {})
+        response = test_client.get("/api/small/users")
+        assert response.status_code == 200
+        assert self.upstream_request(test_client)["content"] is None
+
+    def test_spooled_body_is_forwarded_with_length(self, test_client: TestClient, monkeypatch):
+        configure_proxy_mock(monkeypatch, {})
+        chunks = (b"y" * 100 for _ in range(5))
+        response = test_client.post("/api/spooled/upload", content=chunks)
+        assert response.status_code == 200
+        upstream_request = self.upstream_request(test_client)
+        assert upstream_request["content"] == b"y" * 500
+        assert upstream_request["headers"]["content-length"] == "500"
+        assert "transfer-encoding" not in upstream_request["headers"]
+
+    def test_spooled_body_too_large(self, test_client: TestClient, monkeypatch):
+        configure_proxy_mock(monkeypatch, {})
+        chunks = (b"y" * 512 for _ in range(3))
+        response = test_client.post("/api/spooled/upload", content=chunks)
+        assert response.status_code == 413
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import uuid
+import pytest
+import pytest_asyncio
+from redis.asyncio import Redis
+from src.services.rate_limit.algorithms import ALGORITHMS, RateLimitResult, StackedLimit, check_stacked
+from src.services.rate_limit.blocked import BlockedClients
+from src.services.rate_limit.hybrid import HybridPolicy, QuotaLeases
+from src.services.rate_limit.keys import namespace_pattern
+from src.services.rate_limit.scripts import GCRA
+from src.services.rate_limit.sweeper import RateLimitSweeper
+from src.services.storage.sharding import RateLimitRedis
+
+
+@pytest_asyncio.fixture
+async def redis(settings):
+    client = Redis.from_url(settings.REDIS_URL)
+    yield client
+    await client.aclose()
+
+
+def unique_key() -> str:
+    return f"rate_limit:test:{uuid.uuid4().hex}"
+
+
+class TestRateLimitAlgorithms:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("name", sorted(ALGORITHMS))
+    async def test_allows_up_to_limit(self, redis: Redis, name: str):
+        algorithm = ALGORITHMS[name]
+        key = unique_key()
+        results = [await algorithm.check(redis, key, limit=3, window=60) for _ in range(4)]
+        assert [result.allowed for result in results] == [True, True, True, False]
+        assert [result.remaining for result in results[:3]] == [2, 1, 0]
+        denied = results[-1]
+        assert denied.remaining == 0
+        assert 0 < denied.retry_after <= 60
+        assert 0 < denied.reset <= 60
+        assert denied.algorithm == name
+
+    @pytest.mark.asyncio
+    async def test_gcra_spreads_requests_over_the_window(self, redis: Redis):
+        key = unique_key()
+        for _ in range(10):
+            await ALGORITHMS["gcra"].check(redis, key, limit=10, window=10)
+        denied = await ALGORITHMS["gcra"].check(redis, key, limit=10, window=10)
+        # One request frees up every window / limit
+        assert not denied.allowed
+        assert denied.retry_after == pytest.approx(1.0, abs=0.05)
+
+    @pytest.mark.asyncio
+    async def test_constant_memory_per_key(self, redis: Redis):
+        gcra_key, counter_key = unique_key(), unique_key()
+        for _ in range(50):
+            await ALGORITHMS["gcra"].check(redis, gcra_key, limit=100, window=60)
+            await ALGORITHMS["sliding_window_counter"].check(redis, counter_key, limit=100, window=60)
+        assert await redis.type(gcra_key) == b"string"
+        assert await redis.hlen(counter_key) <= 2
+        assert 0 < await redis.pttl(gcra_key) <= 60_000
+
+    @pytest.mark.asyncio
+    async def test_script_reloaded_after_flush(self, redis: Redis):
+        await redis.script_flush()
+        result = await ALGORITHMS["gcra"].check(redis, unique_key(), limit=1, window=1)
+        assert result.allowed
+        assert (await redis.script_exists(GCRA.sha)) == [True]
+
+    @pytest.mark.asyncio
+    async def test_stacked_limits_counted_all_or_nothing(self, redis: Redis):
+        route = StackedLimit("route", unique_key(), limit=5, window=60)
+        consumer = StackedLimit("consumer", unique_key(), limit=2, window=60)
+        decided, result = await check_stacked(redis, [route, consumer])
+        assert result.allowed and decided is consumer and result.remaining == 1
+        await check_stacked(redis, [route, consumer])
+        decided, result = await check_stacked(redis, [route, consumer])
+        assert not result.allowed and decided is consumer
+        assert result.policy == "consumer"
+        assert 0 < result.retry_after <= 30
+        # The denied request was not counted against the route limit
+        _, result = await check_stacked(redis, [route])
+        assert result.remaining == 2
+
+
+class TestQuotaLeases:
+    @pytest.mark.asyncio
+    async def test_local_requests_cut_redis_traffic(self, redis: Redis):
+        leases = QuotaLeases(logging.getLogger(__name__))
+        policy = HybridPolicy(lease_fraction=0.05)
+        key = unique_key()
+        for _ in range(1000):
+            assert (await leases.check(redis, key, limit=10_000, window=60, policy=policy)).allowed
+        await asyncio.sleep(0)
+        # Leases of 500 requests, refilled when half spent
+        assert leases.lease_calls <= 1000 // 100
+        assert leases.local_hits >= 990
+
+    @pytest.mark.asyncio
+    async def test_never_allows_more_than_the_limit(self, redis: Redis):
+        policy = HybridPolicy(lease_fraction=0.2, strict_fraction=0.2)
+        workers = [QuotaLeases(logging.getLogger(__name__)) for _ in range(3)]
+        key = unique_key()
+        results = await asyncio.gather(*[
+            workers[index % 3].check(redis, key, limit=50, window=60, policy=policy) for index in range(80)
+        ])
+        assert sum(result.allowed for result in results) == 50
+        denied = next(result for result in results if not result.allowed)
+        assert 0 < denied.retry_after <= 60
+
+    @pytest.mark.asyncio
+    async def test_strict_near_the_limit(self, redis: Redis):
+        leases = QuotaLeases(logging.getLogger(__name__))
+        policy = HybridPolicy(lease_fraction=0.1, strict_fraction=0.5)
+        key = unique_key()
+        # Another worker already spent most of the limit
+        for _ in range(70):
+            await ALGORITHMS["gcra"].check(redis, key, limit=100, window=60)
+        for _ in range(15):
+            await leases.check(redis, key, limit=100, window=60, policy=policy)
+        # A first lease of 10 tells that 20 are left, then a Redis call per request
+        assert leases.lease_calls == 1 + 5
+
+    @pytest.mark.asyncio
+    async def test_expired_lease_is_given_back(self, redis: Redis):
+        leases = QuotaLeases(logging.getLogger(__name__))
+        policy = HybridPolicy(lease_fraction=0.5, strict_fraction=0.01)
+        key = unique_key()
+        await leases.check(redis, key, limit=10, window=0.2, policy=policy)
+        await asyncio.sleep(0.15)
+        # The 4 unused tokens are refunded before leasing again
+        result = await leases.check(redis, key, limit=10, window=0.2, policy=policy)
+        assert result.allowed
+        assert result.remaining >= 8
+
+
+def denial(retry_after: float) -> RateLimitResult:
+    return RateLimitResult(False, 10, 0, retry_after, retry_after, 60, "gcra")
+
+
+class TestBlockedClients:
+    @pytest.mark.asyncio
+    async def test_blocked_until_retry_after(self):
+        blocked = BlockedClients()
+        blocked.block("a", denial(0.1))
+        first = blocked.get("a")
+        assert first is not None and 0 < first.retry_after <= 0.1
+        await asyncio.sleep(0.05)
+        second = blocked.get("a")
+        assert second is not None and second.retry_after < first.retry_after
+        await asyncio.sleep(0.06)
+        assert blocked.get("a") is None
+        assert len(blocked) == 0
+        assert blocked.rejections == 2
+
+    def test_bounded(self):
+        blocked = BlockedClients(max_keys=2)
+        for key in ("a", "b", "c"):
+            blocked.block(key, denial(60))
+        assert blocked.get("a") is None
+        assert blocked.get("b") is not None and blocked.get("c") is not None
+
+    def test_allowed_results_not_cached(self):
+        blocked = BlockedClients()
+        blocked.block("a", RateLimitResult(True, 10, 5, 1, 0, 60, "gcra"))
+        assert blocked.get("a") is None
+
+
+class TestRateLimitSweeper:
+    @pytest.mark.asyncio
+    async def test_unlinks_one_generation(self, redis: Redis):
+        prefix = f"/sweep-{uuid.uuid4().hex}"
+        for index in range(25):
+            await redis.set(f"rate_limit:{prefix}@g1:{{client_ip={index}}}", 1, ex=60)
+        await redis.set(f"rate_limit:{prefix}@g2:{{client_ip=0}}", 1, ex=60)
+        await redis.set(f"rate_limit:{prefix}@g10:{{client_ip=0}}", 1, ex=60)
+
+        sweeper = RateLimitSweeper(RateLimitRedis([redis]), logging.getLogger("test"), batch_size=10)
+        sweeper.schedule(namespace_pattern(prefix, 1))
+        await sweeper.wait()
+        assert sweeper.swept == 25
+        assert [key async for key in redis.scan_iter(match=namespace_pattern(prefix, 1))] == []
+        assert await redis.exists(f"rate_limit:{prefix}@g2:{{client_ip=0}}", f"rate_limit:{prefix}@g10:{{client_ip=0}}") == 2
+        await redis.delete(f"rate_limit:{prefix}@g2:{{client_ip=0}}", f"rate_limit:{prefix}@g10:{{client_ip=0}}")
@@ -0,0 +1,87 @@
+import base64
+import json
+import pytest
+from starlette.requests import Request
+from src.services.rate_limit.keys import (
+    ClientIpKey, JwtClaimKey, LimitSpec, PathSegmentKey, create_extractor, namespace_pattern, route_namespace
+)
+
+
+def make_request(path: str = "/api/items/42", headers: dict[str, str] | None = None, client: str = "10.0.0.1") -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": b"",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        "client": (client, 1234),
+    })
+
+
+def make_jwt(claims: dict) -> str:
+    def encode(part: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip("=")
+    return f"{encode({'alg': 'none'})}.{encode(claims)}.signature"
+
+
+class TestKeyExtractors:
+    @pytest.mark.parametrize("trusted_proxies, client, expected", [
+        ([], "10.0.0.1", "10.0.0.1"),                           # Header ignored
+        (["192.168.0.1"], "10.0.0.1", "10.0.0.1"),              # Not sent by a trusted proxy
+        (["10.0.0.1"], "10.0.0.1", "3.3.3.3"),
+        (["10.0.0.0/8", "3.3.3.3"], "10.0.0.1", "2.2.2.2"),
+        (["10.0.0.0/8", "2.2.2.2", "3.3.3.3"], "10.0.0.1", "1.1.1.1"),
+        (["10.0.0.0/8", "1.1.1.1", "2.2.2.2", "3.3.3.3"], "10.0.0.1", "1.1.1.1"),
+    ])
+    def test_client_ip_trusted_proxies(self, trusted_proxies: list[str], client: str, expected: str):
+        request = make_request(headers={"x-forwarded-for": "1.1.1.1, 2.2.2.2, 3.3.3.3"}, client=client)
+        assert ClientIpKey(trusted_proxies).extract(request) == expected
+
+    def test_client_ip_not_spoofed_through_a_proxy(self):
+        # Addresses the client wrote come before the one the proxy appended
+        request = make_request(headers={"x-forwarded-for": "6.6.6.6, 4.4.4.4"})
+        assert ClientIpKey(["10.0.0.0/8"]).extract(request) == "4.4.4.4"
+
+    def test_jwt_claim(self):
+        request = make_request(headers={"authorization": f"Bearer {make_jwt({'tenant': 'acme'})}"})
+        extractor = JwtClaimKey("tenant")
+        assert extractor.extract(request) == extractor.extract(
+            make_request(headers={"authorization": f"Bearer {make_jwt({'tenant': 'acme', 'sub': 'other'})}"})
+        )
+        assert extractor.extract(make_request(headers={"authorization": "Bearer not-a-jwt"})) is None
+        assert JwtClaimKey("missing").extract(request) is None
+
+    def test_values_are_not_stored_in_clear(self):
+        request = make_request(headers={"x-api-key": "secret-key"})
+        value = create_extractor({"type": "api_key"}).extract(request)
+        assert value is not None and "secret" not in value
+
+    def test_path_segment(self):
+        assert PathSegmentKey(2).extract(make_request()) == PathSegmentKey(0).extract(make_request("/42"))
+        assert PathSegmentKey(3).extract(make_request()) is None
+
+
+class TestLimitSpec:
+    def test_composite_key_and_scope(self):
+        spec = LimitSpec.from_options({
+            "name": "consumer",
+            "limit": 10,
+            "scope": "global",
+            "key": [{"type": "api_key"}, {"type": "client_ip", "trusted_proxies": []}],
+        })
+        key = spec.key(make_request(headers={"x-api-key": "k"}), "/api")
+        assert key is not None and key.startswith("rate_limit:*:consumer:{api_key=")
+        assert key.endswith(":client_ip=10.0.0.1")
+
+    def test_missing_part_skips_the_limit(self):
+        spec = LimitSpec.from_options({"name": "consumer", "limit": 10, "key": [{"type": "api_key"}]})
+        assert spec.key(make_request(), "/api") is None
+
+    def test_route_generation_namespace(self):
+        spec = LimitSpec.from_options({"name": "consumer", "limit": 10, "key": [{"type": "api_key"}]})
+        request = make_request(headers={"x-api-key": "k"})
+        old, new = spec.key(request, route_namespace("/api", 3)), spec.key(request, route_namespace("/api", 4))
+        assert old is not None and old.startswith("rate_limit:/api@g3:consumer:")
+        assert new is not None and new != old
+        # Glob characters of the prefix are matched literally
+        assert namespace_pattern("/api/[v1]*", 3) == "rate_limit:/api/\\[v1\\]\\*@g3:*"
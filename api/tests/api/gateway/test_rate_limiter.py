@@ -190,6 +190,9 @@ class TestRateLimiterIntegration:
             "http://localhost:8081/api/limited/test": (200, test_content, test_headers)
         }
         configure_proxy_mock(monkeypatch, responses)
+        # Behind a proxy, the only peer X-Forwarded-For is read from
+        monkeypatch.setattr(test_client._transport, "client", ("10.0.0.1", 50000))
+        monkeypatch.setattr(test_client.app.state.settings, "RATE_LIMIT_TRUSTED_PROXIES", ["10.0.0.0/8"])
 
         # Make requests up to the limit with first client IP
         headers1 = {"X-Forwarded-For": "1.1.1.1"}
@@ -232,3 +235,136 @@ class TestRateLimiterIntegration:
         for _ in range(5):
             response = test_client.get("/admin/metrics")
             assert response.status_code == 401
+
+    def test_headers_reported_without_extra_redis_calls(self, test_client: TestClient, monkeypatch, settings):
+        time.sleep(settings.RATE_LIMIT_WINDOW_SECONDS)
+        responses = {
+            "http://localhost:8081/api/limited/test": (200, b'{"message": "Success"}', {"content-type": "application/json"})
+        }
+        configure_proxy_mock(monkeypatch, responses)
+        redis = test_client.app.state.redis
+
+        async def fail(*args, **kwargs):
+            raise AssertionError("post_process must reuse the pre_process decision")
+
+        # The old post_process counted the window again
+        monkeypatch.setattr(redis, "zcount", fail)
+        first = test_client.get("/api/limited/test")
+        second = test_client.get("/api/limited/test")
+        assert first.headers["X-RateLimit-Limit"] == "2"
+        assert first.headers["X-RateLimit-Remaining"] == "1"
+        assert second.headers["X-RateLimit-Remaining"] == "0"
+        assert int(second.headers["X-RateLimit-Reset"]) <= settings.RATE_LIMIT_WINDOW_SECONDS
+
+    def test_ietf_headers(self, test_client: TestClient, monkeypatch, settings):
+        time.sleep(settings.RATE_LIMIT_WINDOW_SECONDS)
+        responses = {
+            "http://localhost:8081/api/limited/test": (200, b'{"message": "Success"}', {"content-type": "application/json"})
+        }
+        configure_proxy_mock(monkeypatch, responses)
+        monkeypatch.setattr(test_client.app.state.settings, "RATE_LIMIT_HEADERS", "ietf")
+
+        response = test_client.get("/api/limited/test")
+        assert response.headers["RateLimit-Policy"] == '"route";q=2;w=1'
+        assert response.headers["RateLimit"].startswith('"route";r=1;t=')
+        assert "X-RateLimit-Limit" not in response.headers
+
+        test_client.get("/api/limited/test")
+        response = test_client.get("/api/limited/test")
+        assert response.status_code == 429
+        assert response.headers["RateLimit"].startswith('"route";r=0;t=')
+
+    def test_hybrid_route_spends_leased_quota(self, test_client: TestClient, monkeypatch, valid_auth_header):
+        response = test_client.put(
+            "/admin/routes",
+            headers={"Authorization": valid_auth_header},
+            json={"routes": {"/api/hybrid": {
+                "target_url": "http://localhost:8081",
+                "rate_limit": 1000,
+                "rate_limit_hybrid": {"enabled": True, "lease_fraction": 0.5},
+            }}}
+        )
+        assert response.status_code == 200
+        configure_proxy_mock(monkeypatch, {
+            "http://localhost:8081/api/hybrid/test": (200, b'{"message": "Success"}', {"content-type": "application/json"})
+        })
+
+        for _ in range(20):
+            assert test_client.get("/api/hybrid/test").status_code == 200
+        leases = test_client.app.state.quota_leases
+        assert leases.lease_calls == 1
+        assert leases.local_hits == 20
+
+    def test_blocked_clients_rejected_without_redis(self, test_client: TestClient, monkeypatch, settings):
+        time.sleep(settings.RATE_LIMIT_WINDOW_SECONDS)
+        configure_proxy_mock(monkeypatch, {
+            "http://localhost:8081/api/limited/test": (200, b'{"message": "Success"}', {"content-type": "application/json"})
+        })
+        for _ in range(2):
+            assert test_client.get("/api/limited/test").status_code == 200
+        assert test_client.get("/api/limited/test").status_code == 429
+
+        async def fail(*args, **kwargs):
+            raise AssertionError("blocked clients must not reach Redis")
+
+        monkeypatch.setattr(test_client.app.state.redis, "evalsha", fail)
+        response = test_client.get("/api/limited/test")
+        assert response.status_code == 429
+        assert 1 <= int(response.headers["Retry-After"]) <= settings.RATE_LIMIT_WINDOW_SECONDS
+        assert test_client.app.state.blocked_clients.rejections == 1
+
+    def test_stacked_limits(self, test_client: TestClient, monkeypatch, valid_auth_header):
+        response = test_client.put(
+            "/admin/routes",
+            headers={"Authorization": valid_auth_header},
+            json={"routes": {"/api/stacked": {
+                "target_url": "http://localhost:8081",
+                "rate_limit": 100,
+                "rate_limits": [
+                    {"name": "consumer", "limit": 2, "window": 60, "key": [{"type": "api_key"}]},
+                    {"name": "tenant", "limit": 3, "window": 60, "scope": "global", "key": [{"type": "header", "header": "x-tenant"}]},
+                ],
+            }}}
+        )
+        assert response.status_code == 200
+        configure_proxy_mock(monkeypatch, {
+            "http://localhost:8081/api/stacked/test": (200, b'{"message": "Success"}', {"content-type": "application/json"})
+        })
+
+        alice = {"x-api-key": "alice", "x-tenant": "acme"}
+        for _ in range(2):
+            assert test_client.get("/api/stacked/test", headers=alice).status_code == 200
+        response = test_client.get("/api/stacked/test", headers=alice)
+        assert response.status_code == 429
+        assert response.headers["X-RateLimit-Limit"] == "2"
+
+        # Another consumer of the same tenant only has one request left
+        bob = {"x-api-key": "bob", "x-tenant": "acme"}
+        assert test_client.get("/api/stacked/test", headers=bob).status_code == 200
+        assert test_client.get("/api/stacked/test", headers=bob).status_code == 429
+        # Without an API key nor tenant only the route limit applies
+        assert test_client.get("/api/stacked/test").status_code == 200
+
+    def test_route_update_starts_limits_over(self, test_client: TestClient, monkeypatch, settings, valid_auth_header, test_route_config):
+        time.sleep(settings.RATE_LIMIT_WINDOW_SECONDS)
+        configure_proxy_mock(monkeypatch, {
+            "http://localhost:8081/api/limited/test": (200, b'{"message": "Success"}', {"content-type": "application/json"})
+        })
+        for _ in range(2):
+            assert test_client.get("/api/limited/test").status_code == 200
+        assert test_client.get("/api/limited/test").status_code == 429
+
+        async def fail(*args, **kwargs):
+            raise AssertionError("saving routes must not walk nor delete rate limit keys")
+
+        # Invalidation is a generation bump, the old keys are left to expire
+        redis = test_client.app.state.redis
+        for method in ("scan_iter", "delete", "unlink"):
+            monkeypatch.setattr(redis, method, fail)
+        response = test_client.put(
+            "/admin/routes",
+            headers={"Authorization": valid_auth_header},
+            json={"routes": test_route_config}
+        )
+        assert response.status_code == 200
+        assert test_client.get("/api/limited/test").status_code == 200
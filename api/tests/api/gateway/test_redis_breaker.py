@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from fastapi.testclient import TestClient
+import pytest
+from redis.exceptions import ConnectionError
+from src.services.proxy.balancer import CircuitState
+from src.services.rate_limit.algorithms import StackedLimit
+from src.services.rate_limit.local import LocalRateLimiter
+from src.services.storage.breaker import RedisBreakers, RedisCircuitBreaker, RedisUnavailable
+from tests.api.mock_proxy_api import configure_proxy_mock
+from tests.conftest import TestSettings
+
+
+class FakeRedis:
+    def __init__(self):
+        self.up = False
+
+    async def ping(self):
+        if not self.up:
+            raise ConnectionError("down")
+        return True
+
+
+BREAKER_SETTINGS = TestSettings(
+    REDIS_BREAKER_TIMEOUT_SECONDS=0.05,
+    REDIS_BREAKER_SLOW_SECONDS=0.02,
+    REDIS_BREAKER_MAX_FAILURES=2,
+    REDIS_BREAKER_PROBE_SECONDS=0.01,
+)
+
+
+def make_breaker(redis: FakeRedis) -> RedisCircuitBreaker:
+    return RedisCircuitBreaker(redis, BREAKER_SETTINGS, logging.getLogger(__name__))  # type: ignore[arg-type]
+
+
+class TestRedisCircuitBreaker:
+    @pytest.mark.asyncio
+    async def test_opens_on_errors_and_recovers(self):
+        redis = FakeRedis()
+        breaker = make_breaker(redis)
+
+        async def fail():
+            raise ConnectionError("refused")
+
+        for _ in range(2):
+            with pytest.raises(RedisUnavailable):
+                await breaker.run(fail)
+        assert breaker.is_open and breaker.trips == 1
+
+        calls = 0
+
+        async def succeed():
+            nonlocal calls
+            calls += 1
+
+        # Open: nothing reaches Redis
+        with pytest.raises(RedisUnavailable):
+            await breaker.run(succeed)
+        assert calls == 0
+
+        redis.up = True
+        await asyncio.sleep(0.05)
+        assert breaker.state == CircuitState.CLOSED
+        await breaker.run(succeed)
+        assert calls == 1
+        await breaker.close()
+
+    @pytest.mark.asyncio
+    async def test_latency_is_bounded(self):
+        breaker = make_breaker(FakeRedis())
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        async def slow():
+            await asyncio.sleep(0.03)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        with pytest.raises(RedisUnavailable):
+            await breaker.run(hang)
+        assert loop.time() - started < 0.5
+        # Slow but successful calls count as failures too
+        await breaker.run(slow)
+        assert breaker.is_open
+        await breaker.close()
+
+    @pytest.mark.asyncio
+    async def test_each_shard_trips_and_recovers_on_its_own(self):
+        dead, healthy = FakeRedis(), FakeRedis()
+        healthy.up = True
+        breakers = RedisBreakers([dead, healthy], BREAKER_SETTINGS, logging.getLogger(__name__))  # type: ignore[list-item]
+
+        async def fail():
+            raise ConnectionError("refused")
+
+        async def succeed():
+            return True
+
+        for _ in range(2):
+            with pytest.raises(RedisUnavailable):
+                await breakers.run(dead, fail)  # type: ignore[arg-type]
+        assert breakers.for_client(dead).is_open  # type: ignore[arg-type]
+        assert await breakers.run(healthy, succeed)  # type: ignore[arg-type]
+
+        # The healthy shard answering its pings does not close the dead one's circuit
+        await asyncio.sleep(0.05)
+        assert breakers.for_client(dead).is_open  # type: ignore[arg-type]
+        dead.up = True
+        await asyncio.sleep(0.05)
+        assert not breakers.for_client(dead).is_open  # type: ignore[arg-type]
+        await breakers.close()
+
+
+class TestLocalRateLimiter:
+    def test_stacked_limits_counted_all_or_nothing(self):
+        local = LocalRateLimiter()
+        route = StackedLimit("route", "route", limit=5, window=60)
+        consumer = StackedLimit("consumer", "consumer", limit=2, window=60)
+        results = [local.check([route, consumer])[1] for _ in range(3)]
+        assert [result.allowed for result in results] == [True, True, False]
+        assert results[-1].policy == "consumer"
+        assert local.check([route])[1].remaining == 2
+
+
+@pytest.fixture
+def redis_down(test_client: TestClient, monkeypatch):
+    test_client.post("/admin/clear", auth=(test_client.app.state.settings.API_USERNAME, test_client.app.state.settings.API_PASSWORD))
+
+    async def fail(*args, **kwargs):
+        raise ConnectionError("Redis is down")
+
+    monkeypatch.setattr(test_client.app.state.redis, "evalsha", fail)
+    configure_proxy_mock(monkeypatch, {
+        "http://localhost:8081/api/degraded/test": (200, b'{"message": "Success"}', {"content-type": "application/json"})
+    })
+
+
+def put_route(test_client: TestClient, failure_mode: str):
+    settings = test_client.app.state.settings
+    response = test_client.put(
+        "/admin/routes",
+        auth=(settings.API_USERNAME, settings.API_PASSWORD),
+        json={"routes": {"/api/degraded": {
+            "target_url": "http://localhost:8081",
+            "rate_limit": 2,
+            "rate_limit_failure_mode": failure_mode,
+        }}}
+    )
+    assert response.status_code == 200
+
+
+class TestRedisOutage:
+    def test_local_fallback_keeps_limiting(self, test_client: TestClient, redis_down):
+        put_route(test_client, "local")
+        statuses = [test_client.get("/api/degraded/test").status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
+
+    def test_fail_open(self, test_client: TestClient, redis_down):
+        put_route(test_client, "open")
+        assert all(test_client.get("/api/degraded/test").status_code == 200 for _ in range(5))
+
+    def test_fail_closed(self, test_client: TestClient, redis_down):
+        put_route(test_client, "closed")
+        response = test_client.get("/api/degraded/test")
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
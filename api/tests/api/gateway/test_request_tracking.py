@@ -0,0 +1,161 @@
+import time
+import uuid
+from fastapi.testclient import TestClient
+import pytest
+from starlette.requests import Request
+from src.services.request_tracking.histogram import LatencyHistogram
+from src.services.request_tracking.middleware import RECENT_REQUESTS, RequestTracker
+from src.services.request_tracking.timeseries import MAX_POINTS, MINUTE_BUCKETS, RouteRollups, query
+from tests.api.mock_proxy_api import configure_proxy_mock
+
+
+def make_request(path: str, method: str = "GET") -> Request:
+    return Request({"type": "http", "method": method, "path": path, "query_string": b"", "headers": [], "client": ("10.0.0.1", 1234)})
+
+
+class TestRequestTracker:
+    @pytest.mark.asyncio
+    async def test_counters_and_recent_ring(self):
+        tracker = RequestTracker()
+        path = f"/tracked/{uuid.uuid4().hex}"
+        for index in range(RECENT_REQUESTS + 20):
+            tracker.track_request(make_request(path, "POST" if index % 2 else "GET"), 200 if index % 10 else 500)
+        tracker.track_request(make_request(path), 429, is_rate_limited=True)
+
+        metrics = (await tracker.get_metrics()).routes[path]
+        assert metrics.total_requests == RECENT_REQUESTS + 21
+        assert metrics.error_count == 12
+        assert metrics.rate_limited_count == 1
+        assert metrics.success_count == RECENT_REQUESTS + 8
+        assert metrics.status_codes == {"200": RECENT_REQUESTS + 8, "500": 12, "429": 1}
+
+        recent = metrics.recent_requests
+        assert len(recent) == RECENT_REQUESTS
+        assert recent[-1].status_code == 429 and recent[-1].is_rate_limited
+        assert [metric.timestamp for metric in recent] == sorted(metric.timestamp for metric in recent)
+        assert all(metric.path == path and metric.client_ip == "10.0.0.1" for metric in recent)
+
+
+class TestLatencyHistogram:
+    def test_percentiles_within_bucket_error(self):
+        histogram = LatencyHistogram()
+        for millisecond in range(1, 1001):
+            histogram.record(millisecond / 1000)
+        assert histogram.count == 1000
+        for fraction in (0.5, 0.95, 0.99):
+            assert histogram.percentile(fraction) == pytest.approx(fraction, rel=1 / 32)
+        assert histogram.percentile(1.0) == pytest.approx(1.0)
+        summary = histogram.summary()
+        assert summary.mean_ms == pytest.approx(500.5, rel=1e-3)
+        assert summary.max_ms == pytest.approx(1000)
+
+    def test_merge(self):
+        fast, slow, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for _ in range(90):
+            fast.record(0.001)
+            both.record(0.001)
+        for _ in range(10):
+            slow.record(2.0)
+            both.record(2.0)
+        fast.merge(slow)
+        assert list(fast.counts) == list(both.counts)
+        assert fast.summary() == both.summary()
+        assert fast.percentile(0.5) == pytest.approx(0.001, rel=1 / 32)
+        assert fast.percentile(0.95) == pytest.approx(2.0, rel=1 / 32)
+
+    def test_empty(self):
+        assert LatencyHistogram().summary().p99_ms == 0.0
+
+
+class TestRollups:
+    NOW = 1_700_000_000.0
+
+    def test_per_second_points(self):
+        rollups = RouteRollups()
+        for offset, status in ((0, 200), (0.5, 500), (2, 429), (2.2, 200)):
+            rollups.record(self.NOW + offset, error=status == 500, rate_limited=status == 429, latency=0.01)
+        series = query(rollups, self.NOW, self.NOW + 3, self.NOW + 3, resolution=1)
+        assert series.resolution == 1
+        assert series.timestamps == [int(self.NOW) + offset for offset in range(4)]
+        assert series.requests == [2, 0, 2, 0]
+        assert series.errors == [1, 0, 0, 0]
+        assert series.rate_limited == [0, 0, 1, 0]
+        assert series.mean_latency_ms == [10.0, 0.0, 10.0, 0.0]
+
+    def test_downsampled(self):
+        rollups = RouteRollups()
+        for second in range(600):
+            rollups.record(self.NOW + second, error=False, rate_limited=False, latency=0.001 * (second % 2 + 1))
+        series = query(rollups, self.NOW, self.NOW + 599, self.NOW + 600, resolution=10)
+        assert series.resolution == 10
+        assert len(series.timestamps) == 60
+        assert all(count == 10 for count in series.requests)
+        assert series.mean_latency_ms[0] == pytest.approx(1.5)
+        # Too many points at the requested resolution
+        coarse = query(rollups, self.NOW, self.NOW + 599, self.NOW + 600, resolution=None)
+        assert len(coarse.timestamps) <= MAX_POINTS
+        assert sum(coarse.requests) == 600
+
+    def test_older_ranges_from_minutes(self):
+        rollups = RouteRollups()
+        for minute in range(120):
+            rollups.record(self.NOW + minute * 60, error=minute % 2 == 0, rate_limited=False, latency=0.0)
+        now = self.NOW + 120 * 60
+        series = query(rollups, self.NOW, now, now, resolution=1)
+        assert series.resolution == 60     # Older than the per-second buckets
+        assert sum(series.requests) == 120
+        assert sum(series.errors) == 60
+        hourly = query(rollups, self.NOW, now, now, resolution=3600)
+        assert len(hourly.timestamps) <= 3
+        assert sum(hourly.requests) == 120
+
+    def test_range_clipped_to_the_rollups(self):
+        rollups = RouteRollups()
+        for minute in range(10):
+            rollups.record(self.NOW + minute * 60, error=False, rate_limited=False, latency=0.0)
+        now = self.NOW + 600
+        # Neither far-off bounds nor a huge resolution size the result
+        series = query(rollups, self.NOW - 10**12, now + 10**12, now, resolution=None)
+        assert len(series.timestamps) <= MAX_POINTS
+        assert series.timestamps[-1] <= now
+        assert sum(series.requests) == 10
+        coarse = query(rollups, self.NOW, now, now, resolution=10**12)
+        assert coarse.resolution == MINUTE_BUCKETS * 60
+        assert sum(coarse.requests) == 10
+
+
+class TestMetricsEndpoint:
+    def test_tracks_gateway_requests(self, test_client: TestClient, monkeypatch):
+        settings = test_client.app.state.settings
+        auth = (settings.API_USERNAME, settings.API_PASSWORD)
+        prefix = f"/api/tracked-{uuid.uuid4().hex[:8]}"
+        response = test_client.put("/admin/routes", auth=auth, json={"routes": {
+            prefix: {"target_url": "http://localhost:8085", "rate_limit": 0}
+        }})
+        assert response.status_code == 200
+        configure_proxy_mock(monkeypatch, {
+            f"http://localhost:8085{prefix}/a": (200, b"ok", {"content-type": "text/plain"}),
+        })
+        for _ in range(3):
+            assert test_client.get(f"{prefix}/a").status_code == 200
+
+        routes = test_client.get("/admin/metrics", auth=auth).json()["routes"]
+        metrics = routes[f"{prefix}/a"]
+        assert metrics["total_requests"] == 3
+        assert metrics["status_codes"] == {"200": 3}
+        assert metrics["recent_requests"][0]["timestamp"].endswith("Z")
+
+        assert "latency" not in metrics
+        latency = test_client.get("/admin/metrics", auth=auth).json()["gateway_routes"][prefix]
+        assert latency["total"]["count"] == latency["rules"]["count"] == latency["upstream"]["count"] == 3
+        assert 0 < latency["upstream"]["p99_ms"] <= latency["total"]["max_ms"]
+        upstream = test_client.get("/admin/metrics", auth=auth).json()["upstreams"]["http://localhost:8085"]
+        assert upstream["upstream"]["count"] >= 3
+
+        series = test_client.get("/admin/metrics/timeseries", auth=auth, params={"route": prefix}).json()
+        assert list(series["routes"]) == [prefix]
+        assert series["routes"][prefix]["resolution"] == 5     # An hour in at most 720 points
+        assert sum(series["routes"][prefix]["requests"]) == 3
+        assert test_client.get("/admin/metrics/timeseries", auth=auth, params={"start": 10, "end": 5}).status_code == 400
+        future = time.time() + 3600
+        assert test_client.get("/admin/metrics/timeseries", auth=auth, params={"start": future, "end": future + 60}).status_code == 400
@@ -0,0 +1,39 @@
+from src.services.gateway.route_table import CompiledRoute, RouteTable
+
+
+def make_table(*prefixes: str) -> RouteTable:
+    return RouteTable(
+        CompiledRoute(prefix=prefix, target_url=f"http://upstream{prefix}", rate_limit=60)
+        for prefix in prefixes
+    )
+
+
+class TestRouteTable:
+    def test_exact_match(self):
+        table = make_table("/api/service1", "/api/service2")
+        route = table.resolve("/api/service1")
+        assert route is not None
+        assert route.prefix == "/api/service1"
+
+    def test_longest_prefix_wins(self):
+        table = make_table("/api", "/api/service1", "/api/service1/admin")
+        assert table.resolve("/api/service1/users").prefix == "/api/service1"
+        assert table.resolve("/api/service1/admin/users").prefix == "/api/service1/admin"
+        assert table.resolve("/api/other").prefix == "/api"
+
+    def test_no_match(self):
+        table = make_table("/api/service1")
+        assert table.resolve("/other") is None
+        assert table.resolve("/api/serv") is None
+
+    def test_empty_table(self):
+        table = RouteTable()
+        assert len(table) == 0
+        assert table.resolve("/api/service1") is None
+
+    def test_routes_snapshot_is_a_copy(self):
+        table = make_table("/api/service1")
+        routes = table.routes
+        routes.clear()
+        assert len(table) == 1
+        assert table.resolve("/api/service1/users") is not None
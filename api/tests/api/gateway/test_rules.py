@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import pytest
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+from src.services.gateway.context import RouteContext
+from src.services.gateway.middleware import FinalizedResponse
+from src.services.gateway.route_table import CompiledRoute
+from src.services.gateway.rules.asbtract import Rule, RulePhase
+from tests.conftest import TestSettings
+
+
+def make_request(path: str = "/api/service1/users") -> Request:
+    return Request(
+        scope={
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "headers": [(b"host", b"example.com")],
+            "query_string": b"",
+        }
+    )
+
+def make_context() -> RouteContext:
+    return RouteContext.from_route(
+        CompiledRoute(prefix="/api/service1", target_url="http://localhost:8081", rate_limit=60)
+    )
+
+
+class LegacyRule(Rule):
+    """Rule written against the signature without a route context"""
+    def __init__(self):
+        super().__init__("legacy", RulePhase.BOTH)
+        self.calls: list[str] = []
+
+    async def pre_process(self, request, settings, logger):
+        self.calls.append("pre")
+        return None
+
+    async def post_process(self, request, response, settings, logger):
+        self.calls.append("post")
+        return response
+
+
+class ContextRule(Rule):
+    def __init__(self):
+        super().__init__("context", RulePhase.BOTH)
+        self.contexts: list[RouteContext | None] = []
+
+    async def pre_process(self, request, settings, logger, context=None):
+        self.contexts.append(context)
+        context.state["seen"] = True
+        return None
+
+    async def post_process(self, request, response, settings, logger, context=None):
+        self.contexts.append(context)
+        return response
+
+
+class TestRuleContext:
+    @pytest.mark.asyncio
+    async def test_legacy_rule_still_called(self):
+        rule = LegacyRule()
+        response = Response()
+        assert await rule.run_pre_process(make_request(), TestSettings(), logging.getLogger("test"), make_context()) is None
+        assert await rule.run_post_process(make_request(), response, TestSettings(), logging.getLogger("test"), make_context()) is response
+        assert rule.calls == ["pre", "post"]
+
+    @pytest.mark.asyncio
+    async def test_context_shared_between_phases(self):
+        rule = ContextRule()
+        context = make_context()
+        await rule.run_pre_process(make_request(), TestSettings(), logging.getLogger("test"), context)
+        await rule.run_post_process(make_request(), Response(), TestSettings(), logging.getLogger("test"), context)
+        assert rule.contexts == [context, context]
+        assert context.state["seen"] is True
+
+
+async def chunks():
+    yield b"a"
+    yield b"b"
+
+
+async def never_disconnects():
+    await asyncio.Event().wait()
+
+
+class TestFinalizedResponse:
+    @pytest.mark.asyncio
+    async def test_finalized_once_the_body_is_sent(self):
+        context = make_context()
+        calls = []
+
+        async def finalizer():
+            calls.append("finalized")
+        context.finalizers.append(finalizer)
+
+        async def send(message):
+            # Still sending, the finalizers wait
+            assert "finalized" not in calls
+            calls.append(message["type"])
+
+        response = FinalizedResponse(StreamingResponse(chunks()), context)
+        await response({"type": "http", "asgi": {"spec_version": "2.4"}}, never_disconnects, send)
+        assert calls == ["http.response.start", "http.response.body", "http.response.body", "http.response.body", "finalized"]
+
+    @pytest.mark.asyncio
+    async def test_finalized_when_the_client_is_gone(self):
+        context = make_context()
+        calls = []
+
+        async def finalizer():
+            calls.append("finalized")
+        context.finalizers.append(finalizer)
+
+        async def send(message):
+            raise OSError("client disconnected")
+
+        response = FinalizedResponse(StreamingResponse(chunks()), context)
+        with pytest.raises(ClientDisconnect):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, never_disconnects, send)
+        assert calls == ["finalized"]
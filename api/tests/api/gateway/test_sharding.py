@@ -0,0 +1,69 @@
+import uuid
+import pytest
+import pytest_asyncio
+from redis.asyncio import Redis
+from src.services.gateway.rules.rate_limiter import RateLimiter
+from src.services.rate_limit.algorithms import StackedLimit
+from src.services.storage.sharding import HashRing, RateLimitRedis, hash_tag, tagged
+
+
+class TestHashRing:
+    def test_hash_tag(self):
+        assert hash_tag(f"rate_limit:/api:consumer:{tagged('api_key=abc')}:client_ip=1") == "api_key=abc"
+        assert hash_tag("rate_limit:{}:x") == "rate_limit:{}:x"     # Empty tags do not count
+        assert hash_tag("plain") == "plain"
+
+    def test_spread_and_stability(self):
+        tags = [f"client_ip=10.0.{index // 256}.{index % 256}" for index in range(4000)]
+        three = HashRing(3)
+        counts = [0, 0, 0]
+        for tag in tags:
+            counts[three.shard_for(tag)] += 1
+        assert min(counts) > 4000 / 3 * 0.8
+        # A fourth shard only takes keys over, about a quarter of them
+        four = HashRing(4)
+        moved = [tag for tag in tags if three.shard_for(tag) != four.shard_for(tag)]
+        assert all(four.shard_for(tag) == 3 for tag in moved)
+        assert len(moved) < 4000 * 0.35
+
+
+@pytest_asyncio.fixture
+async def shards(settings):
+    # Two databases of the test server stand in for two instances
+    base = settings.REDIS_URL.rsplit("/", 1)[0]
+    clients = [Redis.from_url(f"{base}/{db}") for db in (1, 2)]
+    yield RateLimitRedis(clients, "sharded")
+    for client in clients:
+        await client.flushdb()
+        await client.aclose()
+
+
+def limits_on_two_shards(store: RateLimitRedis) -> tuple[StackedLimit, StackedLimit]:
+    keys: dict[int, str] = {}
+    while len(keys) < 2:
+        key = f"rate_limit:test:{tagged(uuid.uuid4().hex)}"
+        keys.setdefault(store.clients.index(store.client_for(key)), key)
+    return StackedLimit("route", keys[0], limit=5, window=60), StackedLimit("consumer", keys[1], limit=1, window=60)
+
+
+class TestShardedRateLimits:
+    @pytest.mark.asyncio
+    async def test_stacked_limits_across_shards(self, shards: RateLimitRedis):
+        route, consumer = limits_on_two_shards(shards)
+        assert len(shards.group([route.key, consumer.key])) == 2
+        limiter = RateLimiter(shards.clients[0], store=shards)
+        assert (await limiter.check_stacked([route, consumer])).allowed
+        denied = await limiter.check_stacked([route, consumer])
+        assert not denied.allowed and denied.policy == "consumer"
+        # The route shard counted the denied request then gave it back
+        result = await limiter.check_stacked([route])
+        assert result.remaining == 3
+
+    @pytest.mark.asyncio
+    async def test_keys_stay_on_their_shard(self, shards: RateLimitRedis):
+        route, _ = limits_on_two_shards(shards)
+        await RateLimiter(shards.clients[0], store=shards).check_stacked([route])
+        owner = shards.client_for(route.key)
+        other = next(client for client in shards.clients if client is not owner)
+        assert await owner.exists(route.key) == 1
+        assert await other.exists(route.key) == 0
@@ -0,0 +1,121 @@
+import logging
+import multiprocessing
+from pathlib import Path
+from fastapi.testclient import TestClient
+import pytest
+from src.services.request_tracking.aggregation import RedisMetricsAggregator, RouteTotals
+from src.services.request_tracking.histogram import LatencyHistogram
+from src.services.request_tracking.shared_memory import SharedMetrics, SharedMetricsUnavailable
+
+LOGGER = logging.getLogger(__name__)
+
+
+def open_segment(path: Path, max_workers: int = 4, max_routes: int = 8) -> SharedMetrics:
+    return SharedMetrics(str(path), max_workers, max_routes, LOGGER)
+
+
+def record_in_child(path: str, requests: int) -> None:
+    segment = SharedMetrics(path, 4, 8, LOGGER)
+    for _ in range(requests):
+        segment.record("/api/child", 200, False, 0.002)
+    segment.record("/api/shared", 500, False, 0.004)
+    segment.close()
+
+
+class TestSharedMetrics:
+    def test_stripes_add_up(self, tmp_path: Path):
+        first, second = open_segment(tmp_path / "metrics"), open_segment(tmp_path / "metrics")
+        try:
+            assert {first.worker, second.worker} == {0, 1}
+            first.record("/api/a", 200, False, 0.001)
+            first.record("/api/a", 429, True, 0.0005)
+            second.record("/api/a", 502, False, 0.1)
+            second.record("/api/b", 200, False, 0.002)
+
+            workers, routes = first.read()
+            assert workers == 2
+            a = routes["/api/a"]
+            assert (a.requests, a.success, a.errors, a.rate_limited) == (3, 1, 1, 1)
+            assert a.latency.count == 3
+            assert a.latency.max == 100_000
+            assert a.latency.percentile(0.5) == pytest.approx(0.001, rel=1 / 32)
+            assert routes["/api/b"].requests == 1
+            assert second.read()[1].keys() == routes.keys()
+        finally:
+            first.close()
+            second.close()
+
+    def test_workers_in_other_processes(self, tmp_path: Path):
+        path = tmp_path / "metrics"
+        segment = open_segment(path)
+        try:
+            context = multiprocessing.get_context("fork")
+            children = [context.Process(target=record_in_child, args=(str(path), 5)) for _ in range(2)]
+            for child in children:
+                child.start()
+            for child in children:
+                child.join(10)
+                assert child.exitcode == 0
+            workers, routes = segment.read()
+            # The children gave their stripes back, their counts stay
+            assert workers == 1
+            assert routes["/api/child"].requests == 10
+            assert routes["/api/shared"].errors == 2
+        finally:
+            segment.close()
+
+    def test_full_segment(self, tmp_path: Path):
+        segment = open_segment(tmp_path / "metrics", max_workers=1, max_routes=1)
+        try:
+            with pytest.raises(SharedMetricsUnavailable):
+                open_segment(tmp_path / "metrics", max_workers=1, max_routes=1)
+            segment.record("/api/a", 200, False, 0.001)
+            segment.record("/api/b", 200, False, 0.001)     # No room left, not counted
+            assert list(segment.read()[1]) == ["/api/a"]
+        finally:
+            segment.close()
+
+    def test_reset_without_live_workers(self, tmp_path: Path):
+        segment = open_segment(tmp_path / "metrics")
+        segment.record("/api/a", 200, False, 0.001)
+        segment.close()
+        segment = open_segment(tmp_path / "metrics")
+        try:
+            assert segment.read() == (1, {})
+        finally:
+            segment.close()
+
+
+def test_route_totals_round_trip():
+    latency = LatencyHistogram()
+    for seconds in (0.001, 0.02, 0.3):
+        latency.record(seconds)
+    decoded = RouteTotals.decode(RouteTotals(3, 2, 1, 0, latency).encode())
+    assert (decoded.requests, decoded.success, decoded.errors, decoded.rate_limited) == (3, 2, 1, 0)
+    assert list(decoded.latency.counts) == list(latency.counts)
+    assert decoded.latency.summary() == latency.summary()
+
+
+def test_redis_aggregation(test_client: TestClient):
+    redis = test_client.app.state.redis
+    test_client.portal.call(redis.delete, "metrics:workers")
+    aggregators = []
+    for worker, requests in (("host-a:1", 3), ("host-b:1", 4)):
+        latency = LatencyHistogram()
+        for _ in range(requests):
+            latency.record(0.01)
+        totals = {"/api/agg": RouteTotals(requests, requests, 0, 0, latency)}
+        aggregator = RedisMetricsAggregator(redis, lambda totals=totals: totals, LOGGER, 10.0)
+        aggregator.worker_id = worker
+        test_client.portal.call(aggregator.publish)
+        aggregators.append(aggregator)
+
+    cluster = test_client.portal.call(aggregators[0].read)
+    assert cluster.workers == 2
+    assert cluster.routes["/api/agg"].total_requests == 7
+    assert cluster.routes["/api/agg"].latency.count == 7
+
+    settings = test_client.app.state.settings
+    auth = (settings.API_USERNAME, settings.API_PASSWORD)
+    # Not enabled on the test server
+    assert test_client.get("/admin/metrics", auth=auth, params={"cluster": "true"}).status_code == 400
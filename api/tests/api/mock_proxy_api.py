@@ -8,14 +8,23 @@ import logging
 from urllib.parse import urljoin
 
 class MockStreamResponse:
-    def __init__(self, status_code: int, content: bytes, headers: dict[Any, Any] | None = None):
+    def __init__(self, status_code: int, content: bytes, headers: dict[Any, Any] | None = None, chunk_size: int = 1024):
         self.status_code = status_code
         self._content = content
         self.headers = headers or {}
+        self.chunk_size = chunk_size
+        self.is_closed = False
 
     async def aread(self):
         return self._content
 
+    async def aiter_raw(self):
+        for start in range(0, len(self._content), self.chunk_size):
+            yield self._content[start:start + self.chunk_size]
+
+    async def aclose(self):
+        self.is_closed = True
+
 class MockAsyncClient:
     def __init__(self, *args, **kwargs):
         self.responses = {}
@@ -23,21 +32,28 @@ class MockAsyncClient:
         
     async def aclose(self):
         pass
-        
-    async def request(
+
+    def build_request(
         self,
         method: str,
         url: str,
         headers: dict[Any, Any] | None = None,
-        content: bytes | None = None,
+        content: Any = None,
         timeout: float | None = None
     ):
-        self.last_request = {
+        return {
             'method': method,
             'url': url,
             'headers': headers,
             'content': content
         }
+
+    async def send(self, request: dict[str, Any], stream: bool = False):
+        # Consume streamed bodies like the real client does while sending
+        if hasattr(request['content'], '__aiter__'):
+            request['content'] = b"".join([chunk async for chunk in request['content']])
+        self.last_request = request
+        url = request['url']
         
         # Check if the exact URL is in responses
         if url in self.responses:
@@ -50,6 +66,16 @@ class MockAsyncClient:
         
         # Default response if no mock configured
         return MockStreamResponse(200, b"Default response", {"content-type": "text/plain"})
+        
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: dict[Any, Any] | None = None,
+        content: bytes | None = None,
+        timeout: float | None = None
+    ):
+        return await self.send(self.build_request(method, url, headers, content, timeout))
 
 def configure_proxy_mock(monkeypatch: MonkeyPatch, responses: dict[Any, Any] | None = None):
     """Configure mock responses for the proxy service
@@ -106,7 +132,7 @@ async def test_forward_request_success(monkeypatch: MonkeyPatch, mock_logger):
 async def test_forward_request_error(monkeypatch: MonkeyPatch, mock_logger):
     # Configure mock to raise an error
     class ErrorMockAsyncClient(MockAsyncClient):
-        async def request(self, *args, **kwargs):
+        async def send(self, *args, **kwargs):
             raise httpx.RequestError("Connection error")
     
     monkeypatch.setattr(httpx, "AsyncClient", ErrorMockAsyncClient)